@@ -0,0 +1,47 @@
+# Microbenchmark of the portfolio nav history, run it from the stock_service directory:
+#   python benchmark_portfolio_history.py
+# aligns 100 symbols x 10 years of daily closes and computes the nav, cumulative return and drawdown
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from services.portfolio_analytics_service import close_matrix, nav_series
+
+SYMBOLS = 100
+YEARS = 10
+REPEAT = 20
+
+
+def build_histories(symbols: int = SYMBOLS, years: int = YEARS) -> dict:
+    rng = np.random.default_rng(42)
+    business_days = pd.bdate_range(end="2025-12-31", periods=252 * years).values.astype("datetime64[D]")
+    histories = {}
+    for i in range(symbols):
+        # a few days missing here and there and some symbols listed later, like the real price files
+        first_day = rng.integers(0, 252 * 2) if i % 10 == 0 else 0
+        dates = business_days[first_day:]
+        dates = dates[rng.random(len(dates)) > 0.01]
+        closes = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, size=len(dates))))
+        histories[f"S{i:03d}"] = {"date": dates, "close": closes}
+    return histories
+
+
+def compute(histories: dict, quantities: np.ndarray) -> dict:
+    dates, symbols, matrix = close_matrix(histories)
+    complete = ~np.isnan(matrix).any(axis=1)
+    first = int(np.argmax(complete))
+    return nav_series(matrix[first:], quantities)
+
+
+def main():
+    histories = build_histories()
+    quantities = np.arange(1, SYMBOLS + 1, dtype=np.float64)
+    series = compute(histories, quantities)
+    print(f"{SYMBOLS} symbols x {YEARS} years, {len(series['nav'])} nav points, best of 5 x {REPEAT} runs")
+    best = min(timeit.repeat(lambda: compute(histories, quantities), number=REPEAT, repeat=5)) / REPEAT
+    print(f"close matrix + nav / return / drawdown: {best * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
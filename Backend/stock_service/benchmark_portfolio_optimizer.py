@@ -0,0 +1,41 @@
+# Microbenchmark of the portfolio optimizer, run it from the stock_service directory:
+#   python benchmark_portfolio_optimizer.py
+# samples the long only efficient frontier of 200 symbols x 3 years of daily returns
+import timeit
+
+import numpy as np
+
+from services.portfolio_optimizer_service import (
+    FRONTIER_POINTS, long_only_portfolios, nearest_psd, unconstrained_portfolios
+)
+
+SYMBOLS = 200
+YEARS = 3
+REPEAT = 3
+
+
+def build_model(symbols: int = SYMBOLS, years: int = YEARS):
+    rng = np.random.default_rng(42)
+    # a few common factors so the covariance looks like a real market, not a diagonal one
+    factors = rng.normal(size=(252 * years, 5))
+    loadings = rng.normal(size=(5, symbols))
+    returns = factors @ loadings * 0.005 + rng.normal(0.0003, 0.02, size=(252 * years, symbols))
+    mean = returns.mean(axis=0) * 252
+    covariance = nearest_psd(np.cov(returns.T) * 252)
+    spread = mean.max() - mean.min()
+    tradeoffs = np.concatenate([[0.0], np.geomspace(1e-3, 1e3, FRONTIER_POINTS - 1) * 2 * np.trace(covariance) / symbols / spread])
+    return mean, covariance, tradeoffs
+
+
+def main():
+    mean, covariance, tradeoffs = build_model()
+    print(f"{SYMBOLS} symbols x {YEARS} years, {FRONTIER_POINTS} frontier points, best of 5 x {REPEAT} runs")
+    best = min(timeit.repeat(lambda: long_only_portfolios(mean, covariance, tradeoffs), number=REPEAT, repeat=5)) / REPEAT
+    print(f"long only frontier: {best * 1e3:.2f} ms")
+    targets = np.linspace(mean.min(), mean.max(), FRONTIER_POINTS)
+    best = min(timeit.repeat(lambda: unconstrained_portfolios(mean, covariance, targets), number=REPEAT, repeat=5)) / REPEAT
+    print(f"closed form frontier (short allowed): {best * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Microbenchmark of the statement parsing, run it from the stock_service directory:
+#   python benchmark_statement_parsing.py
+# compares the vectorized column mapping with the old per quarter loop on a 40 quarter income statement
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from services.stock_service import INCOME_STATEMENT_ITEMS, _statement_columns, _statement_rows
+
+QUARTERS = 40
+REPEAT = 200
+
+
+def build_income_statement(quarters: int = QUARTERS) -> pd.DataFrame:
+    rng = np.random.default_rng(42)
+    columns = pd.date_range(end="2025-12-31", periods=quarters, freq="QE")[::-1]
+    # the items we read and a few dozen others like a real yahoo finance statement
+    items = list(INCOME_STATEMENT_ITEMS.values()) + [f"Other Item {i}" for i in range(40)]
+    values = rng.normal(1e9, 3e8, size=(len(items), quarters))
+    values[items.index("Earnings Per Share")] = rng.normal(2.5, 1.0, size=quarters)
+    values[rng.random(values.shape) < 0.05] = np.nan  # some missing values
+    return pd.DataFrame(values, index=items, columns=columns)
+
+
+# the loop the loaders used before, kept here as the baseline
+def parse_per_quarter(stock_symbol: str, income_statement: pd.DataFrame) -> list:
+    rows = []
+    for quarter, data in income_statement.items():
+        quarter_date = datetime.fromisoformat(str(quarter).split()[0]).date()
+        if data.get("Total Revenue", 0) is None:
+            continue
+        rows.append(dict(
+            stock_symbol=stock_symbol,
+            quarter=quarter_date,
+            revenue=Decimal(data.get("Total Revenue", 0)) if not pd.isna(data.get("Total Revenue", 0)) else None,
+            gross_profit=Decimal(data.get("Gross Profit", 0)) if not pd.isna(data.get("Gross Profit", 0)) else None,
+            operating_income=Decimal(data.get("Operating Income", 0)) if not pd.isna(data.get("Operating Income", 0)) else None,
+            net_profit=Decimal(data.get("Net Income", 0)) if not pd.isna(data.get("Net Income", 0)) else None,
+            eps=float(data.get("Earnings Per Share")) if not pd.isna(data.get("Earnings Per Share", None)) else None,
+            operating_margin=(
+                Decimal(data.get("Operating Income", 0)) / Decimal(data.get("Total Revenue", 1)) * 100
+                if not pd.isna(data.get("Operating Income", 0)) and not pd.isna(data.get("Total Revenue", 1))
+                else None
+            ),
+        ))
+    return rows
+
+
+def parse_vectorized(stock_symbol: str, income_statement: pd.DataFrame) -> list:
+    quarters, columns = _statement_columns(income_statement, INCOME_STATEMENT_ITEMS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns["operating_margin"] = columns["operating_income"] / columns["revenue"] * 100
+    return _statement_rows(stock_symbol, quarters, columns, float_columns=("eps", "operating_margin"))
+
+
+def check_same_rows(old_rows: list, new_rows: list):
+    assert len(old_rows) == len(new_rows)
+    for old, new in zip(old_rows, new_rows):
+        assert old.keys() == new.keys()
+        for column, old_value in old.items():
+            new_value = new[column]
+            if old_value is None or new_value is None or column in ("stock_symbol", "quarter"):
+                assert old_value == new_value, (column, old_value, new_value)
+            else:
+                # the db stores the amounts with two decimals
+                assert abs(float(old_value) - float(new_value)) <= 0.005 + 1e-9 * abs(float(old_value)), (column, old_value, new_value)
+
+
+def main():
+    statement = build_income_statement()
+    check_same_rows(parse_per_quarter("BENCH", statement), parse_vectorized("BENCH", statement))
+
+    print(f"{QUARTERS} quarter income statement, best of 5 x {REPEAT} runs")
+    for name, parse in (("per quarter loop", parse_per_quarter), ("vectorized", parse_vectorized)):
+        best = min(timeit.repeat(lambda: parse("BENCH", statement), number=REPEAT, repeat=5)) / REPEAT
+        print(f"{name:>18}: {best * 1e6:9.1f} us per statement")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from decimal import Decimal
 from datetime import date
 from typing import List, Optional
 from utils.db_context import get_db
 from services.stock_service import StockService
+from services.fundamentals_refresh_service import FundamentalsRefreshJob, fundamentals_refresh_jobs
+from services.performance_snapshot_service import PerformanceSnapshotService
+from services.portfolio_ledger_service import PortfolioLedgerService
+from services.dividend_service import DividendService, dividend_factor_cache
+from services.portfolio_analytics_service import PortfolioAnalyticsService, return_matrix_cache
+from services.portfolio_optimizer_service import PortfolioOptimizerService, frontier_cache
+from services.portfolio_simulation_service import (
+    SIMULATION_MAX_HORIZON_DAYS, SIMULATION_MAX_PATHS, SIMULATION_METHODS, PortfolioSimulationService
+)
 from models.models import Stock, StockPrice, Portfolio, PortfolioHolding
 from models.pydantic_models import *
 from utils.authentication_utils import verify_role # this function checks the token and returns the username if the token is legit
+from utils.quote_cache import info_cache, quote_cache
+from utils.market_data_provider import market_data_provider
 
 
 router = APIRouter(
@@ -17,6 +28,7 @@ router = APIRouter(
 
 
 # ARTIK STOCK PRİCE HAKKINDA DB  ISLEMI YAPMICAZ, DB YE EKLEMEK VE ORDAN CEKMEK YERİNE YAHOO FİNANCE DEN CEKİCEZ
+# price history is sliced from the local price store (utils/price_store.py) which is filled from yahoo finance
 
 # ENDPOİNTS RELATED TO PORTFOLIOS
 
@@ -43,15 +55,236 @@ def get_user_portfolios(user_id: int, db: Session = Depends(get_db)):
     return service.get_user_portfolios(user_id)
 
 # to return holdings in a portfolio : get_portfolio_holdings
-@router.get("/portfolios/{portfolio_id}/holdings", response_model=List[HoldingResponse])
+# every holding comes with its stock name, market cap and sector
+@router.get("/portfolios/{portfolio_id}/holdings", response_model=List[HoldingDetailResponse])
 def get_portfolio_holdings(portfolio_id: int, db: Session = Depends(get_db)):
     service = StockService(db)
-    holdings = service.get_portfolio_holdings(portfolio_id)
+    try:
+        holdings = service.get_portfolio_holdings(portfolio_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     if not holdings:
         raise HTTPException(status_code=404, detail="No holdings found in this portfolio")
     return holdings
 
-# to add a holding to a portfolio with the given id
+# to return the market value, unrealized profit / loss and weights of the holdings, sectors and the whole portfolio
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/valuation
+example output:
+{
+    "portfolio_id": 1,
+    "name": "My Portfolio",
+    "total_market_value": 4725.0,
+    "total_cost_basis": 4000.05,
+    "total_unrealized_pl": 724.95,
+    "total_unrealized_pl_pct": 18.12,
+    "holdings": [
+        {
+            "holding_id": 3,
+            "stock_symbol": "AGHOL",
+            "name": "AG Anadolu Grubu Holding A.S.",
+            "sector_id": 1,
+            "sector": "Conglomerates",
+            "quantity": 15,
+            "average_price": 266.67,
+            "last_price": 315.0,
+            "previous_close": 313.25,
+            "market_value": 4725.0,
+            "cost_basis": 4000.05,
+            "unrealized_pl": 724.95,
+            "unrealized_pl_pct": 18.12,
+            "weight": 1.0
+        }
+    ],
+    "sectors": [
+        {"sector_id": 1, "sector": "Conglomerates", "holdings_count": 1, "market_value": 4725.0, "cost_basis": 4000.05, "unrealized_pl": 724.95, "weight": 1.0}
+    ],
+    "missing_prices": []
+}
+"""
+@router.get("/portfolios/{portfolio_id}/valuation", response_model=PortfolioValuationResponse)
+def get_portfolio_valuation(portfolio_id: int, db: Session = Depends(get_db)):
+    service = StockService(db)
+    try:
+        return service.get_portfolio_valuation(portfolio_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# daily value (nav), cumulative return and drawdown of the current holdings, one year back if no start is given
+# dividends=true reinvests the dividends of the dividends table, so the figures are total returns
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/history?start=2024-01-01&end=2024-12-31
+example output:
+{
+    "portfolio_id": 1,
+    "start": "2024-01-02",
+    "end": "2024-12-31",
+    "symbols": ["AGHOL", "THYAO"],
+    "missing_symbols": [],
+    "dividends_reinvested": false,
+    "total_return": 0.2431,
+    "max_drawdown": -0.1187,
+    "max_drawdown_date": "2024-08-05",
+    "points": [
+        {"date": "2024-01-02", "nav": 12450.5, "cumulative_return": 0.0, "drawdown": 0.0},
+        ...
+    ]
+}
+"""
+@router.get("/portfolios/{portfolio_id}/history", response_model=PortfolioHistoryResponse)
+def get_portfolio_history(portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                          dividends: bool = False, db: Session = Depends(get_db)):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    service = PortfolioAnalyticsService(db)
+    try:
+        return service.get_nav_history(portfolio_id, start, end, reinvest_dividends=dividends)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# dividend income of the portfolio, per payment, stock and year, from the dividends table and the shares held on each date
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/income?start=2023-01-01
+example output:
+{
+    "portfolio_id": 1,
+    "start": "2023-01-01",
+    "end": null,
+    "total_income": 342.5,
+    "by_symbol": [{"stock_symbol": "THYAO", "payments": 2, "income": 342.5}],
+    "by_year": [{"year": 2023, "income": 142.5}, {"year": 2024, "income": 200.0}],
+    "payments": [
+        {"payment_date": "2023-06-01", "stock_symbol": "THYAO", "amount_per_share": 2.85, "quantity": 50, "income": 142.5},
+        ...
+    ]
+}
+"""
+@router.get("/portfolios/{portfolio_id}/income", response_model=PortfolioIncomeResponse)
+def get_portfolio_income(portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_db)):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    service = DividendService(db)
+    try:
+        return service.get_income_report(portfolio_id, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# volatility, beta against bist 100, one day VaR / CVaR and the covariance / correlation of the current holdings
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/risk?start=2024-01-01&confidence=0.99
+example output:
+{
+    "portfolio_id": 1,
+    "start": "2024-01-01",
+    "end": "2025-01-01",
+    "benchmark": "XU100",
+    "observations": 251,
+    "confidence": 0.99,
+    "market_value": 12450.5,
+    "volatility": 0.312,
+    "daily_volatility": 0.0197,
+    "beta": 1.08,
+    "historical": {"var": 0.051, "cvar": 0.063, "var_amount": 634.98, "cvar_amount": 784.38},
+    "parametric": {"var": 0.045, "cvar": 0.052, "var_amount": 560.27, "cvar_amount": 647.43},
+    "holdings": [{"stock_symbol": "AGHOL", "weight": 0.38, "volatility": 0.35, "beta": 0.97}, ...],
+    "missing_symbols": [],
+    "symbols": ["AGHOL", "THYAO"],
+    "covariance": [[0.00049, 0.00021], [0.00021, 0.00061]],
+    "correlation": [[1.0, 0.38], [0.38, 1.0]]
+}
+"""
+@router.get("/portfolios/{portfolio_id}/risk", response_model=PortfolioRiskResponse)
+def get_portfolio_risk(portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                       confidence: float = 0.95, db: Session = Depends(get_db)):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if not 0.5 < confidence < 1:
+        raise HTTPException(status_code=400, detail="confidence must be between 0.5 and 1")
+    service = PortfolioAnalyticsService(db)
+    try:
+        return service.get_risk(portfolio_id, start, end, confidence)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# minimum variance, maximum sharpe and target return weights of the current holdings with a sampled efficient frontier
+# long only by default, allow_short=true uses the closed form solution with short positions
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/optimize?start=2024-01-01&target_return=0.4&risk_free_rate=0.3
+example output:
+{
+    "portfolio_id": 1,
+    "start": "2024-01-01",
+    "end": "2025-01-01",
+    "symbols": ["AGHOL", "THYAO"],
+    "missing_symbols": [],
+    "allow_short": false,
+    "risk_free_rate": 0.3,
+    "expected_returns": {"AGHOL": 0.21, "THYAO": 0.47},
+    "volatilities": {"AGHOL": 0.35, "THYAO": 0.39},
+    "current": {"weights": {"AGHOL": 0.38, "THYAO": 0.62}, "expected_return": 0.37, "volatility": 0.3, "sharpe": 0.23},
+    "min_variance": {"weights": {"AGHOL": 0.56, "THYAO": 0.44}, "expected_return": 0.33, "volatility": 0.29, "sharpe": 0.1},
+    "max_sharpe": {"weights": {"AGHOL": 0.0, "THYAO": 1.0}, "expected_return": 0.47, "volatility": 0.39, "sharpe": 0.44},
+    "target_return": {"weights": {"AGHOL": 0.27, "THYAO": 0.73}, "expected_return": 0.4, "volatility": 0.32, "sharpe": 0.31},
+    "frontier": [{"expected_return": 0.33, "volatility": 0.29, "sharpe": 0.1}, ...]
+}
+"""
+@router.get("/portfolios/{portfolio_id}/optimize", response_model=PortfolioOptimizationResponse)
+def optimize_portfolio(portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                       target_return: Optional[float] = None, risk_free_rate: Optional[float] = None,
+                       allow_short: bool = False, db: Session = Depends(get_db)):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    service = PortfolioOptimizerService(db)
+    try:
+        if risk_free_rate is None:
+            return service.optimize(portfolio_id, start, end, target_return, allow_short=allow_short)
+        return service.optimize(portfolio_id, start, end, target_return, risk_free_rate, allow_short)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# monte carlo projection of the value of the current holdings, percentile bands for every trading day of the horizon
+# method is gbm (correlated geometric brownian motion) or bootstrap (resampled historical days), a seed makes it repeatable
+# percentiles are read from a 512 bin histogram per day, percentile_error is the bound of their relative error
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/simulate?horizon_days=252&paths=100000&method=gbm&seed=42
+example output:
+{
+    "portfolio_id": 1,
+    "start": "2024-01-01",
+    "end": "2025-01-01",
+    "method": "gbm",
+    "horizon_days": 252,
+    "paths": 100000,
+    "seed": 42,
+    "symbols": ["AGHOL", "THYAO"],
+    "missing_symbols": [],
+    "initial_value": 12450.5,
+    "expected_value": 14876.2,
+    "probability_of_loss": 0.27,
+    "bands": [
+        {"day": 1, "date": "2025-01-02", "mean": 12461.3, "p5": 12051.8, "p25": 12283.1, "p50": 12452.0, "p75": 12631.4, "p95": 12874.9, "percentile_error": 0.0006},
+        ...
+    ]
+}
+"""
+@router.get("/portfolios/{portfolio_id}/simulate", response_model=PortfolioSimulationResponse)
+def simulate_portfolio(portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None, horizon_days: int = 252,
+                       paths: int = 10000, method: str = "gbm", seed: Optional[int] = None, db: Session = Depends(get_db)):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if method not in SIMULATION_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(SIMULATION_METHODS)}")
+    if not 0 < horizon_days <= SIMULATION_MAX_HORIZON_DAYS:
+        raise HTTPException(status_code=400, detail=f"horizon_days must be between 1 and {SIMULATION_MAX_HORIZON_DAYS}")
+    if not 0 < paths <= SIMULATION_MAX_PATHS:
+        raise HTTPException(status_code=400, detail=f"paths must be between 1 and {SIMULATION_MAX_PATHS}")
+    service = PortfolioSimulationService(db)
+    try:
+        return service.simulate(portfolio_id, start, end, horizon_days, paths, method, seed)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+# to add a holding to a portfolio with the given id
 @router.post("/portfolios/{portfolio_id}/add/holdings", response_model=HoldingResponse)
 async def add_holding(
     portfolio_id: int,
@@ -66,9 +299,45 @@ async def add_holding(
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
 
-    response = service.add_holding(portfolio_id, holding.symbol, holding.quantity, Decimal(str(holding.price)))
+    try:
+        response = service.add_holding(portfolio_id, holding.symbol, holding.quantity, Decimal(str(holding.price)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return response
 
+# to apply many buy / sell / delete operations to the holdings of a portfolio with one request and one commit
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/holdings/batch
+{
+    "operations": [
+        {"op": "buy", "symbol": "THYAO", "quantity": 10, "price": 290},
+        {"op": "sell", "symbol": "AGHOL", "quantity": 5, "price": 315},
+        {"op": "delete", "symbol": "ORGE"}
+    ],
+    "all_or_nothing": false
+}
+example output:
+{
+    "portfolio_id": 1,
+    "applied": 2,
+    "failed": 1,
+    "results": [
+        {"index": 0, "op": "buy", "symbol": "THYAO", "status": "applied", "error": null, "holding_id": 4, "quantity": 10, "average_price": 290.0},
+        {"index": 1, "op": "sell", "symbol": "AGHOL", "status": "applied", "error": null, "holding_id": 3, "quantity": 10, "average_price": 266.67},
+        {"index": 2, "op": "delete", "symbol": "ORGE", "status": "failed", "error": "The portfolio has no ORGE holding", "holding_id": null, "quantity": null, "average_price": null}
+    ]
+}
+"""
+@router.post("/portfolios/{portfolio_id}/holdings/batch", response_model=HoldingBatchResponse)
+def apply_holding_operations(portfolio_id: int, batch: HoldingBatchRequest, db: Session = Depends(get_db)):
+    service = PortfolioLedgerService(db)
+    if StockService(db).get_portfolio(portfolio_id) is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    try:
+        return service.apply_operations(portfolio_id, [operation.model_dump() for operation in batch.operations], batch.all_or_nothing)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # to update a holding in a portfolio
 @router.put("/portfolios/holdings/decrease/{holding_id}", response_model=HoldingResponse)
 def decrease_holding(
@@ -77,8 +346,13 @@ def decrease_holding(
     db: Session = Depends(get_db)
 ):
     service = StockService(db)
-    # holding.quantity is the quantity to decrease
-    holding_obj = service.decrease_holding(holding_id, holding.quantity)
+    # holding.quantity is the quantity to decrease
+    try:
+        holding_obj = service.decrease_holding(
+            holding_id, holding.quantity, Decimal(str(holding.price)) if holding.price is not None else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not holding_obj:
         raise HTTPException(status_code=404, detail="Holding not found")
     return holding_obj
@@ -92,7 +366,63 @@ def delete_holding(holding_id: int, db: Session = Depends(get_db)):
     return {"message": "Holding deleted successfully"}
 
 
-# only admin or moderator can add stock to the system
+# ENDPOINTS OF THE TRANSACTION LEDGER
+# every buy / sell of the holding endpoints above is also recorded here, dividends and trades in the past are added with this one
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/transactions
+{
+    "symbol": "THYAO",
+    "transaction_type": "sell",
+    "quantity": 5,
+    "price": 312.5,
+    "traded_at": "2025-01-10T14:30:00"
+}
+"""
+@router.post("/portfolios/{portfolio_id}/transactions", response_model=TransactionResponse)
+def record_transaction(portfolio_id: int, transaction: TransactionCreate, db: Session = Depends(get_db)):
+    service = PortfolioLedgerService(db)
+    if StockService(db).get_stock(transaction.symbol) is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    try:
+        recorded, _ = service.record_trade(
+            portfolio_id, transaction.symbol, transaction.transaction_type, transaction.quantity,
+            Decimal(str(transaction.price)), transaction.traded_at
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return recorded
+
+@router.get("/portfolios/{portfolio_id}/transactions", response_model=List[TransactionResponse])
+def get_transactions(portfolio_id: int, symbol: Optional[str] = None, start: Optional[date] = None,
+                     end: Optional[date] = None, db: Session = Depends(get_db)):
+    service = PortfolioLedgerService(db)
+    return service.get_transactions(portfolio_id, symbol, start, end)
+
+# quantity, cost basis, realized profit / loss and dividends of every stock the portfolio traded, at the end of the as_of day
+"""
+example input: http://localhost:8001/api/stocks/portfolios/1/positions?as_of=2025-01-31
+example output:
+{
+    "portfolio_id": 1,
+    "as_of": "2025-01-31",
+    "positions": [
+        {"stock_symbol": "THYAO", "quantity": 10, "average_price": 290.0, "cost_basis": 2900.0, "realized_pl": 112.5, "dividends": 0.0}
+    ],
+    "total_cost_basis": 2900.0,
+    "total_realized_pl": 112.5,
+    "total_dividends": 0.0
+}
+"""
+@router.get("/portfolios/{portfolio_id}/positions", response_model=PortfolioPositionsResponse)
+def get_positions(portfolio_id: int, as_of: Optional[date] = None, db: Session = Depends(get_db)):
+    service = PortfolioLedgerService(db)
+    try:
+        return service.get_position_report(portfolio_id, as_of)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+# only admin or moderator can add stock to the system
 # it takes the stock symbol as input and returns the stock object as output if the stock is successfully added
 # uses yahoo finance for additional info
 @router.post("/", response_model=StockResponse)
@@ -129,15 +459,44 @@ example output:
     ...
 }
 """
+# the info may be served from the cache while it is refreshed in the background, X-Data-Age tells how old it is in seconds
 @router.get("/{symbol}/info")
-def get_stock_info(symbol: str, db: Session = Depends(get_db)):
+def get_stock_info(symbol: str, response: Response, db: Session = Depends(get_db)):
     service = StockService(db)
-    stock_info = service.get_stock_info(symbol)
+    stock_info, age = service.get_stock_info_with_age(symbol)
+    response.headers["X-Data-Age"] = str(int(age))
     if not stock_info:
         raise HTTPException(status_code=404, detail="Stock info not found")
     return stock_info
 
 
+# daily price return and total return (dividends reinvested) of a stock, the whole history if no start / end is given
+"""
+example input: http://localhost:8001/api/stocks/THYAO/total-return?start=2024-01-01
+example output:
+{
+    "stock_symbol": "THYAO",
+    "start": "2024-01-02",
+    "end": "2025-01-03",
+    "price_return": 0.21,
+    "total_return": 0.245,
+    "dividends": 10.13,
+    "points": [
+        {"date": "2024-01-02", "close": 255.0, "adjusted_close": 242.61, "dividend": 0.0, "price_return": 0.0, "total_return": 0.0},
+        ...
+    ]
+}
+"""
+@router.get("/{symbol}/total-return", response_model=TotalReturnResponse)
+def get_stock_total_return(symbol: str, start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_db)):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    service = DividendService(db)
+    try:
+        return service.get_total_return(symbol, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 # To get the recent stock price of a stock
 """
 example input: http://localhost:8001/api/stocks/AAPL/price
@@ -161,6 +520,30 @@ def get_current_stock_price(symbol: str, db: Session = Depends(get_db)):
     )
 
 
+# To get the last price, previous close and sector of many stocks with one request
+"""
+example input: http://localhost:8001/api/stocks/quotes
+{
+    "symbols": ["AGHOL", "THYAO"]
+}
+example output:
+[
+    {
+        "stock_symbol": "AGHOL",
+        "last_price": 315.0,
+        "previous_close": 313.25,
+        "sector_id": 1,
+        "sector": "Conglomerates"
+    },
+    ...
+]
+"""
+@router.post("/quotes", response_model=List[QuoteResponse])
+def get_quotes(request: QuotesRequest, db: Session = Depends(get_db)):
+    stock_service = StockService(db)
+    return stock_service.get_quotes(request.symbols)
+
+
 # To get the stock prices for a given stock symbol and date range
 """
 example input: 
@@ -221,6 +604,37 @@ def get_predefined_stock_prices(symbol: str, db: Session = Depends(get_db)):
     
     return response
 
+# price points and returns of the predefined periods for many stocks in one response
+# stocks whose history could not be loaded are left out and listed in the X-Failed-Symbols header
+"""
+Example request body (no symbols -> all stocks):
+{
+    "symbols": ["THYAO", "ASELS"]
+}
+Example response:
+[
+    {
+        "stock_symbol": "THYAO",
+        "date": "2025-01-24",
+        "close_price": 315.0,
+        "periods": {
+            "1W": {"date": "2025-01-17", "close_price": 309.0, "return_pct": 1.94},
+            "1M": {"date": "2024-12-26", "close_price": 300.5, "return_pct": 4.83},
+            ...
+            "5Y": {"date": "2020-01-27", "close_price": 19.26, "return_pct": 1535.57}
+        }
+    },
+    ...
+]
+"""
+@router.post("/period-returns", response_model=List[PeriodReturnsResponse])
+def get_period_returns(request: PeriodReturnsRequest, response: Response, db: Session = Depends(get_db)):
+    stock_service = StockService(db)
+    rows, failed_symbols = stock_service.get_predefined_period_returns(request.symbols)
+    if failed_symbols:
+        response.headers["X-Failed-Symbols"] = ",".join(failed_symbols)
+    return rows
+
 # Retrieve the income statement data for a given stock symbol
 # Endpoint to return all financial data for a given stock symbol
 @router.get("/financials/{symbol}", response_model=List[IncomeStatementResponse])
@@ -304,38 +718,116 @@ def get_cash_flow_data(symbol: str, db: Session = Depends(get_db)):
 def add_income_statement_to_db(request: IncomeStatementRequest, db: Session = Depends(get_db)):
     stock_service = StockService(db)
     print("request.stock_symbol", request.stock_symbol)
-    stock_service.add_income_statement(request.stock_symbol)
+    counts = stock_service.add_income_statement(request.stock_symbol)
     
-    # return a success message
-    return {"message": "Income statement added successfully"}
+    # return a success message with the number of inserted, updated and unchanged quarters
+    return {"message": "Income statement added successfully", "quarters": counts}
 
 # ENDPOINT FOR ADDING BALANCE SHEET DATA TO DB
 @router.post("/add-balance-sheet")
 def add_balance_sheet_to_db(request: BalanceSheetRequest, db: Session = Depends(get_db)):
     stock_service = StockService(db)
-    stock_service.add_balance_sheet(request.stock_symbol)
+    counts = stock_service.add_balance_sheet(request.stock_symbol)
     
-    # return a success message
-    return {"message": "Balance sheet added successfully"}
+    # return a success message with the number of inserted, updated and unchanged quarters
+    return {"message": "Balance sheet added successfully", "quarters": counts}
 
 # ENDPOINT FOR ADDING CASH FLOW DATA TO DB
 @router.post("/add-cash-flow")
 def add_cash_flow_to_db(request: CashFlowRequest, db: Session = Depends(get_db)):
     stock_service = StockService(db)
-    stock_service.add_cash_flow(request.stock_symbol)
+    counts = stock_service.add_cash_flow(request.stock_symbol)
     
-    # return a success message
-    return {"message": "Cash flow added successfully"}
+    # return a success message with the number of inserted, updated and unchanged quarters
+    return {"message": "Cash flow added successfully", "quarters": counts}
 
 
 # ENDPOINT FOR ADDING DIVIDEND DATA TO DB
 @router.post("/add-dividend")
 def add_dividend_to_db(request: DividendRequest, db: Session = Depends(get_db)):
     stock_service = StockService(db)
-    stock_service.add_dividend(request.stock_symbol)
+    counts = stock_service.add_dividend(request.stock_symbol)
     
-    # return a success message
-    return {"message": "Dividend added successfully"}
+    # return a success message with the number of inserted, updated and unchanged payments
+    return {"message": "Dividend added successfully", "payments": counts}
+
+
+# ENDPOINT FOR LOADING CLOSE PRICES TO DB
+# only the days after the latest stored price of each stock are fetched and written with bulk upserts
+# symbols that are not in the stocks table are not fetched, they are listed in failed_symbols
+"""
+example request:
+{
+    "symbols": ["AGHOL", "THYAO"],
+    "start_date": "2020-01-01"
+}
+example response:
+{
+    "symbols": 2,
+    "rows_written": 3,
+    "rows_per_symbol": {"AGHOL": 2, "THYAO": 1},
+    "failed_symbols": []
+}
+"""
+@router.post("/ingest-prices")
+def ingest_stock_prices(request: IngestPricesRequest, db: Session = Depends(get_db), username: str = Depends(verify_role)):
+    stock_service = StockService(db)
+    return stock_service.ingest_stock_prices(request.symbols, request.start_date)
+
+
+# ENDPOINTS FOR REFRESHING THE FUNDAMENTALS OF THE WHOLE STOCK UNIVERSE
+# starts a background job that fetches the income statement, balance sheet, cash flow and dividends
+# of every stock (or only the given symbols) and upserts them, poll the status endpoint for the progress
+"""
+Example request body:
+{
+    "symbols": null
+}
+Example response:
+{
+    "job_id": "3f2c9a1b7d4e",
+    "state": "running",
+    "total": 512,
+    "completed": 0,
+    ...
+}
+"""
+@router.post("/fundamentals/refresh")
+def refresh_fundamentals(request: FundamentalsRefreshRequest, username: str = Depends(verify_role)):
+    try:
+        job = fundamentals_refresh_jobs.start(FundamentalsRefreshJob(symbols=request.symbols))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.status()
+
+# progress of the latest refresh job
+@router.get("/fundamentals/refresh")
+def get_latest_fundamentals_refresh_status():
+    job = fundamentals_refresh_jobs.latest()
+    if job is None:
+        raise HTTPException(status_code=404, detail="No fundamentals refresh has been started")
+    return job.status()
+
+@router.get("/fundamentals/refresh/{job_id}")
+def get_fundamentals_refresh_status(job_id: str):
+    job = fundamentals_refresh_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Fundamentals refresh job not found")
+    return job.status()
+
+# ENDPOINTS FOR THE DAILY PERFORMANCE SNAPSHOTS
+# returns, 52 week high / low and average volume of all stocks (or a sector / the given symbols) from one select
+# the table is rebuilt every day after market close, the rebuild endpoint is for running it by hand
+@router.get("/performance/snapshots", response_model=List[PerformanceSnapshotResponse])
+def get_performance_snapshots(sector_id: Optional[int] = None, symbols: Optional[str] = None, db: Session = Depends(get_db)):
+    service = PerformanceSnapshotService(db)
+    # symbols is a comma separated list, e.g. ?symbols=THYAO,ASELS
+    return service.get_snapshots(sector_id, symbols.split(",") if symbols else None)
+
+@router.post("/performance/snapshots/rebuild")
+def rebuild_performance_snapshots(db: Session = Depends(get_db), username: str = Depends(verify_role)):
+    service = PerformanceSnapshotService(db)
+    return service.rebuild()
 
 
 # ENDPOINT FOR SEARCHING STOCKS
@@ -409,10 +901,14 @@ def get_sector_info(sector_id: int, db: Session = Depends(get_db)):
 
 
 # GET ALL THE STOCKS IN THE DB -> DETAİLED İNFO USING YAHOO FİNANCE
+# stocks whose info could not be fetched in time are left out and listed in the X-Failed-Symbols header
 @router.get("/stocks-all/{symbol}")
-def get_all_stocks(db: Session = Depends(get_db)):
+async def get_all_stocks(response: Response, db: Session = Depends(get_db)):
     service = StockService(db)
-    return service.get_all_stocks_in_detail()
+    stock_info, failed_symbols = await service.get_all_stocks_in_detail()
+    if failed_symbols:
+        response.headers["X-Failed-Symbols"] = ",".join(failed_symbols)
+    return stock_info
 
 # to return the sector of the given stock by symbol
 @router.get("/sector/{symbol}")
@@ -421,4 +917,34 @@ def get_sector_of_stock(symbol: str, db: Session = Depends(get_db)):
     sector = service.get_sector_of_stock(symbol)
     if not sector:
         raise HTTPException(status_code=404, detail="Stock not found")
-    return sector
\ No newline at end of file
+    return sector
+
+# hit / miss / expired counters of the process wide quote cache, to tune its ttl and size under load
+@router.get("/quote-cache/stats")
+def get_quote_cache_stats():
+    return quote_cache.stats()
+
+# fresh / stale hit counters of the stale-while-revalidate cache of the info endpoint
+@router.get("/info-cache/stats")
+def get_info_cache_stats():
+    return info_cache.stats()
+
+# hit / extend / build counters of the return matrices behind the portfolio risk endpoint
+@router.get("/return-matrix-cache/stats")
+def get_return_matrix_cache_stats():
+    return return_matrix_cache.stats()
+
+# reused / rebuilt counters of the dividend adjustment factors per stock
+@router.get("/dividend-factor-cache/stats")
+def get_dividend_factor_cache_stats():
+    return dividend_factor_cache.stats()
+
+# hit / miss counters of the sampled efficient frontiers behind the portfolio optimize endpoint
+@router.get("/frontier-cache/stats")
+def get_frontier_cache_stats():
+    return frontier_cache.stats()
+
+# state of the circuit breaker and the unknown symbols of the market data upstream
+@router.get("/market-data/health")
+def get_market_data_health():
+    return market_data_provider.stats()
@@ -1,14 +1,18 @@
 # Standard library imports
+import asyncio
 import uvicorn
 
 # Third-party imports
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 # Local application imports
 from controllers.stock_controller import router as stock_router
 from models.models import Base
 from utils.db_context import engine
+from services.performance_snapshot_service import performance_snapshot_task
+from utils.upstream_guard import UnknownSymbolError, UpstreamUnavailableError
 
 # Single dot (.) means current directory, double dot (..) means parent directory
 
@@ -43,6 +47,19 @@ async def root():
         "redoc_url": "/redoc"
     }
 
+# market data errors are answered right away instead of waiting for the upstream timeouts
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(int(exc.retry_after))})
+
+@app.exception_handler(UnknownSymbolError)
+async def unknown_symbol_handler(request: Request, exc: UnknownSymbolError):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.create_task(performance_snapshot_task())  # daily rebuild of the performance snapshots
+
 
 
 if __name__ == "__main__":
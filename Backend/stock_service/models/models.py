@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, DECIMAL, FLOAT, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Date, DECIMAL, FLOAT, Enum, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from utils.db_context import Base
@@ -44,6 +44,8 @@ class Stock(Base):
 
 class Financial(Base):
     __tablename__ = "financials"
+    # one row per stock and quarter, statement loads upsert on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "quarter", name="uq_financials_symbol_quarter"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -61,6 +63,8 @@ class Financial(Base):
 
 class BalanceSheet(Base):
     __tablename__ = "balance_sheets"
+    # one row per stock and quarter, statement loads upsert on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "quarter", name="uq_balance_sheets_symbol_quarter"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -77,6 +81,8 @@ class BalanceSheet(Base):
 
 class CashFlow(Base):
     __tablename__ = "cash_flows"
+    # one row per stock and quarter, statement loads upsert on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "quarter", name="uq_cash_flows_symbol_quarter"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -92,6 +98,7 @@ class CashFlow(Base):
 
 class Dividend(Base):
     __tablename__ = "dividends"
+    __table_args__ = (UniqueConstraint("stock_symbol", "payment_date", name="uq_dividends_symbol_payment_date"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -103,6 +110,8 @@ class Dividend(Base):
 
 class StockPrice(Base):
     __tablename__ = "stock_prices"
+    # one close price per stock and day, bulk ingestion upserts on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "date", name="uq_stock_prices_symbol_date"),)
     
     price_id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -112,6 +121,28 @@ class StockPrice(Base):
     
     stock = relationship("Stock", back_populates="prices")
 
+# one row per stock with its latest performance figures, rebuilt after every market close
+# list pages read this table instead of computing the returns from the price history
+class StockPerformanceSnapshot(Base):
+    __tablename__ = "stock_performance_snapshots"
+
+    stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), primary_key=True)
+    as_of_date = Column(Date, nullable=False)  # trading day of the last close
+    last_close = Column(DECIMAL(10, 2))
+    # percentage returns
+    return_1d = Column(FLOAT)
+    return_1w = Column(FLOAT)
+    return_1m = Column(FLOAT)
+    return_3m = Column(FLOAT)
+    return_ytd = Column(FLOAT)
+    return_1y = Column(FLOAT)
+    high_52w = Column(DECIMAL(10, 2))
+    low_52w = Column(DECIMAL(10, 2))
+    avg_volume = Column(BigInteger)  # average daily volume of the last 30 trading days
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    stock = relationship("Stock")
+
 class Portfolio(Base):
     __tablename__ = "portfolios"
     
@@ -136,6 +167,33 @@ class PortfolioHolding(Base):
     portfolio = relationship("Portfolio", back_populates="holdings")
     stock = relationship("Stock", back_populates="holdings")
 
+# append only trade history of the portfolios, the holdings above are the current positions built from it
+class PortfolioTransaction(Base):
+    __tablename__ = "portfolio_transactions"
+    __table_args__ = (Index("idx_portfolio_transactions_portfolio_time", "portfolio_id", "traded_at", "transaction_id"),)
+
+    transaction_id = Column(Integer, primary_key=True, autoincrement=True)
+    portfolio_id = Column(Integer, ForeignKey('portfolios.portfolio_id'), nullable=False)
+    stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
+    transaction_type = Column(Enum('buy', 'sell', 'dividend', name='transaction_types'), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    price = Column(DECIMAL(10, 2), nullable=False)  # price per share, dividend per share for dividends
+    traded_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# positions of a portfolio after one of its transactions, replays of the ledger start from the latest one
+class PortfolioPositionSnapshot(Base):
+    __tablename__ = "portfolio_position_snapshots"
+
+    portfolio_id = Column(Integer, ForeignKey('portfolios.portfolio_id'), primary_key=True)
+    transaction_id = Column(Integer, primary_key=True)  # last transaction applied
+    stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), primary_key=True)
+    traded_at = Column(DateTime, nullable=False)  # of the last transaction applied
+    quantity = Column(Integer, nullable=False)
+    cost_basis = Column(DECIMAL(18, 2), nullable=False)
+    realized_pl = Column(DECIMAL(18, 2), nullable=False)
+    dividends = Column(DECIMAL(18, 2), nullable=False)
+
 
 
 
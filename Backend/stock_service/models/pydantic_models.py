@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime, date
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from decimal import Decimal
 
 class StockCreate(BaseModel):
@@ -36,11 +36,64 @@ class StockPriceInRangeRequest(BaseModel):
     start_date: str
     end_date: str
 
+# to load the missing close prices of many stocks into the db, all stocks if no symbol is given
+class IngestPricesRequest(BaseModel):
+    symbols: Optional[List[str]] = None
+    start_date: Optional[str] = None
+
+# to refresh the statements and dividends of many stocks, all stocks if no symbol is given
+class FundamentalsRefreshRequest(BaseModel):
+    symbols: Optional[List[str]] = None
+
 class StockPriceResponse(BaseModel):
     stock_symbol: str
     date: str
     close_price: Optional[Decimal]
 
+# to get the quotes of many stocks with one request
+class QuotesRequest(BaseModel):
+    symbols: List[str]
+
+class QuoteResponse(BaseModel):
+    stock_symbol: str
+    last_price: Optional[float]
+    previous_close: Optional[float]
+    sector_id: Optional[int]
+    sector: Optional[str]
+
+# price points and returns of many stocks for the predefined periods, all stocks if no symbol is given
+class PeriodReturnsRequest(BaseModel):
+    symbols: Optional[List[str]] = None
+
+class PeriodPricePoint(BaseModel):
+    date: date
+    close_price: Optional[float]
+    return_pct: Optional[float]
+
+class PeriodReturnsResponse(BaseModel):
+    stock_symbol: str
+    date: date
+    close_price: Optional[float]
+    periods: Dict[str, PeriodPricePoint]  # "1W", "1M", "3M", "6M", "1Y", "3Y", "5Y"
+
+class PerformanceSnapshotResponse(BaseModel):
+    stock_symbol: str
+    as_of_date: date
+    last_close: Optional[float]
+    return_1d: Optional[float]
+    return_1w: Optional[float]
+    return_1m: Optional[float]
+    return_3m: Optional[float]
+    return_ytd: Optional[float]
+    return_1y: Optional[float]
+    high_52w: Optional[float]
+    low_52w: Optional[float]
+    avg_volume: Optional[int]
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
 class PortfolioCreate(BaseModel):
     user_id: int
     name: str
@@ -72,6 +125,258 @@ class HoldingResponse(BaseModel):
 
 class HoldingDecrease(BaseModel):
     quantity: int
+    price: Optional[float] = None  # sell price, the average bought price if not given
+
+# buy, sell or dividend (quantity is the number of shares and price the dividend per share) in the ledger
+class TransactionCreate(BaseModel):
+    symbol: str
+    transaction_type: Literal["buy", "sell", "dividend"]
+    quantity: int
+    price: float
+    traded_at: Optional[datetime] = None  # now if not given
+
+class TransactionResponse(BaseModel):
+    transaction_id: int
+    portfolio_id: int
+    stock_symbol: str
+    transaction_type: str
+    quantity: int
+    price: float
+    traded_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# many buy / sell / delete operations on the holdings of a portfolio with one request, e.g. a brokerage statement
+class HoldingOperation(BaseModel):
+    op: Literal["buy", "sell", "delete"]
+    symbol: str
+    quantity: Optional[int] = None  # not used by delete
+    price: Optional[float] = None  # required for buy, the average bought price for sell if not given
+
+class HoldingBatchRequest(BaseModel):
+    operations: List[HoldingOperation]
+    all_or_nothing: bool = False  # apply nothing if one operation fails
+
+class HoldingOperationResult(BaseModel):
+    index: int
+    op: str
+    symbol: str
+    status: str  # applied, failed or skipped
+    error: Optional[str] = None
+    holding_id: Optional[int] = None
+    quantity: Optional[int] = None  # of the holding after the operation
+    average_price: Optional[float] = None
+
+class HoldingBatchResponse(BaseModel):
+    portfolio_id: int
+    applied: int
+    failed: int
+    results: List[HoldingOperationResult]
+
+class PositionResponse(BaseModel):
+    stock_symbol: str
+    quantity: int
+    average_price: Optional[float]
+    cost_basis: float
+    realized_pl: float
+    dividends: float
+
+class PortfolioPositionsResponse(BaseModel):
+    portfolio_id: int
+    as_of: date
+    positions: List[PositionResponse]
+    total_cost_basis: float
+    total_realized_pl: float
+    total_dividends: float
+
+# market value and unrealized profit / loss of a portfolio, priced with the last close
+class HoldingValuation(BaseModel):
+    holding_id: int
+    stock_symbol: str
+    name: Optional[str]
+    sector_id: Optional[int]
+    sector: Optional[str]
+    quantity: int
+    average_price: float
+    last_price: Optional[float]
+    previous_close: Optional[float]
+    market_value: Optional[float]
+    cost_basis: float
+    unrealized_pl: Optional[float]
+    unrealized_pl_pct: Optional[float]
+    weight: Optional[float]
+
+class SectorValuation(BaseModel):
+    sector_id: Optional[int]
+    sector: Optional[str]
+    holdings_count: int
+    market_value: float
+    cost_basis: float
+    unrealized_pl: float
+    weight: Optional[float]
+
+class PortfolioValuationResponse(BaseModel):
+    portfolio_id: int
+    name: str
+    total_market_value: float
+    total_cost_basis: float
+    total_unrealized_pl: float
+    total_unrealized_pl_pct: Optional[float]
+    holdings: List[HoldingValuation]
+    sectors: List[SectorValuation]
+    missing_prices: List[str]
+
+# daily value of the current holdings of a portfolio
+class NavPoint(BaseModel):
+    date: date
+    nav: float
+    cumulative_return: Optional[float]
+    drawdown: Optional[float]
+
+class PortfolioHistoryResponse(BaseModel):
+    portfolio_id: int
+    start: date
+    end: date
+    symbols: List[str]
+    missing_symbols: List[str]
+    dividends_reinvested: bool = False
+    total_return: Optional[float]
+    max_drawdown: Optional[float]
+    max_drawdown_date: Optional[date]
+    points: List[NavPoint]
+
+# one day value at risk of a portfolio, as a fraction of its value and in TRY
+class ValueAtRisk(BaseModel):
+    var: Optional[float]
+    cvar: Optional[float]
+    var_amount: Optional[float]
+    cvar_amount: Optional[float]
+
+class HoldingRisk(BaseModel):
+    stock_symbol: str
+    weight: float
+    volatility: float
+    beta: Optional[float]
+
+class PortfolioRiskResponse(BaseModel):
+    portfolio_id: int
+    start: date
+    end: date
+    benchmark: str
+    observations: int
+    confidence: float
+    market_value: float
+    volatility: float
+    daily_volatility: float
+    beta: Optional[float]
+    historical: ValueAtRisk
+    parametric: ValueAtRisk
+    holdings: List[HoldingRisk]
+    missing_symbols: List[str]
+    symbols: List[str]
+    covariance: List[List[Optional[float]]]
+    correlation: List[List[Optional[float]]]
+
+# a portfolio of the mean variance optimization, returns and volatility are yearly
+class OptimizedPortfolio(BaseModel):
+    weights: Dict[str, float]
+    expected_return: float
+    volatility: float
+    sharpe: Optional[float]
+
+class FrontierPoint(BaseModel):
+    expected_return: float
+    volatility: float
+    sharpe: Optional[float]
+
+class PortfolioOptimizationResponse(BaseModel):
+    portfolio_id: int
+    start: date
+    end: date
+    symbols: List[str]
+    missing_symbols: List[str]
+    allow_short: bool
+    risk_free_rate: float
+    expected_returns: Dict[str, float]
+    volatilities: Dict[str, float]
+    current: Optional[OptimizedPortfolio]
+    min_variance: Optional[OptimizedPortfolio]
+    max_sharpe: Optional[OptimizedPortfolio]
+    target_return: Optional[OptimizedPortfolio]
+    frontier: List[FrontierPoint]
+
+# percentiles of the simulated portfolio value at the close of a future trading day
+# the percentiles come from a histogram, percentile_error bounds their relative error to the exact ones of the paths
+class SimulationBand(BaseModel):
+    day: int
+    date: date
+    mean: float
+    p5: float
+    p25: float
+    p50: float
+    p75: float
+    p95: float
+    percentile_error: float
+
+class PortfolioSimulationResponse(BaseModel):
+    portfolio_id: int
+    start: date
+    end: date
+    method: str
+    horizon_days: int
+    paths: int
+    seed: Optional[int]
+    symbols: List[str]
+    missing_symbols: List[str]
+    initial_value: float
+    expected_value: float
+    probability_of_loss: Optional[float]
+    bands: List[SimulationBand]
+
+# daily close of a stock with the dividend adjusted close, returns are cumulative from the first day
+class TotalReturnPoint(BaseModel):
+    date: date
+    close: float
+    adjusted_close: float
+    dividend: float
+    price_return: float
+    total_return: float
+
+class TotalReturnResponse(BaseModel):
+    stock_symbol: str
+    start: date
+    end: date
+    price_return: float
+    total_return: float
+    dividends: float
+    points: List[TotalReturnPoint]
+
+# dividend income of a portfolio from the dividends table and the shares held on the dividend dates
+class DividendPayment(BaseModel):
+    payment_date: date
+    stock_symbol: str
+    amount_per_share: float
+    quantity: int
+    income: float
+
+class SymbolIncome(BaseModel):
+    stock_symbol: str
+    payments: int
+    income: float
+
+class YearlyIncome(BaseModel):
+    year: int
+    income: float
+
+class PortfolioIncomeResponse(BaseModel):
+    portfolio_id: int
+    start: Optional[date]
+    end: Optional[date]
+    total_income: float
+    by_symbol: List[SymbolIncome]
+    by_year: List[YearlyIncome]
+    payments: List[DividendPayment]
 
 
 # income statement request
@@ -147,3 +452,16 @@ class SectorResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+# holding with its stock and the sector of the stock, all loaded with the holding in one query
+class HoldingStockResponse(BaseModel):
+    stock_symbol: str
+    name: str
+    market_cap: Optional[float]
+    sector: Optional[SectorResponse]
+
+    class Config:
+        from_attributes = True
+
+class HoldingDetailResponse(HoldingResponse):
+    stock: Optional[HoldingStockResponse]
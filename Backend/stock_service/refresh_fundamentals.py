@@ -0,0 +1,40 @@
+# Command line entry point of the fundamentals refresh, run it from the stock_service directory:
+#   python refresh_fundamentals.py                       -> every stock in the db
+#   python refresh_fundamentals.py THYAO ASELS --workers 4 --rate 2
+import argparse
+
+from services.fundamentals_refresh_service import (
+    FUNDAMENTALS_REFRESH_MAX_RETRIES,
+    FUNDAMENTALS_REFRESH_RATE_PER_SECOND,
+    FUNDAMENTALS_REFRESH_WORKERS,
+    FundamentalsRefreshJob,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the statements and dividends of the stocks in the db")
+    parser.add_argument("symbols", nargs="*", help="stock symbols to refresh, all stocks if none is given")
+    parser.add_argument("--workers", type=int, default=FUNDAMENTALS_REFRESH_WORKERS)
+    parser.add_argument("--rate", type=float, default=FUNDAMENTALS_REFRESH_RATE_PER_SECOND, help="upstream requests per second")
+    parser.add_argument("--retries", type=int, default=FUNDAMENTALS_REFRESH_MAX_RETRIES)
+    args = parser.parse_args()
+
+    job = FundamentalsRefreshJob(symbols=args.symbols or None, workers=args.workers,
+                                 rate_per_second=args.rate, max_retries=args.retries)
+    thread = job.start()
+    # print the progress every few seconds until the job is done
+    while thread.is_alive():
+        thread.join(timeout=5)
+        status = job.status()
+        print(f"[{status['state']}] {status['completed']}/{status['total']} stocks, "
+              f"{status['failed']} failed, {status['elapsed_seconds']:.0f}s")
+
+    status = job.status()
+    print(f"Counts: {status['counts']}")
+    for symbol, errors in status["errors"].items():
+        print(f"{symbol}: {errors}")
+    return 0 if status["state"] == "finished" else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,252 @@
+import threading
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models.models import Dividend, Portfolio, PortfolioHolding, PortfolioTransaction
+from utils.market_data_provider import MarketDataProvider, market_data_provider
+from utils.price_store import price_store
+
+
+def dividend_ratios(dates: np.ndarray, closes: np.ndarray, dividend_dates: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    """
+    Price adjustment ratio 1 - amount / previous close of every dividend, the previous close is the one of the last
+    trading day before the dividend date. Dividends without a close before them (or bigger than it) do not adjust.
+    """
+    previous = np.searchsorted(dates, dividend_dates, side="left") - 1
+    previous_closes = np.where(previous >= 0, closes[np.maximum(previous, 0)], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = 1 - amounts / previous_closes
+    return np.where((ratios > 0) & (ratios <= 1), ratios, 1.0)
+
+
+class DividendFactors:
+    """
+    Dividends of one stock with the suffix products of their adjustment ratios, so the cumulative
+    adjustment factor of any day is a binary search: the product of the ratios of the dividends after it.
+    """
+
+    __slots__ = ("signature", "dates", "amounts", "suffix")
+
+    def __init__(self, signature: Optional[tuple], dates: np.ndarray, amounts: np.ndarray, ratios: np.ndarray):
+        self.signature = signature
+        self.dates = dates
+        self.amounts = amounts
+        self.suffix = np.append(np.cumprod(ratios[::-1])[::-1], 1.0)
+
+    def factors(self, dates: np.ndarray) -> np.ndarray:
+        """Cumulative adjustment factor of every day, close * factor is the dividend adjusted close."""
+        return self.suffix[np.searchsorted(self.dates, dates, side="right")]
+
+    def per_day(self, dates: np.ndarray) -> np.ndarray:
+        """Dividend per share counted on each of the (trading) days, a dividend on a closed day goes to the next one."""
+        amounts = np.zeros(len(dates))
+        index = np.searchsorted(dates, self.dates, side="left")
+        inside = (index < len(dates)) & (self.dates >= dates[0]) if len(dates) else np.zeros(len(index), dtype=bool)
+        np.add.at(amounts, index[inside], self.amounts[inside])
+        return amounts
+
+
+NO_DIVIDENDS = DividendFactors(None, np.array([], dtype="datetime64[D]"), np.array([]), np.array([]))
+
+
+class DividendFactorCache:
+    """
+    Dividend adjustment factors per stock symbol. Every lookup checks the (count, last id, total amount) of the
+    dividend rows of the symbols with one grouped query, the factors are only rebuilt for symbols whose rows changed.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, DividendFactors] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.rebuilt = 0
+
+    def get_many(self, db: Session, symbols: List[str],
+                 load_closes: Callable[[str], Tuple[np.ndarray, np.ndarray]]) -> Dict[str, DividendFactors]:
+        if not symbols:
+            return {}
+        rows = db.query(
+            Dividend.stock_symbol, func.count(Dividend.id), func.max(Dividend.id), func.sum(Dividend.amount)
+        ).filter(Dividend.stock_symbol.in_(symbols)).group_by(Dividend.stock_symbol).all()
+        signatures = {row[0].upper(): (row[1], row[2], str(row[3])) for row in rows}
+
+        with self._lock:
+            result = {symbol: self._entries.get(symbol) for symbol in symbols}
+        stale = [symbol for symbol, entry in result.items()
+                 if (entry.signature if entry is not None else False) != signatures.get(symbol)]
+        self._count(hits=len(symbols) - len(stale), rebuilt=len(stale))
+        if not stale:
+            return result
+
+        dividends = defaultdict(list)
+        with_dividends = [symbol for symbol in stale if symbol in signatures]
+        if with_dividends:
+            query = db.query(Dividend.stock_symbol, Dividend.payment_date, Dividend.amount).filter(
+                Dividend.stock_symbol.in_(with_dividends)
+            ).order_by(Dividend.stock_symbol, Dividend.payment_date)
+            for row in query:
+                dividends[row.stock_symbol.upper()].append((row.payment_date, float(row.amount)))
+
+        for symbol in stale:
+            if symbol not in dividends:
+                result[symbol] = NO_DIVIDENDS
+                continue
+            dividend_dates = np.array([row[0] for row in dividends[symbol]], dtype="datetime64[D]")
+            amounts = np.array([row[1] for row in dividends[symbol]])
+            dates, closes = load_closes(symbol)
+            result[symbol] = DividendFactors(signatures[symbol], dividend_dates, amounts,
+                                             dividend_ratios(dates, closes, dividend_dates, amounts))
+        with self._lock:
+            for symbol in stale:
+                self._entries[symbol] = result[symbol]
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "rebuilt": self.rebuilt, "size": len(self._entries)}
+
+    def _count(self, hits: int, rebuilt: int):
+        with self._lock:
+            self.hits += hits
+            self.rebuilt += rebuilt
+
+
+class DividendService:
+    def __init__(self, db: Session, market_data: Optional[MarketDataProvider] = None):
+        self.db = db
+        self.market_data = market_data or market_data_provider
+
+    def get_factors(self, symbols: List[str]) -> Dict[str, DividendFactors]:
+        """Cached dividend adjustment factors of the symbols, symbols without dividends get NO_DIVIDENDS."""
+        def load_closes(symbol: str) -> Tuple[np.ndarray, np.ndarray]:
+            try:
+                history = price_store.get_history(symbol, self.market_data)
+                return history["date"], history["close"]
+            except Exception as e:
+                print(f"An error occurred while loading the price history of {symbol}: {e}")
+                return np.array([], dtype="datetime64[D]"), np.array([])
+
+        return dividend_factor_cache.get_many(self.db, [symbol.upper() for symbol in symbols], load_closes)
+
+    def get_total_return(self, stock_symbol: str, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+        """
+        Daily price and total return (dividends reinvested) of a stock between start and end (both inclusive),
+        the whole history by default.
+        """
+        stock_symbol = stock_symbol.upper()
+        end_exclusive = end + timedelta(days=1) if end is not None else None
+        history = price_store.get_history(stock_symbol, self.market_data, start=start, end=end_exclusive)
+        dates, closes = history["date"], history["close"]
+        if len(dates) == 0:
+            raise ValueError(f"No price history found for {stock_symbol}")
+
+        factors = self.get_factors([stock_symbol])[stock_symbol]
+        adjusted = closes * factors.factors(dates)
+        dividends = factors.per_day(dates)
+        price_returns = closes / closes[0] - 1
+        total_returns = adjusted / adjusted[0] - 1
+        return {
+            "stock_symbol": stock_symbol,
+            "start": dates[0].astype(object),
+            "end": dates[-1].astype(object),
+            "price_return": float(price_returns[-1]),
+            "total_return": float(total_returns[-1]),
+            "dividends": float(dividends.sum()),
+            "points": [
+                {"date": day, "close": close, "adjusted_close": adjusted_close, "dividend": dividend,
+                 "price_return": price_return, "total_return": total_return}
+                for day, close, adjusted_close, dividend, price_return, total_return in zip(
+                    dates.astype(object).tolist(), closes.tolist(), np.round(adjusted, 4).tolist(), dividends.tolist(),
+                    price_returns.tolist(), total_returns.tolist()
+                )
+            ],
+        }
+
+    def get_income_report(self, portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+        """
+        Dividend income of a portfolio between start and end (both inclusive, every payment by default).
+        The shares entitled to a dividend are the ones held at the start of its date according to the ledger,
+        stocks that are only in the holdings table count with their current quantity.
+        """
+        portfolio = self.db.query(Portfolio.portfolio_id).filter(Portfolio.portfolio_id == portfolio_id).first()
+        if portfolio is None:
+            raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
+
+        # signed quantities of the buys and sells of every stock, in time order
+        trades = defaultdict(lambda: ([], []))
+        rows = self.db.query(
+            PortfolioTransaction.stock_symbol, PortfolioTransaction.transaction_type,
+            PortfolioTransaction.quantity, PortfolioTransaction.traded_at
+        ).filter(
+            PortfolioTransaction.portfolio_id == portfolio_id, PortfolioTransaction.transaction_type != "dividend"
+        ).order_by(PortfolioTransaction.traded_at, PortfolioTransaction.transaction_id)
+        for row in rows:
+            times, quantities = trades[row.stock_symbol.upper()]
+            times.append(row.traded_at)
+            quantities.append(row.quantity if row.transaction_type == "buy" else -row.quantity)
+
+        holdings = defaultdict(int)
+        for row in self.db.query(PortfolioHolding.stock_symbol, PortfolioHolding.quantity).filter(
+            PortfolioHolding.portfolio_id == portfolio_id
+        ):
+            holdings[row.stock_symbol.upper()] += row.quantity or 0
+        symbols = sorted(set(trades) | {symbol for symbol, quantity in holdings.items() if quantity})
+
+        payments = []
+        if symbols:
+            query = self.db.query(Dividend.stock_symbol, Dividend.payment_date, Dividend.amount).filter(
+                Dividend.stock_symbol.in_(symbols)
+            )
+            if start:
+                query = query.filter(Dividend.payment_date >= start)
+            if end:
+                query = query.filter(Dividend.payment_date <= end)
+            dividends = defaultdict(list)
+            for row in query.order_by(Dividend.payment_date):
+                dividends[row.stock_symbol.upper()].append((row.payment_date, float(row.amount)))
+
+            for symbol, rows in dividends.items():
+                payment_dates = [row[0] for row in rows]
+                if symbol in trades:
+                    times, quantities = trades[symbol]
+                    held = np.concatenate([[0], np.cumsum(quantities)])
+                    entitled = np.array([datetime.combine(day, time.min) for day in payment_dates], dtype="datetime64[us]")
+                    held = held[np.searchsorted(np.array(times, dtype="datetime64[us]"), entitled, side="left")]
+                else:
+                    held = np.full(len(rows), holdings[symbol])
+                for (payment_date, amount), quantity in zip(rows, held.tolist()):
+                    if quantity > 0:
+                        payments.append({
+                            "payment_date": payment_date, "stock_symbol": symbol, "amount_per_share": amount,
+                            "quantity": int(quantity), "income": round(amount * quantity, 2),
+                        })
+        payments.sort(key=lambda payment: (payment["payment_date"], payment["stock_symbol"]))
+
+        by_symbol = defaultdict(lambda: {"payments": 0, "income": 0.0})
+        by_year = defaultdict(float)
+        for payment in payments:
+            by_symbol[payment["stock_symbol"]]["payments"] += 1
+            by_symbol[payment["stock_symbol"]]["income"] += payment["income"]
+            by_year[payment["payment_date"].year] += payment["income"]
+
+        return {
+            "portfolio_id": portfolio_id,
+            "start": start,
+            "end": end,
+            "total_income": round(sum(payment["income"] for payment in payments), 2),
+            "by_symbol": [
+                {"stock_symbol": symbol, "payments": totals["payments"], "income": round(totals["income"], 2)}
+                for symbol, totals in sorted(by_symbol.items())
+            ],
+            "by_year": [{"year": year, "income": round(income, 2)} for year, income in sorted(by_year.items())],
+            "payments": payments,
+        }
+
+
+# Process wide cache of the dividend adjustment factors per stock symbol
+dividend_factor_cache = DividendFactorCache()
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from models.models import Stock
+from services.stock_service import StockService
+from utils.db_context import SessionLocal
+from utils.market_data_provider import MarketDataProvider, market_data_provider
+from utils.rate_limiter import Priority, TokenBucketRateLimiter, call_priority
+from utils.upstream_guard import UnknownSymbolError
+
+# worker pool size, upstream request rate and retry policy of a refresh
+FUNDAMENTALS_REFRESH_WORKERS = int(os.getenv("FUNDAMENTALS_REFRESH_WORKERS", "8"))
+FUNDAMENTALS_REFRESH_RATE_PER_SECOND = float(os.getenv("FUNDAMENTALS_REFRESH_RATE_PER_SECOND", "4"))
+FUNDAMENTALS_REFRESH_MAX_RETRIES = int(os.getenv("FUNDAMENTALS_REFRESH_MAX_RETRIES", "3"))
+FUNDAMENTALS_REFRESH_BACKOFF_SECONDS = float(os.getenv("FUNDAMENTALS_REFRESH_BACKOFF_SECONDS", "2"))
+
+
+class FundamentalsRefreshJob:
+    """
+    Refreshes the income statement, balance sheet, cash flow and dividends of every stock.
+    The statements are fetched concurrently by a worker pool, the writes of a stock are done in one
+    transaction by the thread running the job, so the db session is never shared between threads.
+    """
+
+    # statement name -> provider method
+    STATEMENTS = {
+        "financials": "get_quarterly_financials",
+        "balance_sheet": "get_quarterly_balance_sheet",
+        "cash_flow": "get_quarterly_cashflow",
+        "dividends": "get_dividends",
+    }
+
+    def __init__(self, symbols: Optional[List[str]] = None, market_data: Optional[MarketDataProvider] = None,
+                 session_factory: Callable = SessionLocal, workers: int = FUNDAMENTALS_REFRESH_WORKERS,
+                 rate_per_second: float = FUNDAMENTALS_REFRESH_RATE_PER_SECOND,
+                 max_retries: int = FUNDAMENTALS_REFRESH_MAX_RETRIES,
+                 backoff_seconds: float = FUNDAMENTALS_REFRESH_BACKOFF_SECONDS):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols)) if symbols else None
+        self.market_data = market_data or market_data_provider
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        # pace of this job, the calls also go through the shared market data limiter as background calls
+        self._rate_limiter = TokenBucketRateLimiter(rate_per_second, burst=1, max_wait_seconds=None)
+        self._lock = threading.Lock()
+
+        # progress, read by the status endpoint while the job runs
+        self.state = "pending"
+        self.total = 0
+        self.completed = 0
+        self.retries = 0
+        self.errors: Dict[str, Dict[str, str]] = {}  # symbol -> {statement: error}
+        self.counts = {name: {"inserted": 0, "updated": 0, "unchanged": 0} for name in self.STATEMENTS}
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+
+    def start(self) -> threading.Thread:
+        """Run the job in a background thread."""
+        thread = threading.Thread(target=self.run, name=f"fundamentals-refresh-{self.job_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self) -> dict:
+        self.state = "running"
+        self.started_at = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            service = StockService(db, self.market_data)
+            symbols = self.symbols or [row.stock_symbol for row in db.query(Stock.stock_symbol).all()]
+            self.total = len(symbols)
+
+            pending: Dict[str, dict] = {symbol: {} for symbol in symbols}  # statements fetched so far
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fundamentals") as pool:
+                futures = {
+                    pool.submit(self._fetch, symbol, method): (symbol, name)
+                    for symbol in symbols
+                    for name, method in self.STATEMENTS.items()
+                }
+                for future in as_completed(futures):
+                    symbol, name = futures[future]
+                    try:
+                        pending[symbol][name] = future.result()
+                    except Exception as e:
+                        pending[symbol][name] = None
+                        self._record_error(symbol, name, e)
+
+                    # write a stock as soon as all of its statements are here
+                    if len(pending[symbol]) == len(self.STATEMENTS):
+                        self._save(service, symbol, pending.pop(symbol))
+
+            self.state = "finished"
+        except Exception as e:
+            self.state = "failed"
+            self._record_error("*", "job", e)
+            print(f"Fundamentals refresh {self.job_id} failed: {e}")
+        finally:
+            db.close()
+            self.finished_at = datetime.utcnow()
+        return self.status()
+
+    def status(self) -> dict:
+        with self._lock:
+            end = self.finished_at or datetime.utcnow()
+            return {
+                "job_id": self.job_id,
+                "state": self.state,
+                "total": self.total,
+                "completed": self.completed,
+                "failed": len(self.errors),
+                "progress": self.completed / self.total if self.total else 0.0,
+                "retries": self.retries,
+                "counts": {name: dict(counts) for name, counts in self.counts.items()},
+                "errors": {symbol: dict(errors) for symbol, errors in self.errors.items()},
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "elapsed_seconds": (end - self.started_at).total_seconds() if self.started_at else 0.0,
+            }
+
+    def _fetch(self, symbol: str, method: str):
+        for attempt in range(self.max_retries + 1):
+            self._rate_limiter.acquire()
+            try:
+                with call_priority(Priority.BACKGROUND):
+                    return getattr(self.market_data, method)(symbol)
+            except UnknownSymbolError:
+                raise  # asking again will not help
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                # exponential backoff, 2s, 4s, 8s ... with the default settings
+                time.sleep(self.backoff_seconds * (2 ** attempt))
+
+    def _save(self, service: StockService, symbol: str, statements: dict):
+        fetched = {name: data for name, data in statements.items() if data is not None}
+        try:
+            counts = service.save_fundamentals(symbol, fetched)
+            with self._lock:
+                for name, statement_counts in counts.items():
+                    for key, value in statement_counts.items():
+                        self.counts[name][key] += value
+        except Exception as e:
+            self._record_error(symbol, "write", e)
+        with self._lock:
+            self.completed += 1
+
+    def _record_error(self, symbol: str, name: str, error: Exception):
+        with self._lock:
+            self.errors.setdefault(symbol, {})[name] = str(error)
+
+
+class FundamentalsRefreshRegistry:
+    """Keeps the refresh jobs of this process so that their progress can be polled. Only one job runs at a time."""
+
+    def __init__(self, max_jobs: int = 20):
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, FundamentalsRefreshJob] = {}
+        self._lock = threading.Lock()
+
+    def start(self, job: FundamentalsRefreshJob) -> FundamentalsRefreshJob:
+        with self._lock:
+            running = [j for j in self._jobs.values() if j.state in ("pending", "running")]
+            if running:
+                raise ValueError(f"Fundamentals refresh {running[0].job_id} is already running")
+            self._jobs[job.job_id] = job
+            # forget the oldest finished jobs
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.pop(next(iter(self._jobs)))
+        job.start()
+        return job
+
+    def get(self, job_id: str) -> Optional[FundamentalsRefreshJob]:
+        return self._jobs.get(job_id)
+
+    def latest(self) -> Optional[FundamentalsRefreshJob]:
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+
+# Process wide registry used by the refresh endpoints
+fundamentals_refresh_jobs = FundamentalsRefreshRegistry()
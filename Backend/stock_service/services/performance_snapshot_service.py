@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from models.models import Stock, StockPerformanceSnapshot
+from services.stock_service import upstream_executor
+from utils.db_context import SessionLocal
+from utils.db_upsert import upsert_rows
+from utils.market_data_provider import MarketDataProvider, market_data_provider
+from utils.price_store import price_store
+from utils.rate_limiter import Priority, call_priority
+
+# daily rebuild time in UTC, borsa istanbul closes at 18:00 istanbul time (15:00 UTC)
+SNAPSHOT_REBUILD_UTC_TIME = os.getenv("SNAPSHOT_REBUILD_UTC_TIME", "15:30")
+# one year of history and a margin for the ytd reference of early january
+SNAPSHOT_HISTORY_DAYS = 400
+SNAPSHOT_AVG_VOLUME_DAYS = 30
+
+SNAPSHOT_COLUMNS = [
+    "as_of_date", "last_close", "return_1d", "return_1w", "return_1m", "return_3m", "return_ytd", "return_1y",
+    "high_52w", "low_52w", "avg_volume", "updated_at",
+]
+
+
+class PerformanceSnapshotService:
+    def __init__(self, db: Session, market_data: Optional[MarketDataProvider] = None):
+        self.db = db
+        self.market_data = market_data or market_data_provider
+
+    def get_snapshots(self, sector_id: Optional[int] = None, symbols: Optional[List[str]] = None) -> List[StockPerformanceSnapshot]:
+        query = self.db.query(StockPerformanceSnapshot)
+        if sector_id is not None:
+            query = query.join(Stock, Stock.stock_symbol == StockPerformanceSnapshot.stock_symbol).filter(Stock.sector_id == sector_id)
+        if symbols:
+            query = query.filter(StockPerformanceSnapshot.stock_symbol.in_([symbol.upper() for symbol in symbols]))
+        return query.order_by(StockPerformanceSnapshot.stock_symbol).all()
+
+    def rebuild(self) -> dict:
+        """
+        Recompute the snapshot of every stock from the local price store and upsert the whole table.
+        The figures of all stocks are computed together on date x symbol matrices.
+        """
+        started = time.monotonic()
+        symbols = [row.stock_symbol for row in self.db.query(Stock.stock_symbol).all()]
+        start = date.today() - timedelta(days=SNAPSHOT_HISTORY_DAYS)
+
+        def load_history(symbol: str):
+            try:
+                with call_priority(Priority.BACKGROUND):
+                    return price_store.get_history(symbol, self.market_data, start=start)
+            except Exception as e:
+                print(f"An error occurred while loading the price history of {symbol}: {e}")
+                return None
+
+        histories = {}
+        failed_symbols = []
+        for symbol, history in zip(symbols, upstream_executor.map(load_history, symbols)):
+            if history is None or len(history["date"]) == 0:
+                failed_symbols.append(symbol)
+            else:
+                histories[symbol] = history
+
+        rows = []
+        if histories:
+            frames = {
+                name: pd.DataFrame({
+                    symbol: pd.Series(history[name], index=pd.DatetimeIndex(history["date"]))
+                    for symbol, history in histories.items()
+                }).sort_index()
+                for name in ("close", "high", "low", "volume")
+            }
+            rows = self._snapshot_rows(frames)
+
+        upsert_rows(self.db, StockPerformanceSnapshot, rows, ["stock_symbol"], SNAPSHOT_COLUMNS)
+        self.db.commit()
+        return {
+            "rows_written": len(rows),
+            "failed_symbols": failed_symbols,
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+        }
+
+    @staticmethod
+    def _snapshot_rows(frames: Dict[str, pd.DataFrame]) -> List[dict]:
+        close = frames["close"].ffill()
+        index = close.index
+        last_day = index[-1]
+        last_close = close.iloc[-1]
+
+        # last close on or before the target day for every symbol, nan before the first day
+        def close_on(target) -> pd.Series:
+            position = index.searchsorted(pd.Timestamp(target), side="right") - 1
+            if position < 0:
+                return pd.Series(np.nan, index=close.columns)
+            return close.iloc[position]
+
+        def percentage_change(past: pd.Series) -> pd.Series:
+            return (last_close / past - 1) * 100
+
+        previous_close = close.iloc[-2] if len(index) > 1 else pd.Series(np.nan, index=close.columns)
+        figures = pd.DataFrame({
+            "as_of_date": frames["close"].apply(lambda column: column.last_valid_index()),
+            "last_close": last_close,
+            "return_1d": percentage_change(previous_close),
+            "return_1w": percentage_change(close_on(last_day - timedelta(days=7))),
+            "return_1m": percentage_change(close_on(last_day - timedelta(days=30))),
+            "return_3m": percentage_change(close_on(last_day - timedelta(days=90))),
+            "return_ytd": percentage_change(close_on(pd.Timestamp(last_day.year - 1, 12, 31))),
+            "return_1y": percentage_change(close_on(last_day - timedelta(days=365))),
+            "high_52w": frames["high"][index > last_day - timedelta(days=365)].max(),
+            "low_52w": frames["low"][index > last_day - timedelta(days=365)].min(),
+            "avg_volume": frames["volume"].iloc[-SNAPSHOT_AVG_VOLUME_DAYS:].mean(),
+        })
+        figures = figures.replace([np.inf, -np.inf], np.nan)
+
+        updated_at = datetime.utcnow()
+        rows = []
+        for symbol, figure in figures.iterrows():
+            if pd.isna(figure["as_of_date"]):
+                continue
+            rows.append({
+                "stock_symbol": symbol,
+                "as_of_date": figure["as_of_date"].date(),
+                "last_close": _decimal(figure["last_close"]),
+                "return_1d": _float(figure["return_1d"]),
+                "return_1w": _float(figure["return_1w"]),
+                "return_1m": _float(figure["return_1m"]),
+                "return_3m": _float(figure["return_3m"]),
+                "return_ytd": _float(figure["return_ytd"]),
+                "return_1y": _float(figure["return_1y"]),
+                "high_52w": _decimal(figure["high_52w"]),
+                "low_52w": _decimal(figure["low_52w"]),
+                "avg_volume": None if pd.isna(figure["avg_volume"]) else int(round(figure["avg_volume"])),
+                "updated_at": updated_at,
+            })
+        return rows
+
+
+def _float(value) -> Optional[float]:
+    return None if pd.isna(value) else float(value)
+
+
+def _decimal(value) -> Optional[Decimal]:
+    return None if pd.isna(value) else Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def rebuild_performance_snapshots() -> dict:
+    """Rebuild with a session of its own, used by the scheduler and the admin endpoint."""
+    db = SessionLocal()
+    try:
+        result = PerformanceSnapshotService(db).rebuild()
+        print(f"Performance snapshots rebuilt: {result['rows_written']} stocks, {len(result['failed_symbols'])} failed")
+        return result
+    finally:
+        db.close()
+
+
+# last scheduled rebuild time before now, in naive UTC
+def _last_scheduled_rebuild(now: datetime) -> datetime:
+    hour, minute = (int(part) for part in SNAPSHOT_REBUILD_UTC_TIME.split(":"))
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return scheduled if scheduled <= now else scheduled - timedelta(days=1)
+
+
+def _snapshots_are_stale(now: datetime) -> bool:
+    db = SessionLocal()
+    try:
+        last_update = db.query(StockPerformanceSnapshot.updated_at).order_by(StockPerformanceSnapshot.updated_at.desc()).first()
+    finally:
+        db.close()
+    return last_update is None or last_update[0] < _last_scheduled_rebuild(now)
+
+
+async def performance_snapshot_task():
+    """Rebuild the snapshots every day after market close, and right away if the last rebuild was missed."""
+    loop = asyncio.get_running_loop()
+    while True:
+        now = datetime.utcnow()
+        try:
+            if await loop.run_in_executor(None, _snapshots_are_stale, now):
+                await loop.run_in_executor(None, rebuild_performance_snapshots)
+        except Exception as e:
+            print(f"An error occurred while rebuilding the performance snapshots: {e}")
+
+        next_rebuild = _last_scheduled_rebuild(datetime.utcnow()) + timedelta(days=1)
+        await asyncio.sleep((next_rebuild - datetime.utcnow()).total_seconds())
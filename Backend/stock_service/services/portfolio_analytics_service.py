@@ -0,0 +1,449 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from statistics import NormalDist
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from models.models import Portfolio, PortfolioHolding
+from services.dividend_service import DividendService
+from services.stock_service import upstream_executor
+from utils.market_data_provider import MarketDataProvider, market_data_provider
+from utils.price_store import price_store
+
+# history window used when the request does not give a start date
+PORTFOLIO_HISTORY_DEFAULT_DAYS = 365
+
+# risk figures are measured against bist 100, whose trading days are also the date grid of the return matrices
+RISK_BENCHMARK_SYMBOL = os.getenv("RISK_BENCHMARK_SYMBOL", "XU100")
+TRADING_DAYS_PER_YEAR = 252
+# return matrices are kept per symbol set and window, at most as long as the price store waits before a refresh
+RETURN_MATRIX_CACHE_TTL_SECONDS = float(os.getenv("RETURN_MATRIX_CACHE_TTL_SECONDS", "900"))
+RETURN_MATRIX_CACHE_MAX_ENTRIES = int(os.getenv("RETURN_MATRIX_CACHE_MAX_ENTRIES", "64"))
+
+
+def close_matrix(histories: Dict[str, Dict[str, np.ndarray]]) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """
+    Align the close series of the symbols on the union of their dates.
+    Returns the dates, the symbols (columns) and a date x symbol float matrix where a day without a close
+    carries the last close forward, days before the first close of a symbol are nan.
+    """
+    symbols = list(histories)
+    if not symbols:
+        return np.array([], dtype="datetime64[D]"), symbols, np.empty((0, 0))
+
+    dates = np.unique(np.concatenate([histories[symbol]["date"] for symbol in symbols]))
+    matrix = np.full((len(dates), len(symbols)), np.nan)
+    for column, symbol in enumerate(symbols):
+        symbol_dates = histories[symbol]["date"]
+        if len(symbol_dates) == 0:
+            continue
+        # position of the last close on or before each day, which forward fills the gaps
+        positions = np.searchsorted(symbol_dates, dates, side="right") - 1
+        has_close = positions >= 0
+        matrix[has_close, column] = histories[symbol]["close"][positions[has_close]]
+    return dates, symbols, matrix
+
+
+def nav_series(matrix: np.ndarray, quantities: np.ndarray) -> Dict[str, np.ndarray]:
+    """NAV, cumulative return and drawdown of holding the quantities over the rows of a close matrix without nans."""
+    nav = matrix @ quantities
+    if len(nav) == 0:
+        return {"nav": nav, "cumulative_return": nav.copy(), "drawdown": nav.copy()}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cumulative_return = nav / nav[0] - 1
+        drawdown = nav / np.maximum.accumulate(nav) - 1
+    return {"nav": nav, "cumulative_return": cumulative_return, "drawdown": drawdown}
+
+
+def log_returns_on_grid(grid: np.ndarray, history: Dict[str, np.ndarray]) -> Tuple[np.ndarray, float]:
+    """
+    Daily log returns of a close series on the given date grid (one value less than the grid) and its last close.
+    Closes are carried forward over the grid days the symbol did not trade, returns before its first close are nan.
+    """
+    closes = np.full(len(grid), np.nan)
+    positions = np.searchsorted(history["date"], grid, side="right") - 1
+    has_close = positions >= 0
+    closes[has_close] = history["close"][positions[has_close]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.diff(np.log(closes))
+    returns[~np.isfinite(returns)] = np.nan
+    return returns, float(closes[-1]) if len(closes) else np.nan
+
+
+def pairwise_covariance(returns: np.ndarray) -> np.ndarray:
+    """Sample covariance of the columns, each pair over the rows where both columns have a value."""
+    present = (~np.isnan(returns)).astype(np.float64)
+    filled = np.nan_to_num(returns)
+    counts = present.T @ present
+    sums = filled.T @ present  # sums[i, j]: sum of column i over the rows where column j has a value too
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = (filled.T @ filled - sums * sums.T / counts) / (counts - 1)
+    covariance[counts < 2] = np.nan
+    return covariance
+
+
+def covariance_with(returns: np.ndarray, column: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Pairwise covariance of a new column with each column of the matrix and the variance of the new column.
+    One pass over the matrix, so a covariance matrix grows by a row and a column without being recomputed.
+    """
+    present = (~np.isnan(returns)).astype(np.float64)
+    filled = np.nan_to_num(returns)
+    column_present = (~np.isnan(column)).astype(np.float64)
+    column_filled = np.nan_to_num(column)
+
+    counts = present.T @ column_present
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariances = (filled.T @ column_filled - (filled.T @ column_present) * (present.T @ column_filled) / counts) / (counts - 1)
+    covariances[counts < 2] = np.nan
+
+    observations = column_present.sum()
+    variance = np.nan
+    if observations >= 2:
+        variance = (column_filled @ column_filled - column_filled.sum() ** 2 / observations) / (observations - 1)
+    return covariances, float(variance)
+
+
+class ReturnMatrix:
+    """Daily log returns of a set of symbols on a fixed date grid, with their covariance and benchmark returns."""
+
+    def __init__(self, grid: np.ndarray, benchmark: np.ndarray, symbols: List[str], returns: np.ndarray,
+                 last_closes: np.ndarray, covariance: np.ndarray):
+        self.grid = grid
+        self.benchmark = benchmark
+        self.symbols = symbols
+        self.returns = returns
+        self.last_closes = last_closes
+        self.covariance = covariance
+        self._columns = {symbol: i for i, symbol in enumerate(symbols)}
+
+    def select(self, symbols: List[str]) -> "ReturnMatrix":
+        """The columns and the covariance block of the given symbols, which must all be in the matrix."""
+        columns = [self._columns[symbol] for symbol in symbols]
+        return ReturnMatrix(self.grid, self.benchmark, list(symbols), self.returns[:, columns],
+                            self.last_closes[columns], self.covariance[np.ix_(columns, columns)])
+
+    def extend(self, symbol: str, column: np.ndarray, last_close: float) -> "ReturnMatrix":
+        """A new matrix with one more symbol, its covariance row is computed against the existing columns only."""
+        covariances, variance = covariance_with(self.returns, column)
+        size = len(self.symbols)
+        covariance = np.empty((size + 1, size + 1))
+        covariance[:size, :size] = self.covariance
+        covariance[size, :size] = covariances
+        covariance[:size, size] = covariances
+        covariance[size, size] = variance
+        return ReturnMatrix(self.grid, self.benchmark, self.symbols + [symbol], np.column_stack([self.returns, column]),
+                            np.append(self.last_closes, last_close), covariance)
+
+
+class ReturnMatrixCache:
+    """
+    Return matrices per symbol set and date window.
+    A symbol set that is not cached is built from a cached matrix of the same window when there is one:
+    the shared columns are reused and the covariance is only extended with the new symbols,
+    so adding a holding to a portfolio costs one pass over the returns instead of a full recompute.
+    """
+
+    def __init__(self, ttl_seconds: float = RETURN_MATRIX_CACHE_TTL_SECONDS,
+                 max_entries: int = RETURN_MATRIX_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # (symbols, start, end) -> (matrix, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.extended = 0
+        self.built = 0
+
+    def get_or_build(self, symbols: List[str], start: date, end: date,
+                     load_grid: Callable[[], Tuple[np.ndarray, np.ndarray]],
+                     load_columns: Callable[[np.ndarray, List[str]], Dict[str, Tuple[np.ndarray, float]]]) -> ReturnMatrix:
+        """
+        Return the matrix of the symbols in the window. load_grid returns the date grid and the benchmark returns,
+        load_columns the log returns and last close of the given symbols on a grid (symbols without history left out).
+        """
+        symbol_set = frozenset(symbols)
+        with self._lock:
+            self._drop_expired()
+            entry = self._entries.get((symbol_set, start, end))
+            if entry is not None:
+                self._entries.move_to_end((symbol_set, start, end))
+                self.hits += 1
+                return entry[0]
+            # the cached matrix of the window that shares the most symbols
+            base = max(
+                (matrix for (cached_symbols, cached_start, cached_end), (matrix, _) in self._entries.items()
+                 if cached_start == start and cached_end == end and cached_symbols & symbol_set),
+                key=lambda matrix: len(symbol_set.intersection(matrix.symbols)),
+                default=None,
+            )
+
+        if base is None:
+            grid, benchmark = load_grid()
+            columns = load_columns(grid, sorted(symbol_set))
+            matrix = self._build(grid, benchmark, columns)
+            with self._lock:
+                self.built += 1
+        else:
+            matrix = base.select(sorted(symbol_set.intersection(base.symbols)))
+            new_symbols = sorted(symbol_set.difference(base.symbols))
+            for symbol, (column, last_close) in load_columns(base.grid, new_symbols).items():
+                matrix = matrix.extend(symbol, column, last_close)
+            with self._lock:
+                self.extended += 1
+
+        with self._lock:
+            self._entries[(symbol_set, start, end)] = (matrix, time.monotonic())
+            self._entries.move_to_end((symbol_set, start, end))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return matrix
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "extended": self.extended, "built": self.built}
+
+    @staticmethod
+    def _build(grid: np.ndarray, benchmark: np.ndarray, columns: Dict[str, Tuple[np.ndarray, float]]) -> ReturnMatrix:
+        symbols = list(columns)
+        returns = np.column_stack([columns[symbol][0] for symbol in symbols]) if symbols else np.empty((len(benchmark), 0))
+        last_closes = np.array([columns[symbol][1] for symbol in symbols], dtype=np.float64)
+        return ReturnMatrix(grid, benchmark, symbols, returns, last_closes, pairwise_covariance(returns))
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (_, stored_at) in self._entries.items() if now - stored_at >= self.ttl_seconds]:
+            del self._entries[key]
+
+
+class PortfolioAnalyticsService:
+    def __init__(self, db: Session, market_data: Optional[MarketDataProvider] = None):
+        self.db = db
+        self.market_data = market_data or market_data_provider
+
+    def get_positions(self, portfolio_id: int) -> Dict[str, int]:
+        """Symbol -> quantity of the current holdings of the portfolio."""
+        portfolio = self.db.query(Portfolio.portfolio_id).filter(Portfolio.portfolio_id == portfolio_id).first()
+        if portfolio is None:
+            raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
+
+        positions: Dict[str, int] = {}
+        rows = self.db.query(PortfolioHolding.stock_symbol, PortfolioHolding.quantity).filter(
+            PortfolioHolding.portfolio_id == portfolio_id
+        ).all()
+        for row in rows:
+            if row.quantity:
+                positions[row.stock_symbol.upper()] = positions.get(row.stock_symbol.upper(), 0) + row.quantity
+        return positions
+
+    def load_close_matrix(self, symbols: List[str], start: Optional[date] = None,
+                          end: Optional[date] = None) -> Tuple[np.ndarray, List[str], np.ndarray, List[str]]:
+        """
+        Close matrix of the symbols between start and end (both inclusive) from the local price store.
+        The histories are loaded concurrently, symbols without history are returned as the last element.
+        """
+        histories, missing_symbols = self._load_histories(symbols, start, end)
+        dates, columns, matrix = close_matrix(histories)
+        return dates, columns, matrix, missing_symbols
+
+    def load_return_matrix(self, symbols: List[str], start: date, end: date) -> ReturnMatrix:
+        """
+        Daily log returns of the symbols on the trading days of the benchmark between start and end,
+        from the return matrix cache. Symbols without history are not in the returned matrix.
+        """
+        def load_grid() -> Tuple[np.ndarray, np.ndarray]:
+            histories, _ = self._load_histories([RISK_BENCHMARK_SYMBOL], start, end)
+            if RISK_BENCHMARK_SYMBOL in histories:
+                grid = histories[RISK_BENCHMARK_SYMBOL]["date"]
+                return grid, log_returns_on_grid(grid, histories[RISK_BENCHMARK_SYMBOL])[0]
+            # without the benchmark every business day is a grid day and there is no beta
+            grid = pd.bdate_range(start, end).values.astype("datetime64[D]")
+            return grid, np.full(max(len(grid) - 1, 0), np.nan)
+
+        def load_columns(grid: np.ndarray, column_symbols: List[str]) -> Dict[str, Tuple[np.ndarray, float]]:
+            histories, _ = self._load_histories(column_symbols, start, end)
+            return {symbol: log_returns_on_grid(grid, history) for symbol, history in histories.items()}
+
+        return return_matrix_cache.get_or_build(symbols, start, end, load_grid, load_columns)
+
+    def _load_histories(self, symbols: List[str], start: Optional[date],
+                        end: Optional[date]) -> Tuple[Dict[str, Dict[str, np.ndarray]], List[str]]:
+        # price histories of the symbols loaded concurrently, end is inclusive
+        end_exclusive = end + timedelta(days=1) if end is not None else None
+
+        def load_history(symbol: str):
+            try:
+                return price_store.get_history(symbol, self.market_data, start=start, end=end_exclusive)
+            except Exception as e:
+                print(f"An error occurred while loading the price history of {symbol}: {e}")
+                return None
+
+        histories = {}
+        missing_symbols = []
+        for symbol, history in zip(symbols, upstream_executor.map(load_history, symbols)):
+            if history is None or len(history["date"]) == 0:
+                missing_symbols.append(symbol)
+            else:
+                histories[symbol] = history
+        return histories, missing_symbols
+
+    def get_nav_history(self, portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                        reinvest_dividends: bool = False) -> dict:
+        """
+        Daily value of the current holdings of the portfolio, with the cumulative return and the drawdown.
+        The series starts on the first day every holding has a price, so a recent listing shortens it.
+        With reinvest_dividends the dividends are reinvested in the stock that paid them (total return).
+        """
+        start, end = _window(start, end)
+        positions = self.get_positions(portfolio_id)
+        dates, symbols, matrix, missing_symbols = self.load_close_matrix(list(positions), start, end)
+
+        # drop the leading days on which some holding has no price yet
+        complete = ~np.isnan(matrix).any(axis=1) if matrix.size else np.zeros(len(dates), dtype=bool)
+        first = int(np.argmax(complete)) if complete.any() else len(dates)
+        dates, matrix = dates[first:], matrix[first:]
+
+        if reinvest_dividends and len(dates):
+            # shares grow by the adjustment factor of each day over the one of the first day
+            factors = DividendService(self.db, self.market_data).get_factors(symbols)
+            for column, symbol in enumerate(symbols):
+                adjustment = factors[symbol].factors(dates)
+                matrix[:, column] *= adjustment / adjustment[0]
+
+        quantities = np.array([positions[symbol] for symbol in symbols], dtype=np.float64)
+        series = nav_series(matrix, quantities)
+
+        points = []
+        max_drawdown = None
+        max_drawdown_date = None
+        if len(dates):
+            trough = int(np.nanargmin(series["drawdown"])) if not np.isnan(series["drawdown"]).all() else 0
+            max_drawdown = _float(series["drawdown"][trough])
+            max_drawdown_date = dates[trough].astype(object)
+            points = [
+                {"date": day, "nav": nav, "cumulative_return": cumulative_return, "drawdown": drawdown}
+                for day, nav, cumulative_return, drawdown in zip(
+                    dates.astype(object).tolist(),
+                    np.round(series["nav"], 2).tolist(),
+                    _nan_to_none(series["cumulative_return"]),
+                    _nan_to_none(series["drawdown"]),
+                )
+            ]
+
+        return {
+            "portfolio_id": portfolio_id,
+            "start": points[0]["date"] if points else start,
+            "end": points[-1]["date"] if points else end,
+            "symbols": symbols,
+            "missing_symbols": missing_symbols,
+            "dividends_reinvested": reinvest_dividends,
+            "total_return": points[-1]["cumulative_return"] if points else None,
+            "max_drawdown": max_drawdown,
+            "max_drawdown_date": max_drawdown_date,
+            "points": points,
+        }
+
+    def get_risk(self, portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                 confidence: float = 0.95) -> dict:
+        """
+        Volatility, beta against the benchmark, one day historical and parametric VaR / CVaR and the
+        covariance and correlation of the daily log returns of the current holdings.
+        Holdings are weighted by their value at the last close of the window.
+        """
+        if not 0.5 < confidence < 1:
+            raise ValueError("confidence must be between 0.5 and 1")
+        start, end = _window(start, end)
+        positions = self.get_positions(portfolio_id)
+        matrix = self.load_return_matrix(list(positions), start, end)
+        symbols = matrix.symbols
+        missing_symbols = sorted(set(positions).difference(symbols))
+
+        values = np.array([positions[symbol] for symbol in symbols], dtype=np.float64) * matrix.last_closes
+        values = np.nan_to_num(values)
+        market_value = float(values.sum())
+        weights = values / market_value if market_value else np.zeros(len(symbols))
+
+        covariance = np.nan_to_num(matrix.covariance)
+        volatilities = np.sqrt(np.clip(np.diag(covariance), 0, None))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = matrix.covariance / np.outer(volatilities, volatilities)
+        benchmark = matrix.benchmark[~np.isnan(matrix.benchmark)]
+        benchmark_variance = float(benchmark.var(ddof=1)) if len(benchmark) > 1 else np.nan
+        holding_covariances, _ = covariance_with(matrix.returns, matrix.benchmark)
+        betas = holding_covariances / benchmark_variance if benchmark_variance > 0 else np.full(len(symbols), np.nan)
+
+        # daily simple returns of the portfolio, each day weighted over the holdings that have a price
+        simple_returns = np.expm1(matrix.returns)
+        present = ~np.isnan(simple_returns)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            portfolio_returns = np.nan_to_num(simple_returns) @ weights / (present @ weights)
+        portfolio_returns = portfolio_returns[np.isfinite(portfolio_returns)]
+
+        daily_volatility = float(np.sqrt(max(weights @ covariance @ weights, 0.0)))
+        mean_return = float(weights @ np.nan_to_num(np.nanmean(matrix.returns, axis=0))) if len(matrix.returns) else 0.0
+        tail = 1 - confidence
+        z = NormalDist().inv_cdf(confidence)
+
+        historical = {"var": None, "cvar": None}
+        if len(portfolio_returns):
+            cutoff = float(np.quantile(portfolio_returns, tail))
+            historical = {"var": -cutoff, "cvar": -float(portfolio_returns[portfolio_returns <= cutoff].mean())}
+        parametric = {
+            "var": -(mean_return - z * daily_volatility),
+            "cvar": -(mean_return - daily_volatility * NormalDist().pdf(z) / tail),
+        }
+        for figures in (historical, parametric):
+            figures["var_amount"] = figures["var"] * market_value if figures["var"] is not None else None
+            figures["cvar_amount"] = figures["cvar"] * market_value if figures["cvar"] is not None else None
+
+        return {
+            "portfolio_id": portfolio_id,
+            "start": start,
+            "end": end,
+            "benchmark": RISK_BENCHMARK_SYMBOL,
+            "observations": len(portfolio_returns),
+            "confidence": confidence,
+            "market_value": market_value,
+            "volatility": daily_volatility * np.sqrt(TRADING_DAYS_PER_YEAR),
+            "daily_volatility": daily_volatility,
+            "beta": _float(np.nansum(weights * betas)) if not np.isnan(betas).all() else None,
+            "historical": historical,
+            "parametric": parametric,
+            "holdings": [
+                {"stock_symbol": symbol, "weight": weight, "volatility": volatility, "beta": beta}
+                for symbol, weight, volatility, beta in zip(
+                    symbols, weights.tolist(), (volatilities * np.sqrt(TRADING_DAYS_PER_YEAR)).tolist(), _nan_to_none(betas)
+                )
+            ],
+            "missing_symbols": missing_symbols,
+            "symbols": symbols,
+            "covariance": [_nan_to_none(row) for row in matrix.covariance],
+            "correlation": [_nan_to_none(row) for row in correlation],
+        }
+
+
+# default window is the last year, end is inclusive
+def _window(start: Optional[date], end: Optional[date]) -> Tuple[date, date]:
+    end = end or date.today()
+    start = start or end - timedelta(days=PORTFOLIO_HISTORY_DEFAULT_DAYS)
+    if start > end:
+        raise ValueError("start must be before end")
+    return start, end
+
+
+def _float(value) -> Optional[float]:
+    return None if pd.isna(value) else float(value)
+
+
+def _nan_to_none(values: np.ndarray) -> list:
+    values = np.where(np.isfinite(values), values, np.nan)
+    return [None if value != value else value for value in values.tolist()]
+
+
+# Process wide cache of the return matrices used by the risk endpoint
+return_matrix_cache = ReturnMatrixCache()
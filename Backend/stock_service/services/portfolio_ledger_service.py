@@ -0,0 +1,403 @@
+import os
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, or_
+from sqlalchemy.orm import Session
+
+from models.models import Portfolio, PortfolioHolding, PortfolioPositionSnapshot, PortfolioTransaction, Stock
+
+# a replay of more transactions than this after the latest snapshot writes a new snapshot
+PORTFOLIO_SNAPSHOT_INTERVAL = int(os.getenv("PORTFOLIO_SNAPSHOT_INTERVAL", "50"))
+# largest list of operations the batch endpoint takes in one request
+HOLDINGS_BATCH_MAX_OPERATIONS = int(os.getenv("HOLDINGS_BATCH_MAX_OPERATIONS", "1000"))
+
+TRANSACTION_TYPES = ("buy", "sell", "dividend")
+CENT = Decimal("0.01")
+
+
+class Position:
+    """Quantity, cost basis (average cost method), realized profit / loss and dividends of one stock."""
+
+    __slots__ = ("quantity", "cost_basis", "realized_pl", "dividends")
+
+    def __init__(self, quantity: int = 0, cost_basis: Decimal = Decimal(0), realized_pl: Decimal = Decimal(0),
+                 dividends: Decimal = Decimal(0)):
+        self.quantity = quantity
+        self.cost_basis = Decimal(cost_basis)
+        self.realized_pl = Decimal(realized_pl)
+        self.dividends = Decimal(dividends)
+
+    @property
+    def average_price(self) -> Optional[Decimal]:
+        return self.cost_basis / self.quantity if self.quantity else None
+
+    def apply(self, transaction_type: str, quantity: int, price: Decimal):
+        if transaction_type == "buy":
+            self.cost_basis += quantity * price
+            self.quantity += quantity
+        elif transaction_type == "sell":
+            # the sold shares leave the cost basis at the average cost, the difference to the price is realized
+            sold_cost = self.cost_basis * quantity / self.quantity if self.quantity else Decimal(0)
+            self.realized_pl += quantity * price - sold_cost
+            self.cost_basis -= sold_cost
+            self.quantity -= quantity
+        else:
+            self.dividends += quantity * price
+
+    def to_dict(self, stock_symbol: str) -> dict:
+        average_price = self.average_price
+        return {
+            "stock_symbol": stock_symbol,
+            "quantity": self.quantity,
+            "average_price": float(average_price.quantize(CENT)) if average_price is not None else None,
+            "cost_basis": float(self.cost_basis.quantize(CENT)),
+            "realized_pl": float(self.realized_pl.quantize(CENT)),
+            "dividends": float(self.dividends.quantize(CENT)),
+        }
+
+
+class PortfolioLedgerService:
+    """
+    Trade history of the portfolios. Transactions are only ever appended, positions at any time are rebuilt
+    by replaying the transactions after the latest position snapshot before that time.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def record(self, portfolio_id: int, stock_symbol: str, transaction_type: str, quantity: int, price: Decimal,
+               traded_at: Optional[datetime] = None) -> PortfolioTransaction:
+        """
+        Append a transaction to the ledger, the caller commits it together with its other changes.
+        A transaction dated before the latest snapshots drops them, the next read rebuilds them.
+        """
+        transaction = PortfolioTransaction(**_transaction_row(portfolio_id, stock_symbol, transaction_type, quantity, price, traded_at))
+        self.db.add(transaction)
+        if traded_at is not None:
+            self.db.query(PortfolioPositionSnapshot).filter(
+                PortfolioPositionSnapshot.portfolio_id == portfolio_id,
+                PortfolioPositionSnapshot.traded_at > traded_at
+            ).delete(synchronize_session=False)
+        return transaction
+
+    def record_trade(self, portfolio_id: int, stock_symbol: str, transaction_type: str, quantity: int, price: Decimal,
+                     traded_at: Optional[datetime] = None) -> Tuple[PortfolioTransaction, Optional[PortfolioHolding]]:
+        """
+        Append a buy, sell or dividend, update the holding of the stock with the average cost of the trade and
+        commit both together. Sells are checked against the holding. Returns the transaction and the holding.
+        Nothing is replayed here, the positions and their snapshots are rebuilt by the reads. A trade dated in
+        the past is applied to the holding like a new one, the replayed position report is the exact one then.
+        A sell dated in the past must not make the position negative at its date or at any time after it.
+        Holdings from before the ledger are opened in it by migrations/002_open_portfolio_ledger.sql.
+        """
+        # the portfolio and holding rows stay locked until the commit, concurrent trades of the portfolio wait
+        # for each other instead of rewriting the holding from the same old quantity
+        portfolio = self.db.query(Portfolio.portfolio_id).filter(
+            Portfolio.portfolio_id == portfolio_id
+        ).with_for_update().first()
+        if portfolio is None:
+            raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
+
+        stock_symbol = stock_symbol.upper()
+        holding = self.db.query(PortfolioHolding).filter(
+            PortfolioHolding.portfolio_id == portfolio_id,
+            PortfolioHolding.stock_symbol == stock_symbol
+        ).with_for_update().populate_existing().first()  # the caller may have loaded the holding before the lock
+        held = holding.quantity if holding is not None else 0
+        if transaction_type == "sell":
+            sellable = held if traded_at is None else min(held, self._sellable_at(portfolio_id, stock_symbol, traded_at))
+            if quantity > sellable:
+                when = f" on {traded_at.date()}" if traded_at is not None else ""
+                raise ValueError(f"Can not sell {quantity} {stock_symbol}{when}, the portfolio holds {sellable}")
+
+        transaction = self.record(portfolio_id, stock_symbol, transaction_type, quantity, price, traded_at)
+        if transaction_type != "dividend":
+            position = Position(held, held * (holding.average_price or Decimal(0)) if held else Decimal(0))
+            position.apply(transaction_type, quantity, transaction.price)
+            holding = self.materialize_holding(portfolio_id, stock_symbol, position, holding)
+        self.db.commit()
+        return transaction, holding
+
+    def close_holding(self, holding: PortfolioHolding):
+        """Sell what is left of the holding at its average price and delete it, the caller commits."""
+        if holding.quantity > 0:
+            self.record(holding.portfolio_id, holding.stock_symbol, "sell", holding.quantity,
+                        Decimal(holding.average_price or 0).quantize(CENT))
+        self.db.delete(holding)
+
+    def apply_operations(self, portfolio_id: int, operations: List[dict], all_or_nothing: bool = False) -> dict:
+        """
+        Apply a list of buy / sell / delete operations ({"op", "symbol", "quantity", "price"}) with one commit.
+        The symbols are checked with one query, the positions are updated in memory and only the
+        holdings that changed are written. Failed operations are reported and skipped, with all_or_nothing
+        a single failure leaves the portfolio untouched.
+        """
+        if len(operations) > HOLDINGS_BATCH_MAX_OPERATIONS:
+            raise ValueError(f"At most {HOLDINGS_BATCH_MAX_OPERATIONS} operations can be sent at once")
+        portfolio = self.db.query(Portfolio.portfolio_id).filter(Portfolio.portfolio_id == portfolio_id).first()
+        if portfolio is None:
+            raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
+
+        symbols = {operation["symbol"].upper() for operation in operations}
+        known_symbols = {row.stock_symbol.upper() for row in self.db.query(Stock.stock_symbol).filter(Stock.stock_symbol.in_(symbols)).all()}
+        holdings = {
+            holding.stock_symbol.upper(): holding
+            for holding in self.db.query(PortfolioHolding).filter(PortfolioHolding.portfolio_id == portfolio_id).all()
+        }
+        positions = self.get_positions(portfolio_id)
+
+        results = []
+        transaction_rows = []  # inserted with one statement at the end
+        deleted = set()  # symbols whose last operation was a delete
+        for index, operation in enumerate(operations):
+            op = operation["op"]
+            symbol = operation["symbol"].upper()
+            quantity = operation.get("quantity")
+            price = operation.get("price")
+            result = {"index": index, "op": op, "symbol": symbol, "status": "applied", "error": None,
+                      "holding_id": None, "quantity": None, "average_price": None}
+            try:
+                if symbol not in known_symbols:
+                    raise ValueError(f"Stock {symbol} not found")
+                position = self._open_holding(positions, holdings.get(symbol)) if symbol in holdings else positions.setdefault(symbol, Position())
+                if op == "delete":
+                    # a stock bought earlier in the batch has no holding row yet but can be deleted too
+                    if symbol in deleted or (symbol not in holdings and not position.quantity):
+                        raise ValueError(f"The portfolio has no {symbol} holding")
+                    quantity = position.quantity
+                    price = position.average_price if quantity else None
+                    deleted.add(symbol)
+                elif op in ("buy", "sell"):
+                    if not quantity or quantity <= 0:
+                        raise ValueError("Quantity must be positive")
+                    if op == "buy" and price is None:
+                        raise ValueError("Price is required for a buy")
+                    if op == "sell" and quantity > position.quantity:
+                        raise ValueError(f"Can not sell {quantity} {symbol}, the portfolio holds {position.quantity}")
+                    if op == "sell" and price is None:
+                        price = position.average_price
+                    deleted.discard(symbol)
+                else:
+                    raise ValueError("Operation must be buy, sell or delete")
+
+                if quantity:
+                    row = _transaction_row(portfolio_id, symbol, "buy" if op == "buy" else "sell", quantity, Decimal(str(price)))
+                    transaction_rows.append(row)
+                    position.apply(row["transaction_type"], quantity, row["price"])
+                result["quantity"] = position.quantity
+                result["average_price"] = float(position.average_price.quantize(CENT)) if position.quantity else None
+            except (ValueError, ArithmeticError) as e:
+                result.update(status="failed", error=str(e))
+            results.append(result)
+
+        failed = sum(1 for result in results if result["status"] == "failed")
+        if failed and all_or_nothing:
+            self.db.rollback()
+            for result in results:
+                if result["status"] == "applied":
+                    result.update(status="skipped", quantity=None, average_price=None)
+            return {"portfolio_id": portfolio_id, "applied": 0, "failed": failed, "results": results}
+
+        if transaction_rows:
+            self.db.execute(insert(PortfolioTransaction), transaction_rows)
+        # write the holdings of the stocks that were traded
+        touched = {result["symbol"] for result in results if result["status"] == "applied"}
+        for symbol in touched:
+            if symbol in deleted:
+                if symbol in holdings:
+                    self.db.delete(holdings.pop(symbol))
+                continue
+            if symbol not in holdings:
+                if positions[symbol].quantity == 0:
+                    continue
+                holdings[symbol] = PortfolioHolding(portfolio_id=portfolio_id, stock_symbol=symbol)
+                self.db.add(holdings[symbol])
+            self.materialize_holding(portfolio_id, symbol, positions[symbol], holdings[symbol])
+        self.db.flush()
+        holding_ids = {symbol: holding.holding_id for symbol, holding in holdings.items() if holding is not None}
+        self.db.commit()
+
+        for result in results:
+            if result["status"] == "applied":
+                result["holding_id"] = holding_ids.get(result["symbol"])
+        return {"portfolio_id": portfolio_id, "applied": len(results) - failed, "failed": failed, "results": results}
+
+    def get_transactions(self, portfolio_id: int, stock_symbol: Optional[str] = None, start: Optional[date] = None,
+                         end: Optional[date] = None) -> List[PortfolioTransaction]:
+        query = self.db.query(PortfolioTransaction).filter(PortfolioTransaction.portfolio_id == portfolio_id)
+        if stock_symbol:
+            query = query.filter(PortfolioTransaction.stock_symbol == stock_symbol.upper())
+        if start:
+            query = query.filter(PortfolioTransaction.traded_at >= datetime.combine(start, time.min))
+        if end:
+            query = query.filter(PortfolioTransaction.traded_at < _end_of_day(end))
+        return query.order_by(PortfolioTransaction.traded_at, PortfolioTransaction.transaction_id).all()
+
+    def get_positions(self, portfolio_id: int, as_of: Optional[date] = None) -> Dict[str, Position]:
+        """
+        Positions of every stock the portfolio has traded, at the end of the as_of day or now.
+        Starts from the latest snapshot before that time and replays the transactions after it.
+        """
+        before = _end_of_day(as_of) if as_of is not None else None
+
+        snapshot_query = self.db.query(
+            PortfolioPositionSnapshot.transaction_id, PortfolioPositionSnapshot.traded_at
+        ).filter(PortfolioPositionSnapshot.portfolio_id == portfolio_id)
+        if before is not None:
+            snapshot_query = snapshot_query.filter(PortfolioPositionSnapshot.traded_at < before)
+        snapshot = snapshot_query.order_by(
+            PortfolioPositionSnapshot.traded_at.desc(), PortfolioPositionSnapshot.transaction_id.desc()
+        ).first()
+
+        positions: Dict[str, Position] = {}
+        transaction_query = self.db.query(
+            PortfolioTransaction.transaction_id,
+            PortfolioTransaction.stock_symbol,
+            PortfolioTransaction.transaction_type,
+            PortfolioTransaction.quantity,
+            PortfolioTransaction.price,
+            PortfolioTransaction.traded_at,
+        ).filter(PortfolioTransaction.portfolio_id == portfolio_id)
+        if snapshot is not None:
+            rows = self.db.query(PortfolioPositionSnapshot).filter(
+                PortfolioPositionSnapshot.portfolio_id == portfolio_id,
+                PortfolioPositionSnapshot.transaction_id == snapshot.transaction_id
+            ).all()
+            for row in rows:
+                positions[row.stock_symbol] = Position(row.quantity, row.cost_basis, row.realized_pl, row.dividends)
+            # transactions ordered after the snapshot's one
+            transaction_query = transaction_query.filter(or_(
+                PortfolioTransaction.traded_at > snapshot.traded_at,
+                and_(PortfolioTransaction.traded_at == snapshot.traded_at,
+                     PortfolioTransaction.transaction_id > snapshot.transaction_id)
+            ))
+        if before is not None:
+            transaction_query = transaction_query.filter(PortfolioTransaction.traded_at < before)
+        transactions = transaction_query.order_by(PortfolioTransaction.traded_at, PortfolioTransaction.transaction_id).all()
+
+        for transaction in transactions:
+            position = positions.setdefault(transaction.stock_symbol, Position())
+            position.apply(transaction.transaction_type, transaction.quantity, Decimal(transaction.price))
+
+        if len(transactions) >= PORTFOLIO_SNAPSHOT_INTERVAL:
+            self._save_snapshot(portfolio_id, transactions[-1], positions)
+        return positions
+
+    def get_position_report(self, portfolio_id: int, as_of: Optional[date] = None) -> dict:
+        portfolio = self.db.query(Portfolio.portfolio_id).filter(Portfolio.portfolio_id == portfolio_id).first()
+        if portfolio is None:
+            raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
+
+        positions = self.get_positions(portfolio_id, as_of)
+        self.db.commit()  # keeps the snapshot the replay may have written
+        return {
+            "portfolio_id": portfolio_id,
+            "as_of": as_of or date.today(),
+            "positions": [positions[symbol].to_dict(symbol) for symbol in sorted(positions)],
+            "total_cost_basis": float(sum((p.cost_basis for p in positions.values()), Decimal(0)).quantize(CENT)),
+            "total_realized_pl": float(sum((p.realized_pl for p in positions.values()), Decimal(0)).quantize(CENT)),
+            "total_dividends": float(sum((p.dividends for p in positions.values()), Decimal(0)).quantize(CENT)),
+        }
+
+    def materialize_holding(self, portfolio_id: int, stock_symbol: str, position: Position,
+                            holding: Optional[PortfolioHolding] = None) -> Optional[PortfolioHolding]:
+        """Write the position of the stock to its holding row, the caller commits."""
+        if holding is None:
+            holding = self.db.query(PortfolioHolding).filter(
+                PortfolioHolding.portfolio_id == portfolio_id,
+                PortfolioHolding.stock_symbol == stock_symbol
+            ).first()
+        if holding is None:
+            if position.quantity == 0:
+                return None
+            holding = PortfolioHolding(portfolio_id=portfolio_id, stock_symbol=stock_symbol)
+            self.db.add(holding)
+        holding.quantity = position.quantity
+        if position.quantity:
+            holding.average_price = position.average_price.quantize(CENT)
+        return holding
+
+    def _open_holding(self, positions: Dict[str, Position], holding: Optional[PortfolioHolding]) -> Position:
+        """
+        Position of the holding's stock in the replayed ledger. Holdings from before the ledger have no
+        transactions, they get an opening buy at their average price on their first trade.
+        """
+        if holding is None:
+            return Position()
+        position = positions.get(holding.stock_symbol.upper())
+        if position is None:
+            position = positions[holding.stock_symbol.upper()] = Position()
+            if holding.quantity > 0:
+                opening = self.record(holding.portfolio_id, holding.stock_symbol, "buy", holding.quantity,
+                                      holding.average_price or Decimal(0), holding.added_at or datetime.utcnow())
+                position.apply("buy", opening.quantity, opening.price)
+        return position
+
+    def _sellable_at(self, portfolio_id: int, stock_symbol: str, traded_at: datetime) -> int:
+        """
+        Most shares a sell dated traded_at can take: the smallest position of the stock in the ledger
+        from that time on, so that the sell does not leave any later position negative.
+        """
+        rows = self.db.query(
+            PortfolioTransaction.transaction_type, PortfolioTransaction.quantity, PortfolioTransaction.traded_at
+        ).filter(
+            PortfolioTransaction.portfolio_id == portfolio_id,
+            PortfolioTransaction.stock_symbol == stock_symbol,
+            PortfolioTransaction.transaction_type != "dividend"
+        ).order_by(PortfolioTransaction.traded_at, PortfolioTransaction.transaction_id).all()
+
+        quantity = 0
+        sellable = None
+        for row in rows:
+            if sellable is None and row.traded_at > traded_at:
+                sellable = quantity  # the position the sell would be applied to
+            quantity += row.quantity if row.transaction_type == "buy" else -row.quantity
+            if sellable is not None:
+                sellable = min(sellable, quantity)
+        return quantity if sellable is None else sellable
+
+    def _save_snapshot(self, portfolio_id: int, last_transaction, positions: Dict[str, Position]):
+        try:
+            # in a savepoint so that a failed snapshot does not undo the pending changes of the caller
+            with self.db.begin_nested():
+                for symbol, position in positions.items():
+                    self.db.merge(PortfolioPositionSnapshot(
+                        portfolio_id=portfolio_id,
+                        transaction_id=last_transaction.transaction_id,
+                        stock_symbol=symbol,
+                        traded_at=last_transaction.traded_at,
+                        quantity=position.quantity,
+                        cost_basis=position.cost_basis.quantize(CENT),
+                        realized_pl=position.realized_pl.quantize(CENT),
+                        dividends=position.dividends.quantize(CENT),
+                    ))
+        except Exception as e:
+            # snapshots only make the replays shorter, the positions are right without them
+            print(f"An error occurred while saving the position snapshot of portfolio {portfolio_id}: {e}")
+
+
+def _transaction_row(portfolio_id: int, stock_symbol: str, transaction_type: str, quantity: int, price: Decimal,
+                     traded_at: Optional[datetime] = None) -> dict:
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f"Transaction type must be one of {', '.join(TRANSACTION_TYPES)}")
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive")
+    if price < 0:
+        raise ValueError("Price can not be negative")
+    now = datetime.utcnow()
+    return {
+        "portfolio_id": portfolio_id,
+        "stock_symbol": stock_symbol.upper(),
+        "transaction_type": transaction_type,
+        "quantity": quantity,
+        "price": Decimal(price).quantize(CENT),
+        "traded_at": traded_at or now,
+        "created_at": now,
+    }
+
+
+# exclusive upper bound of a day
+def _end_of_day(day: date) -> datetime:
+    return datetime.combine(day + timedelta(days=1), time.min)
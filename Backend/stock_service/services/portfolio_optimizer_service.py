@@ -0,0 +1,216 @@
+import os
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from services.portfolio_analytics_service import (
+    RETURN_MATRIX_CACHE_TTL_SECONDS, TRADING_DAYS_PER_YEAR, PortfolioAnalyticsService, _window
+)
+from utils.market_data_provider import MarketDataProvider
+from utils.quote_cache import QuoteCache
+
+# number of portfolios on the sampled efficient frontier and iterations of the long only solver
+FRONTIER_POINTS = int(os.getenv("FRONTIER_POINTS", "50"))
+FRONTIER_MAX_ITERATIONS = int(os.getenv("FRONTIER_MAX_ITERATIONS", "2000"))
+# yearly risk free rate used for the sharpe ratios when the request does not give one
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.0"))
+
+
+def nearest_psd(covariance: np.ndarray) -> np.ndarray:
+    """Covariance with its negative eigenvalues clipped, pairwise covariances are not always positive semi definite."""
+    covariance = (covariance + covariance.T) / 2
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    floor = max(eigenvalues.max(), 0.0) * 1e-10
+    return (eigenvectors * np.clip(eigenvalues, floor, None)) @ eigenvectors.T
+
+
+def project_to_simplex(weights: np.ndarray) -> np.ndarray:
+    """Euclidean projection of every row onto {w >= 0, sum(w) = 1}."""
+    ordered = -np.sort(-weights, axis=1)
+    cumulative = np.cumsum(ordered, axis=1) - 1
+    ranks = np.arange(1, weights.shape[1] + 1)
+    last = (ordered - cumulative / ranks > 0).sum(axis=1) - 1
+    threshold = cumulative[np.arange(len(weights)), last] / (last + 1)
+    return np.maximum(weights - threshold[:, None], 0)
+
+
+def long_only_portfolios(mean: np.ndarray, covariance: np.ndarray, tradeoffs: np.ndarray,
+                         max_iterations: int = FRONTIER_MAX_ITERATIONS, tolerance: float = 1e-10) -> np.ndarray:
+    """
+    Fully invested long only portfolios minimizing w'Cw - t * mean'w, one row per tradeoff t, t = 0 is the
+    minimum variance portfolio. All rows are solved together with accelerated projected gradient steps.
+    """
+    size = len(mean)
+    step = 1 / (2 * max(np.linalg.eigvalsh(covariance).max(), 1e-12))
+    weights = np.full((len(tradeoffs), size), 1 / size)
+    momentum = weights.copy()
+    linear = tradeoffs[:, None] * mean[None, :]
+    acceleration = 1.0
+    for _ in range(max_iterations):
+        gradient = 2 * momentum @ covariance - linear
+        updated = project_to_simplex(momentum - step * gradient)
+        next_acceleration = (1 + np.sqrt(1 + 4 * acceleration ** 2)) / 2
+        momentum = updated + (acceleration - 1) / next_acceleration * (updated - weights)
+        change = np.abs(updated - weights).max()
+        weights, acceleration = updated, next_acceleration
+        if change < tolerance:
+            break
+    return weights
+
+
+def unconstrained_portfolios(mean: np.ndarray, covariance: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Fully invested portfolios (short positions allowed) of minimum variance for each target return, in closed form."""
+    inverse_ones = np.linalg.solve(covariance, np.ones(len(mean)))
+    inverse_mean = np.linalg.solve(covariance, mean)
+    a, b, c = inverse_ones.sum(), inverse_mean.sum(), mean @ inverse_mean
+    d = a * c - b * b
+    if abs(d) < 1e-18:
+        # all expected returns are the same, every target gives the minimum variance portfolio
+        return np.tile(inverse_ones / a, (len(targets), 1))
+    return (np.outer(c - b * targets, inverse_ones) + np.outer(a * targets - b, inverse_mean)) / d
+
+
+class PortfolioOptimizerService:
+    """
+    Mean variance optimization of the current holdings of a portfolio with the expected returns and
+    the covariance of their daily log returns (yearly figures). The sampled frontier is cached per
+    holdings set and window, the requested portfolios are picked from it.
+    """
+
+    def __init__(self, db: Session, market_data: Optional[MarketDataProvider] = None):
+        self.analytics = PortfolioAnalyticsService(db, market_data)
+
+    def optimize(self, portfolio_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                 target_return: Optional[float] = None, risk_free_rate: float = RISK_FREE_RATE,
+                 allow_short: bool = False) -> dict:
+        start, end = _window(start, end)
+        positions = self.analytics.get_positions(portfolio_id)
+        symbols = sorted(positions)
+        key = f"{','.join(symbols)}|{start}|{end}|{'short' if allow_short else 'long'}"
+        model = frontier_cache.get_or_load(key, lambda: self._build_frontier(symbols, start, end, allow_short))
+
+        symbols, mean, covariance, frontier = model["symbols"], model["mean"], model["covariance"], model["frontier"]
+        missing_symbols = sorted(set(positions).difference(symbols))
+        if not symbols:
+            return {
+                "portfolio_id": portfolio_id, "start": start, "end": end, "symbols": [], "missing_symbols": missing_symbols,
+                "allow_short": allow_short, "risk_free_rate": risk_free_rate, "expected_returns": {}, "volatilities": {},
+                "current": None, "min_variance": None, "max_sharpe": None, "target_return": None, "frontier": [],
+            }
+
+        def describe(weights: np.ndarray) -> dict:
+            expected_return = float(weights @ mean)
+            volatility = float(np.sqrt(max(weights @ covariance @ weights, 0.0)))
+            return {
+                "weights": dict(zip(symbols, np.round(weights, 6).tolist())),
+                "expected_return": expected_return,
+                "volatility": volatility,
+                "sharpe": (expected_return - risk_free_rate) / volatility if volatility > 0 else None,
+            }
+
+        values = np.array([positions[symbol] for symbol in symbols], dtype=np.float64) * model["last_closes"]
+        values = np.nan_to_num(values)
+        current = describe(values / values.sum()) if values.sum() > 0 else None
+
+        frontier_returns = frontier @ mean
+        frontier_volatilities = np.sqrt(np.clip(np.einsum("ij,jk,ik->i", frontier, covariance, frontier), 0, None))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sharpes = (frontier_returns - risk_free_rate) / frontier_volatilities
+        sharpes[~np.isfinite(sharpes)] = -np.inf
+        best = int(np.argmax(sharpes))
+        if allow_short:
+            max_sharpe = self._tangency(mean, covariance, risk_free_rate)
+            max_sharpe = describe(max_sharpe) if max_sharpe is not None else describe(frontier[best])
+        else:
+            # refine between the neighbours of the best sampled portfolio
+            candidates = frontier[max(best - 1, 0): best + 2]
+            alphas = np.linspace(0, 1, 21)[:, None]
+            refined = np.vstack([(1 - alphas) * candidates[i] + alphas * candidates[i + 1] for i in range(len(candidates) - 1)] or [candidates])
+            refined_sharpes = (refined @ mean - risk_free_rate) / np.sqrt(np.clip(np.einsum("ij,jk,ik->i", refined, covariance, refined), 1e-300, None))
+            max_sharpe = describe(refined[int(np.argmax(refined_sharpes))])
+
+        target = None
+        if target_return is not None:
+            target = self._target_portfolio(mean, covariance, frontier, frontier_returns, target_return, allow_short)
+            target = describe(target) if target is not None else None
+
+        return {
+            "portfolio_id": portfolio_id,
+            "start": start,
+            "end": end,
+            "symbols": symbols,
+            "missing_symbols": missing_symbols,
+            "allow_short": allow_short,
+            "risk_free_rate": risk_free_rate,
+            "expected_returns": dict(zip(symbols, mean.tolist())),
+            "volatilities": dict(zip(symbols, np.sqrt(np.diag(covariance)).tolist())),
+            "current": current,
+            "min_variance": describe(model["min_variance"]),
+            "max_sharpe": max_sharpe,
+            "target_return": target,
+            "frontier": [
+                {"expected_return": expected_return, "volatility": volatility, "sharpe": sharpe if np.isfinite(sharpe) else None}
+                for expected_return, volatility, sharpe in zip(frontier_returns.tolist(), frontier_volatilities.tolist(), sharpes.tolist())
+            ],
+        }
+
+    def _build_frontier(self, symbols: List[str], start: date, end: date, allow_short: bool) -> dict:
+        matrix = self.analytics.load_return_matrix(symbols, start, end)
+        # columns in a fixed order, the cached return matrix may have them in the order they were added
+        order = sorted(range(len(matrix.symbols)), key=lambda i: matrix.symbols[i])
+        symbols = [matrix.symbols[i] for i in order]
+        if not symbols:
+            return {"symbols": [], "mean": None, "covariance": None, "last_closes": None, "frontier": None, "min_variance": None}
+
+        returns = matrix.returns[:, order]
+        mean = np.nan_to_num(np.nanmean(returns, axis=0)) * TRADING_DAYS_PER_YEAR
+        covariance = nearest_psd(np.nan_to_num(matrix.covariance[np.ix_(order, order)]) * TRADING_DAYS_PER_YEAR)
+
+        if allow_short:
+            min_variance = np.linalg.solve(covariance, np.ones(len(mean)))
+            min_variance /= min_variance.sum()
+            targets = np.linspace(min_variance @ mean, max(mean.max(), min_variance @ mean), FRONTIER_POINTS)
+            frontier = unconstrained_portfolios(mean, covariance, targets)
+        else:
+            # tradeoffs from 0 (minimum variance) to where the expected return dominates (the best single stock)
+            spread = max(mean.max() - mean.min(), 1e-12)
+            scale = 2 * np.trace(covariance) / len(mean) / spread
+            tradeoffs = np.concatenate([[0.0], np.geomspace(1e-3, 1e3, FRONTIER_POINTS - 1) * scale])
+            frontier = long_only_portfolios(mean, covariance, tradeoffs)
+            frontier = frontier[np.argsort(frontier @ mean, kind="stable")]
+            min_variance = frontier[0]
+        return {
+            "symbols": symbols,
+            "mean": mean,
+            "covariance": covariance,
+            "last_closes": matrix.last_closes[order],
+            "frontier": frontier,
+            "min_variance": min_variance,
+        }
+
+    @staticmethod
+    def _tangency(mean: np.ndarray, covariance: np.ndarray, risk_free_rate: float) -> Optional[np.ndarray]:
+        excess = np.linalg.solve(covariance, mean - risk_free_rate)
+        if excess.sum() <= 0:
+            return None  # no portfolio beats the risk free rate
+        return excess / excess.sum()
+
+    @staticmethod
+    def _target_portfolio(mean: np.ndarray, covariance: np.ndarray, frontier: np.ndarray, frontier_returns: np.ndarray,
+                          target_return: float, allow_short: bool) -> Optional[np.ndarray]:
+        if allow_short:
+            return unconstrained_portfolios(mean, covariance, np.array([target_return]))[0]
+        if not frontier_returns[0] <= target_return <= frontier_returns[-1]:
+            return None  # not reachable without short positions
+        # mix of the two frontier portfolios around the target, it is long only and has exactly the target return
+        upper = min(int(np.searchsorted(frontier_returns, target_return)), len(frontier) - 1)
+        lower = max(upper - 1, 0)
+        spread = frontier_returns[upper] - frontier_returns[lower]
+        alpha = (target_return - frontier_returns[lower]) / spread if spread > 0 else 0.0
+        return (1 - alpha) * frontier[lower] + alpha * frontier[upper]
+
+
+# Process wide cache of the sampled frontiers per holdings set, window and short selling
+frontier_cache = QuoteCache(ttl_seconds=RETURN_MATRIX_CACHE_TTL_SECONDS, max_entries=64)
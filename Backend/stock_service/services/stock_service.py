@@ -1,17 +1,123 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import date
 from decimal import Decimal
 from typing import List, Optional
-import yfinance as yf  # New import
 from datetime import datetime  # New import
+import numpy as np
 import pandas as pd
 from models.models import *
 from datetime import timedelta
+import asyncio
+import math
+import os
+from collections import defaultdict
+from sqlalchemy import func
+from concurrent.futures import ThreadPoolExecutor
+from utils.quote_cache import info_cache, quote_cache
+from utils.market_data_provider import MarketDataProvider, market_data_provider
+from utils.upstream_guard import UnknownSymbolError, UpstreamUnavailableError
+from utils.rate_limiter import Priority, call_priority
+from utils.price_store import price_store
+from utils.db_upsert import upsert_rows
+from services.portfolio_ledger_service import PortfolioLedgerService
+
+# limits of the concurrent upstream calls when the details of all stocks are fetched
+STOCK_DETAIL_CONCURRENCY = int(os.getenv("STOCK_DETAIL_CONCURRENCY", "16"))
+STOCK_DETAIL_TIMEOUT_SECONDS = float(os.getenv("STOCK_DETAIL_TIMEOUT_SECONDS", "10"))
+
+# blocking market data calls run in this pool so that they do not block the event loop
+# a timed out call keeps its thread until the upstream returns, so the pool has room for a few of them
+upstream_executor = ThreadPoolExecutor(max_workers=2 * STOCK_DETAIL_CONCURRENCY, thread_name_prefix="market-data")
+
+# compares a stored DECIMAL / FLOAT column with a freshly fetched value
+def _same_value(stored, new) -> bool:
+    if stored is None or new is None:
+        return stored is None and new is None
+    return math.isclose(float(stored), float(new), rel_tol=1e-6, abs_tol=0.005)
+
+# db column -> yahoo finance line item of each quarterly statement
+INCOME_STATEMENT_ITEMS = {
+    "revenue": "Total Revenue",
+    "gross_profit": "Gross Profit",
+    "operating_income": "Operating Income",
+    "net_profit": "Net Income",
+    "eps": "Earnings Per Share",
+}
+BALANCE_SHEET_ITEMS = {
+    "total_assets": "Total Assets",
+    "total_liabilities": "Total Liabilities Net Minority Interest",
+    "total_equity": "Ordinary Shares Number",
+    "current_assets": "Current Assets",
+    "current_liabilities": "Current Liabilities",
+}
+CASH_FLOW_ITEMS = {
+    "operating_cash_flow": "Net Cash Provided by Operating Activities",
+    "investing_cash_flow": "Net Cash Used for Investing Activities",
+    "financing_cash_flow": "Net Cash Used Provided by Financing Activities",
+    "free_cash_flow": "Free Cash Flow",
+    "capital_expenditures": "Capital Expenditure",
+}
+
+# turns a yahoo finance statement (line items x quarters) into the quarter dates and one float array per db column
+# line items that are missing from the statement become nan arrays
+def _statement_columns(statement: pd.DataFrame, items: dict) -> tuple:
+    if not statement.index.is_unique:
+        statement = statement[~statement.index.duplicated()]
+    values = statement.reindex(list(items.values()))
+    try:
+        matrix = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    except (TypeError, ValueError):
+        matrix = values.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    quarters = list(pd.to_datetime(statement.columns).date)
+    return quarters, dict(zip(items, matrix))
+
+# insert ready rows of a statement, amounts are rounded to cents like the DECIMAL(20, 2) columns
+# and nan / inf values become None
+def _statement_rows(stock_symbol: str, quarters: list, columns: dict, float_columns=()) -> List[dict]:
+    names = list(columns)
+    matrix = np.vstack([columns[name] if name in float_columns else np.round(columns[name], 2) for name in names])
+    matrix[~np.isfinite(matrix)] = np.nan
+
+    rows = []
+    for quarter, values in zip(quarters, matrix.T.tolist()):
+        row = {"stock_symbol": stock_symbol, "quarter": quarter}
+        row.update((name, None if value != value else value) for name, value in zip(names, values))  # nan != nan
+        rows.append(row)
+    return rows
+
+# look back of the predefined price points in calendar days, the order is the order of the responses
+PREDEFINED_PERIODS = {
+    "1W": 7,
+    "1M": 30,
+    "3M": 90,
+    "6M": 180,
+    "1Y": 365,
+    "3Y": 3 * 365,
+    "5Y": 5 * 365,
+}
+
+# positions of the trading days closest to each target date, dates must be sorted ascending
+# on a tie the earlier day wins, like min() over the index did before
+def _nearest_positions(dates: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    if len(dates) == 1:
+        return np.zeros(len(targets), dtype=np.int64)
+    right = np.searchsorted(dates, targets, side="left").clip(1, len(dates) - 1)
+    left = right - 1
+    return np.where(dates[right] - targets < targets - dates[left], right, left)
+
 
 class StockService:
-    def __init__(self, db: Session):
+    # market data (yahoo finance by default) is injected so that the service can run offline in load tests
+    def __init__(self, db: Session, market_data: Optional[MarketDataProvider] = None):
         self.db = db
+        self.market_data = market_data or market_data_provider
+
+    # info dicts are shared through the process wide quote cache
+    # so that concurrent requests for the same symbol make only one upstream call
+    def _get_ticker_info(self, symbol: str) -> dict:
+        symbol = symbol.upper()
+        return quote_cache.get_or_load(symbol, lambda: self.market_data.get_info(symbol))
 
 
     # Using yahoo finance to create a stock and related sector object
@@ -25,10 +131,7 @@ class StockService:
         if stock:
             raise ValueError(f"Stock with symbol {symbol} already exists")
         
-        # add .IS to the end of the stock symbol since yahoo finance excepts that
-        symbol += ".IS"
-        stock = yf.Ticker(symbol)
-        info = stock.info
+        info = self.market_data.get_info(symbol)
 
         sector_info = info.get("industry", None)
         if sector_info is None:
@@ -44,7 +147,7 @@ class StockService:
         
         # then create the stock object
         stock = Stock(
-            stock_symbol= symbol[:-3], # remove .IS from the end since we keep the symbol without .IS in the db
+            stock_symbol= symbol,
             name=info.get("longName", None),
             sector_id= sector_obj.sector_id,
             market_cap=  Decimal(info.get("marketCap", 0))
@@ -100,16 +203,14 @@ class StockService:
     
     # function to get detailed info about a stock using yahoo finance
     def get_stock_info(self, symbol: str) -> dict:
-        #check if the stock exists in the db
-        stock = self.db.query(Stock).filter(Stock.stock_symbol == symbol).first()
-
-        stock_symbol = symbol.upper()
-        # add .IS to the end of the stock symbol since yahoo finance excepts that
-        stock_symbol += ".IS"
-
-        stock = yf.Ticker(stock_symbol)
-        info = stock.info
+        info, _ = self.get_stock_info_with_age(symbol)
         return info
+
+    # stock info served stale-while-revalidate, only a missing or hard expired entry waits for yahoo finance
+    # returns the info and how many seconds old it is
+    def get_stock_info_with_age(self, symbol: str) -> tuple:
+        symbol = symbol.upper()
+        return info_cache.get_or_load_stale(symbol, lambda: self.market_data.get_info(symbol))
     
     def get_sector_of_stock(self, symbol: str) -> Optional[Sector]:
         symbol = symbol.upper() # Ensure symbol is uppercase
@@ -124,22 +225,46 @@ class StockService:
         return self.db.query(Stock).all()
     
     # bu function returns all stocks in detail, using yahoo finance
-    def get_all_stocks_in_detail(self):
+    async def get_all_stocks_in_detail(
+        self,
+        concurrency: int = STOCK_DETAIL_CONCURRENCY,
+        timeout_seconds: float = STOCK_DETAIL_TIMEOUT_SECONDS
+    ) -> tuple:
         """
             Retrieve the stock symbols and names of all stocks in the database.
-            Then using yahoo finance, fetch detailed information about each stock.
+            Then using yahoo finance, fetch detailed information about each stock concurrently,
+            at most `concurrency` calls at a time and each limited to `timeout_seconds`.
+            Returns the infos of the stocks that succeeded and the symbols that failed.
         """
-        stocks = self.db.query(Stock).all()
-        stock_info = []
-        for stock in stocks:
-            stock_symbol = stock.stock_symbol
-            stock_symbol += ".IS"
-            stock = yf.Ticker(stock_symbol)
-            info = stock.info
-
-            info["stock_symbol"] = stock_symbol[:-3]  # remove .IS from the end
-            stock_info.append(info)
-        return stock_info
+        symbols = [row.stock_symbol for row in self.db.query(Stock.stock_symbol).all()]
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        failed_symbols = []
+
+        async def fetch_info(symbol: str) -> Optional[dict]:
+            async with semaphore:
+                try:
+                    info = await asyncio.wait_for(
+                        loop.run_in_executor(upstream_executor, self._get_ticker_info, symbol),
+                        timeout=timeout_seconds
+                    )
+                except asyncio.TimeoutError:
+                    print(f"Fetching info of {symbol} timed out after {timeout_seconds} seconds")
+                    failed_symbols.append(symbol)
+                    return None
+                except Exception as e:
+                    print(f"An error occurred while fetching info of {symbol}: {e}")
+                    failed_symbols.append(symbol)
+                    return None
+
+            # copy since the cached dict is shared with other requests
+            info = dict(info)
+            info["stock_symbol"] = symbol
+            return info
+
+        results = await asyncio.gather(*(fetch_info(symbol) for symbol in symbols))
+        stock_info = [info for info in results if info is not None]
+        return stock_info, failed_symbols
          
     
     # search for stocks by symbol or name
@@ -168,54 +293,18 @@ class StockService:
             # then, start adding data
             stock_symbol = stock_symbol.upper()
 
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-            # Fetch stock data using yfinance 
-            stock_data = yf.download(stock_symbol, start=start_date, end=end_date)
+            # Fetch stock data using the market data provider
+            stock_data = self.market_data.get_closes([stock_symbol], start=start_date, end=end_date)
 
             # Check if data is available
-            if stock_data.empty:
+            if stock_data.empty or stock_symbol not in stock_data.columns:
                 print(f"No data available for {stock_symbol} from {start_date} to {end_date}")
                 return
-            
-            prices = []
-            dates = []
-
-            # Iterate through the data and add closing prices
-            for date, row in stock_data.iterrows():
-                # check whether the las
-
-                # Extract the Close price explicitly using multi-index handling
-                if 'Close' in row.index:
-                    close_price_series = row['Close']
-                    # Ensure close_price is the specific value for the stock
-                    if isinstance(close_price_series, pd.Series):
-                        close_price = close_price_series.get(stock_symbol, None)
-                    else:
-                        close_price = close_price_series
-                else:
-                    close_price = None
-
-                #print(date)
-                #print(close_price)
-                prices.append(close_price)
-                dates.append(date)
-
-            stock_symbol = stock_symbol[:-3]
-            for price, date in zip(prices, dates):
-                # there is no null data in prices
 
-                # Convert to Decimal for compatibility with DECIMAL(10, 2)
-                close_price = Decimal(f"{price:.2f}")
+            # days that are already stored are overwritten instead of failing on the (stock_symbol, date) key
+            rows = self._close_price_rows(stock_data[[stock_symbol]])
+            upsert_rows(self.db, StockPrice, rows, ["stock_symbol", "date"], ["close_price"])
 
-                # Add the stock price record to the database
-                stock_price = StockPrice(
-                    stock_symbol=stock_symbol,
-                    date=date.date(),  # Convert timestamp to date
-                    close_price=close_price,  # Store as Decimal
-                )
-                self.db.add(stock_price)
-            
             # Commit all new records to the database
             self.db.commit()  # Moved this line to commit after adding all prices
             print(f"Closing prices for {stock_symbol} added successfully.")
@@ -224,6 +313,85 @@ class StockService:
             self.db.rollback()  # Rollback in case of an error
             print(f"An error occurred while adding stock prices: {e}")
 
+    def ingest_stock_prices(self, symbols: Optional[List[str]] = None, start_date: Optional[str] = None) -> dict:
+        """
+        Incrementally load close prices into the stock_prices table.
+        For each stock only the days from its latest stored date on are fetched (stocks without any stored
+        price start from start_date, five years ago by default) and all rows are written with bulk upserts.
+        Without symbols every stock in the db is refreshed. Given symbols that are not in the stocks table
+        are not fetched and come back in failed_symbols, their rows would fail the whole write on the foreign key.
+        """
+        failed_symbols = []
+        if symbols:
+            symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+            known = {row.stock_symbol.upper() for row in self.db.query(Stock.stock_symbol).filter(Stock.stock_symbol.in_(symbols)).all()}
+            failed_symbols = [symbol for symbol in symbols if symbol not in known]
+            symbols = [symbol for symbol in symbols if symbol in known]
+        else:
+            symbols = [row.stock_symbol for row in self.db.query(Stock.stock_symbol).all()]
+        if not symbols:
+            return {"symbols": 0, "rows_written": 0, "rows_per_symbol": {}, "failed_symbols": failed_symbols}
+
+        # latest stored date of every stock with one grouped query
+        watermarks = dict(
+            self.db.query(StockPrice.stock_symbol, func.max(StockPrice.date))
+            .filter(StockPrice.stock_symbol.in_(symbols))
+            .group_by(StockPrice.stock_symbol)
+            .all()
+        )
+        default_start = pd.Timestamp(start_date).date() if start_date else date.today() - timedelta(days=5 * 365)
+
+        # the last stored day is fetched again since it may have been stored during the session,
+        # stocks with the same watermark are fetched together with one batched download
+        symbols_by_start = defaultdict(list)
+        for symbol in symbols:
+            symbols_by_start[watermarks.get(symbol) or default_start].append(symbol)
+
+        rows = []
+        for fetch_start, group in symbols_by_start.items():
+            try:
+                # bulk loads leave the interactive share of the upstream budget to the users
+                with call_priority(Priority.BACKGROUND):
+                    closes = self.market_data.get_closes(group, start=fetch_start, end=date.today() + timedelta(days=1))
+            except Exception as e:
+                print(f"An error occurred while fetching stock prices of {group}: {e}")
+                failed_symbols.extend(group)
+                continue
+            rows.extend(self._close_price_rows(closes))
+
+        try:
+            upsert_rows(self.db, StockPrice, rows, ["stock_symbol", "date"], ["close_price"])
+            self.db.commit()
+        except Exception as e:
+            self.db.rollback()
+            print(f"An error occurred while writing stock prices: {e}")
+            raise
+
+        rows_per_symbol = defaultdict(int)
+        for row in rows:
+            rows_per_symbol[row["stock_symbol"]] += 1
+        print(f"Ingested {len(rows)} stock prices for {len(symbols)} stocks")
+        return {
+            "symbols": len(symbols),
+            "rows_written": len(rows),
+            "rows_per_symbol": dict(rows_per_symbol),
+            "failed_symbols": failed_symbols
+        }
+
+    # turns a date x symbol frame of close prices into stock_prices rows, NaN closes are skipped
+    @staticmethod
+    def _close_price_rows(closes: pd.DataFrame) -> List[dict]:
+        stacked = closes.stack().dropna()
+        return [
+            {
+                "stock_symbol": symbol,
+                "date": pd.Timestamp(price_date).date(),
+                # Convert to Decimal for compatibility with DECIMAL(10, 2)
+                "close_price": Decimal(f"{price:.2f}")
+            }
+            for (price_date, symbol), price in stacked.items()
+        ]
+
     # following to adds to db and extract from db
     def get_stock_price_on_date(self, stock_symbol: str, date: str) -> Optional[Decimal]:
         """Retrieve the stock price for a given stock symbol on a specific date."""
@@ -250,37 +418,90 @@ class StockService:
             Using the yahoo finance api, get the current stock price for the given stock symbol
         """
         try:
-            stock_symbol = stock_symbol.upper()
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-            stock = yf.Ticker(stock_symbol)
-            info = stock.info
+            info = self._get_ticker_info(stock_symbol)
             current_price = info.get("currentPrice", None)
             return current_price
+        except (UpstreamUnavailableError, UnknownSymbolError):
+            # answered with 503 / 404 right away
+            raise
         except Exception as e:
             print(f"An error occurred while fetching stock price: {e}")
 
-    # Function to get close price of a stock for a given date range using yahoo finance
+    # Function to get the last price, previous close and sector of many stocks at once
+    def get_quotes(self, symbols: List[str]) -> List[dict]:
+        """
+        Return the last price, previous close and sector for each of the given stock symbols.
+        Prices come from one batched yahoo finance download and sectors from one joined query.
+        """
+        # upper case and remove duplicates but keep the order of the request
+        symbols = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        if not symbols:
+            return []
+
+        sector_rows = self.db.query(Stock.stock_symbol, Sector.sector_id, Sector.name).join(
+            Sector, Stock.sector_id == Sector.sector_id
+        ).filter(Stock.stock_symbol.in_(symbols)).all()
+        sectors = {row.stock_symbol: row for row in sector_rows}
+
+        last_closes = self._get_last_closes(symbols)
+
+        quotes = []
+        for symbol in symbols:
+            last_price, previous_close = last_closes[symbol]
+            sector = sectors.get(symbol)
+            quotes.append({
+                "stock_symbol": symbol,
+                "last_price": last_price,
+                "previous_close": previous_close,
+                "sector_id": sector.sector_id if sector else None,
+                "sector": sector.name if sector else None
+            })
+        return quotes
+
+    def _get_last_closes(self, symbols: List[str]) -> dict:
+        """Last close and the one before it for each symbol from one batched download, None where there is no price."""
+        try:
+            # a few days are enough to have the last two closes even after a weekend or a holiday
+            closes = self.market_data.get_closes(symbols, period="5d")
+        except Exception as e:
+            print(f"An error occurred while fetching stock quotes: {e}")
+            closes = pd.DataFrame()
+
+        last_closes = {}
+        for symbol in symbols:
+            last_price = None
+            previous_close = None
+            if symbol in closes.columns:
+                symbol_closes = closes[symbol].dropna()
+                if len(symbol_closes) > 0:
+                    last_price = float(symbol_closes.iloc[-1])
+                if len(symbol_closes) > 1:
+                    previous_close = float(symbol_closes.iloc[-2])
+            last_closes[symbol] = (last_price, previous_close)
+        return last_closes
+
+    # Function to get close price of a stock for a given date range using yahoo finance
     def get_stock_price_in_range(self, stock_symbol: str, start_date: str, end_date: str) -> List[StockPrice]:
         """
         Retrieve the stock prices for a given stock symbol and date range using Yahoo Finance.
         """
         try:
             stock_symbol = stock_symbol.upper()
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-            stock = yf.Ticker(stock_symbol)
-            stock_data = stock.history(start=start_date, end=end_date)
+            # sliced from the local price store, only the days that are missing locally are fetched upstream
+            history = price_store.get_history(stock_symbol, self.market_data, start=start_date, end=end_date)
             stock_prices = []
-            for date, row in stock_data.iterrows():
-                close_price = Decimal(row['Close'])
+            for price_date, close in zip(history["date"].tolist(), history["close"].tolist()):
+                if close != close:  # skip NaN closes
+                    continue
                 stock_price = StockPrice(
-                    stock_symbol=stock_symbol[:-3],  # remove .IS from the end
-                    date=date.date(),
-                    close_price=close_price
+                    stock_symbol=stock_symbol,
+                    date=price_date,
+                    close_price=Decimal(close)
                 )
                 stock_prices.append(stock_price)
             return stock_prices
+        except (UpstreamUnavailableError, UnknownSymbolError):
+            raise
         except Exception as e:
             print(f"An error occurred while fetching stock prices: {e}")
 
@@ -289,40 +510,76 @@ class StockService:
         if stock is None:
             raise ValueError(f"Stock with symbol {stock_symbol} does not exist")
 
-        stock_symbol += ".IS"
-        stock = yf.Ticker(stock_symbol)
-        stock_data = stock.history(period="5y")
-
-        # Ensure stock_data index is timezone-naive
-        stock_data.index = stock_data.index.tz_localize(None)
-
-        stock_prices = []
-        date_intervals = {
-            "current": date.today(),
-            "one_week" : date.today() - timedelta(days=7),
-            "one_month" : date.today() - timedelta(days=30),
-            "three_months" : date.today() - timedelta(days=90),
-            "six_months" : date.today() - timedelta(days=180),
-            "one_year" : date.today() - timedelta(days=365),
-            "three_years" : date.today() - timedelta(days=3*365),
-            "five_years" : date.today() - timedelta(days=5*365)
-        }
-
-        for target_date in date_intervals.values():
-            # Convert target_date to timezone-naive Timestamp
-            target_timestamp = pd.Timestamp(target_date).tz_localize(None)
-            
-            # find the closest date in the stock data
-            closest_date = min(stock_data.index, key=lambda x: abs(x - target_timestamp))
-            closest_price = stock_data.loc[closest_date]['Close']
-            stock_price = StockPrice(
-                stock_symbol=stock_symbol[:-3],  # remove .IS from the end
-                date=closest_date.date(),
-                close_price=closest_price
+        # last five years (and a few days of margin) from the local price store
+        today = date.today()
+        history = price_store.get_history(stock_symbol, self.market_data, start=today - timedelta(days=5*365 + 7))
+        if len(history["date"]) == 0:
+            return []
+
+        # today first, then 1 week, 1 month ... 5 years ago
+        targets = np.array([today] + [today - timedelta(days=days) for days in PREDEFINED_PERIODS.values()], dtype="datetime64[D]")
+        positions = _nearest_positions(history["date"], targets)
+
+        return [
+            StockPrice(
+                stock_symbol=stock_symbol,
+                date=history["date"][position].astype(object),
+                close_price=float(history["close"][position])
             )
-            stock_prices.append(stock_price)
+            for position in positions
+        ]
 
-        return stock_prices
+    def get_predefined_period_returns(self, symbols: Optional[List[str]] = None) -> tuple:
+        """
+        Last close and the closes nearest to 1W/1M/3M/6M/1Y/3Y/5Y ago with the percentage return of each period,
+        for the given stocks or all stocks. Returns the rows and the symbols whose history could not be loaded.
+        """
+        query = self.db.query(Stock.stock_symbol)
+        if symbols:
+            query = query.filter(Stock.stock_symbol.in_([symbol.upper() for symbol in symbols]))
+        stock_symbols = [row.stock_symbol for row in query.all()]
+
+        today = date.today()
+        targets = np.array([today] + [today - timedelta(days=days) for days in PREDEFINED_PERIODS.values()], dtype="datetime64[D]")
+        start = today - timedelta(days=max(PREDEFINED_PERIODS.values()) + 7)
+
+        def load_history(symbol: str):
+            try:
+                return price_store.get_history(symbol, self.market_data, start=start)
+            except Exception as e:
+                print(f"An error occurred while loading the price history of {symbol}: {e}")
+                return None
+
+        rows = []
+        failed_symbols = []
+        # only symbols whose stored history is stale go upstream, these run concurrently
+        for symbol, history in zip(stock_symbols, upstream_executor.map(load_history, stock_symbols)):
+            if history is None or len(history["date"]) == 0:
+                failed_symbols.append(symbol)
+                continue
+
+            positions = _nearest_positions(history["date"], targets)
+            dates = history["date"][positions]
+            closes = history["close"][positions]
+            # percentage change from each past close to the last close, nan where a close is missing
+            with np.errstate(divide="ignore", invalid="ignore"):
+                returns = (closes[0] / closes[1:] - 1) * 100
+
+            periods = {}
+            for name, period_date, close_price, period_return in zip(PREDEFINED_PERIODS, dates[1:], closes[1:], returns):
+                periods[name] = {
+                    "date": period_date.astype(object),
+                    "close_price": float(close_price) if np.isfinite(close_price) else None,
+                    "return_pct": float(period_return) if np.isfinite(period_return) else None,
+                }
+            rows.append({
+                "stock_symbol": symbol,
+                "date": dates[0].astype(object),
+                "close_price": float(closes[0]) if np.isfinite(closes[0]) else None,
+                "periods": periods,
+            })
+
+        return rows, failed_symbols
 
 
         
@@ -337,42 +594,11 @@ class StockService:
             if stock is None:
                 raise ValueError(f"Stock with symbol {stock_symbol} does not exists")
             
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-
-            stock = yf.Ticker(stock_symbol)
-            income_statement = stock.quarterly_financials
-
-            if income_statement.empty:
-                print(f"No income statement data available for {stock_symbol}.")
-                return
-
-            for quarter, data in income_statement.items():
-                # Strip timestamp from the quarter if it exists
-                quarter_date = datetime.fromisoformat(str(quarter).split()[0]).date()
-
-                # check if revenue is null, if it is, do not add the record
-                if data.get("Total Revenue", 0) is None:
-                    continue
-
-                financial = Financial(
-                    stock_symbol=stock_symbol[:-3], # remove .IS from the end
-                    quarter=quarter_date,
-                    revenue=Decimal(data.get("Total Revenue", 0)) if not pd.isna(data.get("Total Revenue", 0)) else None,
-                    gross_profit=Decimal(data.get("Gross Profit", 0)) if not pd.isna(data.get("Gross Profit", 0)) else None,
-                    operating_income=Decimal(data.get("Operating Income", 0)) if not pd.isna(data.get("Operating Income", 0)) else None,
-                    net_profit=Decimal(data.get("Net Income", 0)) if not pd.isna(data.get("Net Income", 0)) else None,
-                    eps=data.get("Earnings Per Share", None),
-                    operating_margin=(
-                        Decimal(data.get("Operating Income", 0)) / Decimal(data.get("Total Revenue", 1)) * 100
-                        if not pd.isna(data.get("Operating Income", 0)) and not pd.isna(data.get("Total Revenue", 1))
-                        else None
-                    ),
-                )
-                self.db.add(financial)
-
+            income_statement = self.market_data.get_quarterly_financials(stock_symbol)
+            counts = self._save_income_statement(stock_symbol, income_statement)
             self.db.commit()
-            print(f"Income statement data for {stock_symbol[:-3]} added successfully.")
+            print(f"Income statement data for {stock_symbol} added successfully: {counts}")
+            return counts
         except Exception as e:
             self.db.rollback()
             print(f"An error occurred while adding income statement data: {e}")
@@ -387,37 +613,11 @@ class StockService:
             if stock is None:
                 raise ValueError(f"Stock with symbol {stock_symbol} does not exists")
             
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-
-            stock = yf.Ticker(stock_symbol)
-            balance_sheet = stock.quarterly_balancesheet
-
-            if balance_sheet.empty:
-                print(f"No balance sheet data available for {stock_symbol}.")
-                return
-
-            for quarter, data in balance_sheet.items():
-                # Strip timestamp from the quarter if it exists
-                quarter_date = datetime.fromisoformat(str(quarter).split()[0]).date()
-
-                # check if total assets is null, if it is, do not add the record
-                if data.get("Total Assets", 0) is None:
-                    continue
-
-                balance = BalanceSheet(
-                    stock_symbol=stock_symbol[:-3],  # remove .IS from the end
-                    quarter=quarter_date,
-                    total_assets=Decimal(data.get("Total Assets", 0)) if not pd.isna(data.get("Total Assets", 0)) else None,
-                    total_liabilities=Decimal(data.get("Total Liabilities Net Minority Interest", 0)) if not pd.isna(data.get("Total Liabilities Net Minority Interest", 0)) else None,
-                    total_equity=Decimal(data.get("Ordinary Shares Number", 0)) if not pd.isna(data.get("Ordinary Shares Number", 0)) else None,
-                    current_assets=Decimal(data.get("Current Assets", 0)) if not pd.isna(data.get("Current Assets", 0)) else None,
-                    current_liabilities=Decimal(data.get("Current Liabilities", 0)) if not pd.isna(data.get("Current Liabilities", 0)) else None,
-                )
-                self.db.add(balance)
-
+            balance_sheet = self.market_data.get_quarterly_balance_sheet(stock_symbol)
+            counts = self._save_balance_sheet(stock_symbol, balance_sheet)
             self.db.commit()
-            print(f"Balance sheet data for {stock_symbol[:-3]} added successfully.")
+            print(f"Balance sheet data for {stock_symbol} added successfully: {counts}")
+            return counts
         except Exception as e:
             self.db.rollback()
             print(f"An error occurred while adding balance sheet data: {e}")
@@ -432,36 +632,11 @@ class StockService:
             if stock is None:
                 raise ValueError(f"Stock with symbol {stock_symbol} does not exists")
 
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-
-            stock = yf.Ticker(stock_symbol)
-            cash_flow = stock.quarterly_cashflow
-
-            if cash_flow.empty:
-                print(f"No cash flow data available for {stock_symbol}.")
-                return
-
-            for quarter, data in cash_flow.items():
-                quarter_date = datetime.fromisoformat(str(quarter).split()[0]).date()
-
-                # check if operating cash flow is null, if it is, do not add the record
-                if data.get("free_cash_flow", 0) is None:
-                    continue 
-
-                flow = CashFlow(
-                    stock_symbol=stock_symbol[:-3],  # remove .IS from the end
-                    quarter=quarter_date,
-                    operating_cash_flow=Decimal(data.get("Net Cash Provided by Operating Activities", 0)) if not pd.isna(data.get("Net Cash Provided by Operating Activities", 0)) else None,
-                    investing_cash_flow=Decimal(data.get("Net Cash Used for Investing Activities", 0)) if not pd.isna(data.get("Net Cash Used for Investing Activities", 0)) else None,
-                    financing_cash_flow=Decimal(data.get("Net Cash Used Provided by Financing Activities", 0)) if not pd.isna(data.get("Net Cash Used Provided by Financing Activities", 0)) else None,
-                    free_cash_flow=Decimal(data.get("Free Cash Flow", 0)) if not pd.isna(data.get("Free Cash Flow", 0)) else None,
-                    capital_expenditures=Decimal(data.get("Capital Expenditure", 0)) if not pd.isna(data.get("Capital Expenditure", 0)) else None,
-                )
-                self.db.add(flow)
-
+            cash_flow = self.market_data.get_quarterly_cashflow(stock_symbol)
+            counts = self._save_cash_flow(stock_symbol, cash_flow)
             self.db.commit()
-            print(f"Cash flow data for {stock_symbol[:-3]} added successfully.")
+            print(f"Cash flow data for {stock_symbol} added successfully: {counts}")
+            return counts
         except Exception as e:
             self.db.rollback()
             print(f"An error occurred while adding cash flow data: {e}")
@@ -476,30 +651,109 @@ class StockService:
             if stock is None:
                 raise ValueError(f"Stock with symbol {stock_symbol} does not exists")
 
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-
-            stock = yf.Ticker(stock_symbol)
-            dividends = stock.dividends
-
-            if dividends.empty:
-                print(f"No dividend data available for {stock_symbol}.")
-                return
-
-            for date, amount in dividends.items():
-                dividend = Dividend(
-                    stock_symbol=stock_symbol[:-3],  # remove .IS from the end
-                    payment_date=date.date(),
-                    amount=Decimal(amount),
-                )
-                self.db.add(dividend)
-
+            dividends = self.market_data.get_dividends(stock_symbol)
+            counts = self._save_dividends(stock_symbol, dividends)
             self.db.commit()
-            print(f"Dividend data for {stock_symbol[:-3]} added successfully.")
+            print(f"Dividend data for {stock_symbol} added successfully: {counts}")
+            return counts
         except Exception as e:
             self.db.rollback()
             print(f"An error occurred while adding dividend data: {e}")
 
+    def save_fundamentals(self, stock_symbol: str, statements: dict) -> dict:
+        """
+        Write already fetched statements of a stock in one transaction.
+        statements maps "financials", "balance_sheet", "cash_flow" or "dividends" to the frame returned by the provider,
+        missing keys are skipped. Returns the inserted / updated / unchanged counts per statement.
+        """
+        savers = {
+            "financials": self._save_income_statement,
+            "balance_sheet": self._save_balance_sheet,
+            "cash_flow": self._save_cash_flow,
+            "dividends": self._save_dividends,
+        }
+        try:
+            counts = {name: savers[name](stock_symbol, data) for name, data in statements.items()}
+            self.db.commit()
+            return counts
+        except Exception:
+            self.db.rollback()
+            raise
+
+    # following helpers turn a provider frame into rows and upsert them, the caller commits
+    def _save_income_statement(self, stock_symbol: str, income_statement: pd.DataFrame) -> dict:
+        if income_statement.empty:
+            print(f"No income statement data available for {stock_symbol}.")
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        quarters, columns = _statement_columns(income_statement, INCOME_STATEMENT_ITEMS)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            columns["operating_margin"] = columns["operating_income"] / columns["revenue"] * 100
+        rows = _statement_rows(stock_symbol, quarters, columns, float_columns=("eps", "operating_margin"))
+        return self._upsert_statement_rows(Financial, stock_symbol, rows)
+
+    def _save_balance_sheet(self, stock_symbol: str, balance_sheet: pd.DataFrame) -> dict:
+        if balance_sheet.empty:
+            print(f"No balance sheet data available for {stock_symbol}.")
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        quarters, columns = _statement_columns(balance_sheet, BALANCE_SHEET_ITEMS)
+        rows = _statement_rows(stock_symbol, quarters, columns)
+        return self._upsert_statement_rows(BalanceSheet, stock_symbol, rows)
+
+    def _save_cash_flow(self, stock_symbol: str, cash_flow: pd.DataFrame) -> dict:
+        if cash_flow.empty:
+            print(f"No cash flow data available for {stock_symbol}.")
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        quarters, columns = _statement_columns(cash_flow, CASH_FLOW_ITEMS)
+        rows = _statement_rows(stock_symbol, quarters, columns)
+        return self._upsert_statement_rows(CashFlow, stock_symbol, rows)
+
+    def _save_dividends(self, stock_symbol: str, dividends: pd.Series) -> dict:
+        if dividends.empty:
+            print(f"No dividend data available for {stock_symbol}.")
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        rows = [
+            dict(stock_symbol=stock_symbol, payment_date=payment_date.date(), amount=Decimal(amount).quantize(Decimal("0.01")))
+            for payment_date, amount in dividends.items()
+            if not pd.isna(amount)
+        ]
+        return self._upsert_statement_rows(Dividend, stock_symbol, rows, key_column="payment_date")
+
+    def _upsert_statement_rows(self, model, stock_symbol: str, rows: List[dict], key_column: str = "quarter") -> dict:
+        """
+        Write the rows of a statement table with one bulk upsert on its (stock_symbol, key_column) key.
+        Rows that are already stored with the same values are not sent again.
+        Returns how many rows were inserted, updated or unchanged.
+        """
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        if not rows:
+            return counts
+
+        value_columns = [column for column in rows[0] if column not in ("stock_symbol", key_column)]
+        key = getattr(model, key_column)
+        stored_rows = self.db.query(key, *[getattr(model, column) for column in value_columns]).filter(
+            model.stock_symbol == stock_symbol
+        ).all()
+        stored = {row[0]: row for row in stored_rows}
+
+        changed_rows = []
+        for row in rows:
+            stored_row = stored.get(row[key_column])
+            if stored_row is None:
+                counts["inserted"] += 1
+            elif all(_same_value(getattr(stored_row, column), row[column]) for column in value_columns):
+                counts["unchanged"] += 1
+                continue
+            else:
+                counts["updated"] += 1
+            changed_rows.append(row)
+
+        upsert_rows(self.db, model, changed_rows, ["stock_symbol", key_column], value_columns)
+        return counts
+
     # services related to returning them
 
     # Function to return all financial data for a given stock symbol
@@ -538,34 +792,9 @@ class StockService:
     def add_holding(self, portfolio_id: int, symbol: str, quantity: int, price: Decimal) -> PortfolioHolding:
         # no need to check if the stock exists since user can buy existing stocks in the frontend
 
-        # check if the stock exists in the portfolio
-        holding = self.db.query(PortfolioHolding).filter(
-            PortfolioHolding.portfolio_id == portfolio_id,
-            PortfolioHolding.stock_symbol == symbol
-        ).first()
-
-        if holding:
-            # we need to update the holding if it exists like quantity and the average bought price
-            new_weighted_avg_price = (holding.quantity * holding.average_price + quantity * price) / (holding.quantity + quantity)
-            new_quantity = holding.quantity + quantity
-
-            holding.quantity = new_quantity
-            holding.average_price = new_weighted_avg_price
-
-            self.db.commit()
-            self.db.refresh(holding)
-            return holding
-
-        # else: create a new holding record in the db
-        holding = PortfolioHolding(
-            portfolio_id=portfolio_id,
-            stock_symbol=symbol,
-            quantity=quantity,
-            average_price=price
-        )
-        self.db.add(holding)
-        self.db.commit()
-        self.db.refresh(holding)
+        # the buy is appended to the transaction ledger, the holding (quantity and average bought price)
+        # is the position of the stock replayed from the ledger
+        _, holding = PortfolioLedgerService(self.db).record_trade(portfolio_id, symbol, "buy", quantity, price)
         return holding
 
     # to return a portfolio by portfolio id but in this holdings are not included
@@ -578,28 +807,122 @@ class StockService:
     
     # to return all holding of a portfolio
     def get_portfolio_holdings(self, portfolio_id: int) -> List[PortfolioHolding]:
-        # check if the portfolio exists
+        """
+        Holdings of the portfolio with their stock and its sector, the portfolio, holdings, stocks and sectors
+        come from one joined query so reading holding.stock.sector does not load anything per row.
+        """
+        portfolio = self.db.query(Portfolio).options(
+            joinedload(Portfolio.holdings).joinedload(PortfolioHolding.stock).joinedload(Stock.sector)
+        ).filter(Portfolio.portfolio_id == portfolio_id).one_or_none()
+        if portfolio is None:
+            raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
+        return sorted(portfolio.holdings, key=lambda holding: holding.holding_id)
+
+    def get_portfolio_valuation(self, portfolio_id: int) -> dict:
+        """
+        Market value, unrealized profit / loss and weight of each holding, of each sector and of the whole portfolio.
+        Holdings come with their stock and sector from one joined query and are priced with one batched download.
+        Holdings without a price are listed but left out of the totals and the weights.
+        """
         portfolio = self.db.query(Portfolio).filter(Portfolio.portfolio_id == portfolio_id).first()
         if portfolio is None:
             raise ValueError(f"Portfolio with id {portfolio_id} does not exists")
 
-        # otherwise return all holdings of the portfolio
-        return self.db.query(PortfolioHolding).filter(PortfolioHolding.portfolio_id == portfolio_id).all()
+        rows = self.db.query(
+            PortfolioHolding.holding_id,
+            PortfolioHolding.stock_symbol,
+            PortfolioHolding.quantity,
+            PortfolioHolding.average_price,
+            Stock.name,
+            Sector.sector_id,
+            Sector.name.label("sector"),
+        ).join(
+            Stock, Stock.stock_symbol == PortfolioHolding.stock_symbol
+        ).outerjoin(
+            Sector, Sector.sector_id == Stock.sector_id
+        ).filter(PortfolioHolding.portfolio_id == portfolio_id).order_by(PortfolioHolding.holding_id).all()
+
+        last_closes = self._get_last_closes(list(dict.fromkeys(row.stock_symbol.upper() for row in rows)))
+
+        holdings = []
+        for row in rows:
+            last_price, previous_close = last_closes[row.stock_symbol.upper()]
+            average_price = float(row.average_price or 0)
+            cost_basis = average_price * row.quantity
+            market_value = last_price * row.quantity if last_price is not None else None
+            unrealized_pl = market_value - cost_basis if market_value is not None else None
+            holdings.append({
+                "holding_id": row.holding_id,
+                "stock_symbol": row.stock_symbol,
+                "name": row.name,
+                "sector_id": row.sector_id,
+                "sector": row.sector,
+                "quantity": row.quantity,
+                "average_price": average_price,
+                "last_price": last_price,
+                "previous_close": previous_close,
+                "market_value": market_value,
+                "cost_basis": cost_basis,
+                "unrealized_pl": unrealized_pl,
+                "unrealized_pl_pct": unrealized_pl / cost_basis * 100 if unrealized_pl is not None and cost_basis else None,
+                "weight": None,
+            })
+
+        priced = [holding for holding in holdings if holding["market_value"] is not None]
+        total_market_value = sum(holding["market_value"] for holding in priced)
+        total_cost_basis = sum(holding["cost_basis"] for holding in priced)
+        total_unrealized_pl = total_market_value - total_cost_basis
+
+        # sectors in the order of their first holding, stocks without a sector are grouped together
+        sectors = {}
+        for holding in priced:
+            sector = sectors.setdefault(holding["sector_id"], {
+                "sector_id": holding["sector_id"],
+                "sector": holding["sector"],
+                "holdings_count": 0,
+                "market_value": 0.0,
+                "cost_basis": 0.0,
+                "unrealized_pl": 0.0,
+                "weight": None,
+            })
+            sector["holdings_count"] += 1
+            sector["market_value"] += holding["market_value"]
+            sector["cost_basis"] += holding["cost_basis"]
+            sector["unrealized_pl"] += holding["unrealized_pl"]
+
+        if total_market_value:
+            for item in priced + list(sectors.values()):
+                item["weight"] = item["market_value"] / total_market_value
+
+        return {
+            "portfolio_id": portfolio.portfolio_id,
+            "name": portfolio.name,
+            "total_market_value": total_market_value,
+            "total_cost_basis": total_cost_basis,
+            "total_unrealized_pl": total_unrealized_pl,
+            "total_unrealized_pl_pct": total_unrealized_pl / total_cost_basis * 100 if total_cost_basis else None,
+            "holdings": holdings,
+            "sectors": list(sectors.values()),
+            "missing_prices": [holding["stock_symbol"] for holding in holdings if holding["market_value"] is None],
+        }
 
     # it allows us to decrease the quantity of a holding in a portfolio but not delete
-    def decrease_holding(self, holding_id: int, quantity: int) -> Optional[PortfolioHolding]:
+    # the sell is recorded at the given price, at the average bought price (no realized profit / loss) if there is none
+    def decrease_holding(self, holding_id: int, quantity: int, price: Optional[Decimal] = None) -> Optional[PortfolioHolding]:
         holding = self.db.query(PortfolioHolding).filter(PortfolioHolding.holding_id == holding_id).first()
         if holding:
-            holding.quantity -= quantity
-            self.db.commit()
-            self.db.refresh(holding)
+            _, holding = PortfolioLedgerService(self.db).record_trade(
+                holding.portfolio_id, holding.stock_symbol, "sell", quantity,
+                price if price is not None else holding.average_price or Decimal(0)
+            )
         return holding
 
     # to delete a holding in a portfolio by holding id -> user will need this when they sell a stock
     def delete_holding(self, holding_id: int) -> bool:
         holding = self.db.query(PortfolioHolding).filter(PortfolioHolding.holding_id == holding_id).first()
         if holding:
-            self.db.delete(holding)
+            # the rest of the holding is sold at its average price in the ledger
+            PortfolioLedgerService(self.db).close_holding(holding)
             self.db.commit()
             return True
         return False
@@ -0,0 +1,74 @@
+import threading
+from collections import Counter
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.models import Sector, Stock
+from services.fundamentals_refresh_service import FundamentalsRefreshJob
+from utils.db_context import Base
+from utils.market_data_provider import MarketDataProvider
+
+
+class EmptyStatementsProvider(MarketDataProvider):
+    """Answers every statement with an empty frame and counts the calls per symbol."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, symbol):
+        with self._lock:
+            self.calls[symbol] += 1
+
+    def get_info(self, symbol):
+        return {}
+
+    def get_quote(self, symbol):
+        return None
+
+    def get_history(self, symbol, start=None, end=None, period=None):
+        return pd.DataFrame()
+
+    def get_closes(self, symbols, start=None, end=None, period=None):
+        return pd.DataFrame()
+
+    def get_quarterly_financials(self, symbol):
+        self._count(symbol)
+        return pd.DataFrame()
+
+    def get_quarterly_balance_sheet(self, symbol):
+        self._count(symbol)
+        return pd.DataFrame()
+
+    def get_quarterly_cashflow(self, symbol):
+        self._count(symbol)
+        return pd.DataFrame()
+
+    def get_dividends(self, symbol):
+        self._count(symbol)
+        return pd.Series(dtype=float)
+
+
+def test_duplicate_and_mixed_case_symbols_are_refreshed_once():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    db = session_factory()
+    db.add(Sector(sector_id=1, name="Banking"))
+    db.add_all([Stock(stock_symbol="THYAO", name="Turk Hava Yollari", sector_id=1),
+                Stock(stock_symbol="AKBNK", name="Akbank", sector_id=1)])
+    db.commit()
+    db.close()
+
+    provider = EmptyStatementsProvider()
+    job = FundamentalsRefreshJob(symbols=["THYAO", "thyao", "Akbnk", "AKBNK"], market_data=provider,
+                                 session_factory=session_factory, workers=4, rate_per_second=1000)
+    status = job.run()
+
+    assert status["state"] == "finished"
+    assert status["errors"] == {}
+    assert status["total"] == status["completed"] == 2
+    assert provider.calls == {"THYAO": 4, "AKBNK": 4}
+    engine.dispose()
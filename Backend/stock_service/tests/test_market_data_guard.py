@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from utils.market_data_provider import GuardedMarketDataProvider, MarketDataProvider
+from utils.rate_limiter import TokenBucketRateLimiter
+from utils.upstream_guard import CircuitBreaker, NegativeCache, UpstreamUnavailableError
+
+
+class FlakyProvider(MarketDataProvider):
+    def __init__(self):
+        self.failing = True
+        self.calls = 0
+
+    def _answer(self):
+        self.calls += 1
+        if self.failing:
+            raise ConnectionError("upstream is down")
+        return pd.DataFrame({"THYAO": [300.0]})
+
+    def get_info(self, symbol):
+        return {"symbol": symbol, "currentPrice": 300.0}
+
+    def get_quote(self, symbol):
+        return 300.0
+
+    def get_history(self, symbol, start=None, end=None, period=None):
+        return self._answer()
+
+    def get_closes(self, symbols, start=None, end=None, period=None):
+        return self._answer()
+
+    def get_quarterly_financials(self, symbol):
+        return pd.DataFrame()
+
+    def get_quarterly_balance_sheet(self, symbol):
+        return pd.DataFrame()
+
+    def get_quarterly_cashflow(self, symbol):
+        return pd.DataFrame()
+
+    def get_dividends(self, symbol):
+        return pd.Series(dtype=float)
+
+
+def test_rate_limited_half_open_probe_does_not_block_the_breaker():
+    upstream = FlakyProvider()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    # an empty bucket that refills far slower than an interactive caller is willing to wait
+    limiter = TokenBucketRateLimiter(rate_per_second=0.001, burst=1, max_wait_seconds=0.01)
+    provider = GuardedMarketDataProvider(upstream, breaker=breaker, negative_cache=NegativeCache(), rate_limiter=limiter)
+
+    with pytest.raises(ConnectionError):
+        provider.get_closes(["THYAO"], period="5d")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # the reset time is over, this call is the half open probe but it is stopped by the rate limiter
+    with pytest.raises(UpstreamUnavailableError):
+        provider.get_closes(["THYAO"], period="5d")
+    assert upstream.calls == 1
+
+    # the upstream is back and the limiter lets calls through: the next call must be able to probe
+    upstream.failing = False
+    limiter.rate_per_second = 0
+    closes = provider.get_closes(["THYAO"], period="5d")
+    assert list(closes.columns) == ["THYAO"]
+    assert breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,67 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models.models import Portfolio, PortfolioHolding, Sector, Stock, User
+from models.pydantic_models import HoldingDetailResponse
+from services.stock_service import StockService
+from utils.db_context import Base
+
+
+@pytest.fixture
+def make_engine():
+    engines = []
+
+    def make():
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+def seed_portfolio(engine, holdings: int) -> int:
+    db = sessionmaker(bind=engine)()
+    db.add(User(user_id=1, username="investor", first_name="Ada", last_name="Investor", email="investor@example.com", password="x"))
+    db.add(Sector(sector_id=1, name="Banking"))
+    portfolio = Portfolio(user_id=1, name="My Portfolio")
+    db.add(portfolio)
+    db.flush()
+    for i in range(holdings):
+        symbol = f"S{i:03d}"
+        db.add(Stock(stock_symbol=symbol, name=f"Stock {i}", sector_id=1, market_cap=Decimal(1000)))
+        db.add(PortfolioHolding(portfolio_id=portfolio.portfolio_id, stock_symbol=symbol, quantity=10,
+                                average_price=Decimal("12.50")))
+    db.commit()
+    portfolio_id = portfolio.portfolio_id
+    db.close()
+    return portfolio_id
+
+
+def count_holdings_queries(engine, portfolio_id: int) -> int:
+    """Statements of reading the holdings and building the response of the holdings endpoint from them."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db = sessionmaker(bind=engine)()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        holdings = StockService(db).get_portfolio_holdings(portfolio_id)
+        responses = [HoldingDetailResponse.model_validate(holding) for holding in holdings]
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        db.close()
+    assert all(response.stock.sector.name == "Banking" for response in responses)
+    return len(statements)
+
+
+def test_holdings_queries_do_not_grow_with_the_holdings(make_engine):
+    one, many = make_engine(), make_engine()
+    assert count_holdings_queries(many, seed_portfolio(many, 50)) == count_holdings_queries(one, seed_portfolio(one, 1))
@@ -0,0 +1,61 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.models import Portfolio, PortfolioHolding, Sector, Stock, User
+from services.portfolio_ledger_service import PortfolioLedgerService
+from services.stock_service import StockService
+from utils.db_context import Base
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(User(user_id=1, username="investor", first_name="Ada", last_name="Investor", email="investor@example.com", password="x"))
+    session.add(Sector(sector_id=1, name="Airlines"))
+    session.add(Stock(stock_symbol="THYAO", name="Turk Hava Yollari", sector_id=1))
+    session.add(Portfolio(portfolio_id=1, user_id=1, name="My Portfolio"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_back_dated_sell_can_not_make_a_position_negative(db):
+    ledger = PortfolioLedgerService(db)
+    ledger.record_trade(1, "THYAO", "buy", 10, Decimal("300"), datetime(2024, 3, 1))
+
+    # before the buy there is nothing to sell
+    with pytest.raises(ValueError):
+        ledger.record_trade(1, "THYAO", "sell", 5, Decimal("290"), datetime(2024, 2, 1))
+
+    # the shares held on the date are already sold later
+    ledger.record_trade(1, "THYAO", "sell", 8, Decimal("320"), datetime(2024, 5, 1))
+    with pytest.raises(ValueError):
+        ledger.record_trade(1, "THYAO", "sell", 5, Decimal("310"), datetime(2024, 4, 1))
+
+    _, holding = ledger.record_trade(1, "THYAO", "sell", 2, Decimal("310"), datetime(2024, 4, 1))
+    assert holding.quantity == 0
+    assert "THYAO" not in ledger.get_positions(1, date(2024, 2, 1))
+    assert ledger.get_positions(1, date(2024, 4, 1))["THYAO"].quantity == 8
+    assert ledger.get_positions(1, date(2024, 5, 1))["THYAO"].quantity == 0
+
+
+def test_sell_reads_the_holding_again_under_the_lock(db):
+    ledger = PortfolioLedgerService(db)
+    ledger.record_trade(1, "THYAO", "buy", 10, Decimal("300"))
+    holding = db.query(PortfolioHolding).filter(PortfolioHolding.stock_symbol == "THYAO").one()
+
+    # another session sells meanwhile, this one still has the old quantity loaded
+    other = sessionmaker(bind=db.get_bind())()
+    PortfolioLedgerService(other).record_trade(1, "THYAO", "sell", 6, Decimal("310"))
+    other.close()
+    assert holding.quantity == 10
+
+    with pytest.raises(ValueError):
+        StockService(db).decrease_holding(holding.holding_id, 5)
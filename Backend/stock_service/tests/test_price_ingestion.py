@@ -0,0 +1,59 @@
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from models.models import Sector, Stock, StockPrice
+from services.stock_service import StockService
+from utils.db_context import Base
+from utils.market_data_provider import MarketDataProvider
+
+
+class ClosesProvider(MarketDataProvider):
+    """Has two days of closes for every symbol it is asked for, like yahoo for any valid ticker."""
+
+    def get_info(self, symbol):
+        return {}
+
+    def get_quote(self, symbol):
+        return None
+
+    def get_history(self, symbol, start=None, end=None, period=None):
+        return pd.DataFrame()
+
+    def get_closes(self, symbols, start=None, end=None, period=None):
+        return pd.DataFrame({symbol: [10.0, 10.5] for symbol in symbols},
+                            index=pd.to_datetime(["2024-01-02", "2024-01-03"]))
+
+    def get_quarterly_financials(self, symbol):
+        return pd.DataFrame()
+
+    def get_quarterly_balance_sheet(self, symbol):
+        return pd.DataFrame()
+
+    def get_quarterly_cashflow(self, symbol):
+        return pd.DataFrame()
+
+    def get_dividends(self, symbol):
+        return pd.Series(dtype=float)
+
+
+def test_symbols_missing_from_the_stocks_table_are_reported_not_written():
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")  # like the foreign keys of MySQL
+
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.add(Sector(sector_id=1, name="Airlines"))
+    db.add(Stock(stock_symbol="THYAO", name="Turk Hava Yollari", sector_id=1))
+    db.commit()
+
+    result = StockService(db, ClosesProvider()).ingest_stock_prices(["thyao", "AAPL"], "2024-01-01")
+
+    assert result["failed_symbols"] == ["AAPL"]
+    assert result["rows_per_symbol"] == {"THYAO": 2}
+    assert db.query(StockPrice).count() == 2
+    db.close()
+    engine.dispose()
@@ -0,0 +1,37 @@
+from typing import List
+
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+# rows per INSERT statement, keeps a single statement below max_allowed_packet of mysql
+UPSERT_CHUNK_SIZE = 5000
+
+
+def upsert_rows(db: Session, model, rows: List[dict], conflict_columns: List[str], update_columns: List[str],
+                chunk_size: int = UPSERT_CHUNK_SIZE) -> int:
+    """
+    Insert the rows with multi-row INSERT ... ON DUPLICATE KEY UPDATE statements.
+    Rows that hit a unique key (conflict_columns) get their update_columns overwritten.
+    The caller commits. Returns the number of rows sent.
+    """
+    if not rows:
+        return 0
+
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        if dialect == "sqlite":
+            # used by local runs without mysql
+            statement = sqlite.insert(table).values(chunk)
+            statement = statement.on_conflict_do_update(
+                index_elements=conflict_columns,
+                set_={column: statement.excluded[column] for column in update_columns}
+            )
+        else:
+            statement = mysql.insert(table).values(chunk)
+            statement = statement.on_duplicate_key_update(
+                {column: statement.inserted[column] for column in update_columns}
+            )
+        db.execute(statement)
+    return len(rows)
@@ -0,0 +1,19 @@
+-- One-off migration for databases created before the statement loads became upserts, run it once by hand.
+-- New databases get the unique keys from db_create_statements.txt and do not need it.
+-- Removes the duplicated quarters (keeping the latest row) and adds the unique keys that the loads upsert on.
+DELETE f1 FROM financials f1 JOIN financials f2
+    ON f1.stock_symbol = f2.stock_symbol AND f1.quarter = f2.quarter AND f1.id < f2.id;
+ALTER TABLE financials ADD UNIQUE KEY uq_financials_symbol_quarter (stock_symbol, quarter);
+
+DELETE b1 FROM balance_sheets b1 JOIN balance_sheets b2
+    ON b1.stock_symbol = b2.stock_symbol AND b1.quarter = b2.quarter AND b1.id < b2.id;
+ALTER TABLE balance_sheets ADD UNIQUE KEY uq_balance_sheets_symbol_quarter (stock_symbol, quarter);
+
+DELETE c1 FROM cash_flows c1 JOIN cash_flows c2
+    ON c1.stock_symbol = c2.stock_symbol AND c1.quarter = c2.quarter AND c1.id < c2.id;
+ALTER TABLE cash_flows ADD UNIQUE KEY uq_cash_flows_symbol_quarter (stock_symbol, quarter);
+
+DELETE d1 FROM dividends d1 JOIN dividends d2
+    ON d1.stock_symbol = d2.stock_symbol AND d1.payment_date = d2.payment_date AND d1.id < d2.id;
+ALTER TABLE dividends DROP INDEX idx_dividends_stock_payment,
+    ADD UNIQUE KEY uq_dividends_symbol_payment_date (stock_symbol, payment_date);
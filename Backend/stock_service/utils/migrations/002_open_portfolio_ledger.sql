@@ -0,0 +1,10 @@
+-- One-off migration for databases that had portfolio holdings before the transaction ledger, run it once by hand.
+-- Opens the ledger with one buy per holding at its average price. Holdings whose stock already has
+-- transactions in the portfolio are skipped, so running it again does not count them twice.
+INSERT INTO portfolio_transactions (portfolio_id, stock_symbol, transaction_type, quantity, price, traded_at)
+SELECT h.portfolio_id, h.stock_symbol, 'buy', h.quantity, h.average_price, h.added_at
+FROM portfolio_holdings h
+WHERE h.quantity > 0 AND NOT EXISTS (
+    SELECT 1 FROM portfolio_transactions t
+    WHERE t.portfolio_id = h.portfolio_id AND t.stock_symbol = h.stock_symbol
+);
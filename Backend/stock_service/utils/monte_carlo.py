@@ -0,0 +1,58 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+# only numpy in here, the chunks run in worker processes that import this module on their own
+
+
+def simulate_chunk(method: str, paths: int, steps: int, values: np.ndarray, drift: np.ndarray,
+                   factor: Optional[np.ndarray], history: Optional[np.ndarray], seed: np.random.SeedSequence,
+                   lows: np.ndarray, bin_widths: np.ndarray, bins: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Buy and hold paths of a portfolio with the given holding values, one step is one trading day.
+    "gbm" draws correlated daily log returns drift + factor @ z, "bootstrap" draws whole days of the
+    historical log returns (rows of history) so the correlation between the holdings is kept.
+    Only a (paths, holdings) array is kept in memory, every step is reduced to a histogram of the
+    log return of the portfolio (bins of width bin_widths[step] from lows[step], the outer bins also
+    count everything outside) and the sum of the portfolio values.
+    Returns the (steps, bins) histogram counts, the (steps,) value sums and the number of paths ending below the start.
+    """
+    rng = np.random.default_rng(seed)
+    initial = values.sum()
+    current = np.tile(values, (paths, 1))
+    counts = np.zeros((steps, bins), dtype=np.int64)
+    sums = np.zeros(steps)
+    total = np.full(paths, initial)
+    for step in range(steps):
+        if method == "bootstrap":
+            returns = history[rng.integers(0, len(history), size=paths)]
+        else:
+            returns = rng.standard_normal((paths, len(values))) @ factor.T
+            returns += drift
+        current *= np.exp(returns)
+        total = current.sum(axis=1)
+        sums[step] = total.sum()
+        index = np.floor((np.log(total / initial) - lows[step]) / bin_widths[step])
+        counts[step] = np.bincount(np.clip(index, 0, bins - 1).astype(np.int64), minlength=bins)
+    return counts, sums, int((total < initial).sum())
+
+
+def histogram_percentiles(counts: np.ndarray, lows: np.ndarray, bin_widths: np.ndarray, percentiles) -> np.ndarray:
+    """
+    (len(percentiles), steps) log returns at the percentiles of the step histograms, linear inside a bin.
+    The exact percentile of the paths is in the same bin, so the error is below one bin width of the step
+    (a value error below exp(width) - 1). A percentile in an outer bin, which also counts everything outside
+    the histogram range, can be further off.
+    """
+    cumulative = np.cumsum(counts, axis=1)
+    paths = cumulative[:, -1]
+    steps = np.arange(len(counts))
+    result = np.empty((len(percentiles), len(counts)))
+    for i, percentile in enumerate(percentiles):
+        target = percentile / 100 * paths
+        index = np.argmax(cumulative >= target[:, None], axis=1)
+        before = np.where(index > 0, cumulative[steps, index - 1], 0)
+        in_bin = counts[steps, index]
+        fraction = np.where(in_bin > 0, (target - before) / np.maximum(in_bin, 1), 0.0)
+        result[i] = lows + (index + fraction) * bin_widths
+    return result
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.market_data_provider import MarketDataProvider
+from utils.upstream_guard import UnknownSymbolError, UpstreamUnavailableError
+
+# where the per symbol price files are kept and how often a symbol is checked for new days
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "prices"))
+PRICE_STORE_REFRESH_SECONDS = float(os.getenv("PRICE_STORE_REFRESH_SECONDS", "900"))
+
+
+class PriceStore:
+    """
+    Local daily OHLCV history, one numpy .npz file per stock symbol.
+    A symbol is downloaded once with its whole history and afterwards only the missing tail is fetched.
+    Loaded series stay in memory so that range queries are a binary search and an array slice.
+    """
+
+    COLUMNS = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, directory: str = PRICE_STORE_DIR, refresh_seconds: float = PRICE_STORE_REFRESH_SECONDS):
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self._series: Dict[str, Dict[str, np.ndarray]] = {}  # symbol -> {"date": ..., "close": ...}
+        self._checked_at: Dict[str, float] = {}
+        self._symbol_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def get_history(self, symbol: str, provider: MarketDataProvider, start=None, end=None) -> Dict[str, np.ndarray]:
+        """
+        Return the date and OHLCV arrays of the symbol between start (inclusive) and end (exclusive).
+        Dates are numpy datetime64[D] values in ascending order. The arrays are read only views.
+        """
+        series = self.ensure_fresh(symbol, provider)
+        dates = series["date"]
+        lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start).date(), "D"), side="left"))
+        hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(end).date(), "D"), side="left"))
+        return {name: values[lo:hi] for name, values in series.items()}
+
+    def ensure_fresh(self, symbol: str, provider: MarketDataProvider) -> Dict[str, np.ndarray]:
+        """Load the series of the symbol and fetch the days that are missing from the provider."""
+        symbol = symbol.upper()
+        with self._get_symbol_lock(symbol):
+            series = self._series.get(symbol)
+            if series is None:
+                series = self._load(symbol)
+
+            # the tail is fetched again at most once per refresh interval
+            checked_at = self._checked_at.get(symbol)
+            if series is None or checked_at is None or time.monotonic() - checked_at >= self.refresh_seconds:
+                series = self._refresh(symbol, provider, series)
+
+            if series is None:
+                raise ValueError(f"No price history available for {symbol}")
+            return series
+
+    def extend(self, symbol: str, history: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Merge a yahoo finance style history frame (Open, High, Low, Close, Volume) into the stored series.
+        Rows of the frame replace the stored rows from its first date on, so the last partial day gets updated.
+        """
+        symbol = symbol.upper()
+        with self._get_symbol_lock(symbol):
+            series = self._series.get(symbol) or self._load(symbol)
+            return self._merge_and_save(symbol, series, history)
+
+    def last_date(self, symbol: str) -> Optional[date]:
+        symbol = symbol.upper()
+        series = self._series.get(symbol) or self._load(symbol)
+        if series is None or len(series["date"]) == 0:
+            return None
+        return series["date"][-1].astype(object)
+
+    def _refresh(self, symbol: str, provider: MarketDataProvider, series: Optional[Dict[str, np.ndarray]]):
+        try:
+            if series is None or len(series["date"]) == 0:
+                history = provider.get_history(symbol, period="max")
+            else:
+                # fetch again from the last stored day since it may have been stored during the session
+                last_day = series["date"][-1].astype(object)
+                history = provider.get_history(symbol, start=last_day, end=date.today() + timedelta(days=1))
+            series = self._merge_and_save(symbol, series, history)
+            self._checked_at[symbol] = time.monotonic()
+        except (UpstreamUnavailableError, UnknownSymbolError):
+            # without a stored series there is nothing to serve, let the caller answer with 503 / 404
+            if series is None:
+                raise
+        except Exception as e:
+            # serve what we have, the next request will try again
+            print(f"An error occurred while refreshing stored prices of {symbol}: {e}")
+        return series
+
+    def _merge_and_save(self, symbol: str, series: Optional[Dict[str, np.ndarray]], history: pd.DataFrame):
+        if history is None or history.empty:
+            if series is not None:
+                self._series[symbol] = series
+            return series
+
+        index = history.index
+        if getattr(index, "tz", None) is not None:
+            index = index.tz_localize(None)
+        new = {"date": index.values.astype("datetime64[D]")}
+        for column in self.COLUMNS:
+            new[column] = history[column.capitalize()].to_numpy(dtype=np.float64)
+
+        if series is not None and len(series["date"]) > 0:
+            keep = int(np.searchsorted(series["date"], new["date"][0], side="left"))
+            new = {name: np.concatenate([series[name][:keep], new[name]]) for name in new}
+
+        for values in new.values():
+            values.setflags(write=False)
+        self._save(symbol, new)
+        self._series[symbol] = new
+        return new
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self.directory, f"{symbol}.npz")
+
+    def _load(self, symbol: str) -> Optional[Dict[str, np.ndarray]]:
+        path = self._path(symbol)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            series = {name: data[name] for name in data.files}
+        for values in series.values():
+            values.setflags(write=False)
+        self._series[symbol] = series
+        return series
+
+    def _save(self, symbol: str, series: Dict[str, np.ndarray]):
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first so that readers never see a half written file
+        tmp_path = self._path(symbol) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **series)
+        os.replace(tmp_path, self._path(symbol))
+
+    def _get_symbol_lock(self, symbol: str) -> threading.Lock:
+        with self._lock:
+            return self._symbol_locks[symbol]
+
+
+# Process wide price store used by the range and chart endpoints
+price_store = PriceStore()
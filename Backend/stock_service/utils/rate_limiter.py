@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional, Tuple
+
+try:
+    import fcntl  # file locks for the cross process mode, not available on windows
+except ImportError:
+    fcntl = None
+
+from utils.upstream_guard import UpstreamUnavailableError
+
+# budget of upstream market data calls, shared by every endpoint and background job
+MARKET_DATA_RATE_PER_SECOND = float(os.getenv("MARKET_DATA_RATE_PER_SECOND", "10"))
+MARKET_DATA_RATE_BURST = float(os.getenv("MARKET_DATA_RATE_BURST", "20"))
+# share of the burst that background calls leave for interactive requests
+MARKET_DATA_BACKGROUND_RESERVE = float(os.getenv("MARKET_DATA_BACKGROUND_RESERVE", "0.3"))
+# an interactive request that would wait longer than this gets a 503 instead
+MARKET_DATA_RATE_MAX_WAIT_SECONDS = float(os.getenv("MARKET_DATA_RATE_MAX_WAIT_SECONDS", "10"))
+# if set, all processes (uvicorn workers, both services) using this file share one budget
+MARKET_DATA_RATE_LIMIT_FILE = os.getenv("MARKET_DATA_RATE_LIMIT_FILE")
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # requests a user is waiting for
+    BACKGROUND = 1  # alert loop, refresh jobs, bulk ingestion
+
+
+_priority: ContextVar = ContextVar("market_data_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def call_priority(priority: Priority):
+    """Upstream calls made inside the block (in this thread / task) use the given priority class."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket of upstream calls, refilled with rate_per_second tokens up to burst.
+    Interactive calls may use the whole bucket, background calls only the part above the reserve,
+    so a running background job never makes a user wait for a full bucket refill.
+    With a state_path the bucket lives in a file guarded by a file lock and is shared between processes.
+    """
+
+    def __init__(self, rate_per_second: float = MARKET_DATA_RATE_PER_SECOND, burst: float = MARKET_DATA_RATE_BURST,
+                 background_reserve: float = MARKET_DATA_BACKGROUND_RESERVE,
+                 max_wait_seconds: Optional[float] = MARKET_DATA_RATE_MAX_WAIT_SECONDS,
+                 state_path: Optional[str] = None):
+        self.rate_per_second = rate_per_second
+        self.burst = max(burst, 1.0)
+        self.background_reserve = background_reserve
+        self.max_wait_seconds = max_wait_seconds
+        self.state_path = state_path if fcntl is not None else None
+        if state_path and fcntl is None:
+            print("File locks are not available, the market data rate limit is not shared between processes")
+
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+        self.granted = {priority.name.lower(): 0 for priority in Priority}
+        self.waited_seconds = 0.0
+        self.rejected = 0
+
+    def acquire(self, priority: Optional[Priority] = None):
+        """
+        Block until a token is available for the priority class (the one of the caller by default).
+        Interactive calls that would wait longer than max_wait_seconds raise UpstreamUnavailableError.
+        """
+        if self.rate_per_second <= 0:
+            return
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        while True:
+            wait = self._take(priority)
+            if wait <= 0:
+                with self._lock:
+                    self.granted[priority.name.lower()] += 1
+                    self.waited_seconds += time.monotonic() - started
+                return
+
+            waited = time.monotonic() - started
+            if priority == Priority.INTERACTIVE and self.max_wait_seconds is not None and waited + wait > self.max_wait_seconds:
+                with self._lock:
+                    self.rejected += 1
+                raise UpstreamUnavailableError("Market data rate limit reached, please try again later", retry_after=wait)
+            # sleep in short steps, another process may have left tokens unused
+            time.sleep(min(wait, 0.5))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_second": self.rate_per_second,
+                "burst": self.burst,
+                "background_reserve": self.background_reserve,
+                "shared_file": self.state_path,
+                "granted": dict(self.granted),
+                "waited_seconds": round(self.waited_seconds, 3),
+                "rejected": self.rejected,
+            }
+
+    # takes a token if there is one for the priority, otherwise returns how long to wait for it
+    def _take(self, priority: Priority) -> float:
+        with self._lock:
+            if self.state_path is None:
+                self._tokens, self._updated_at, wait = self._refill_and_take(self._tokens, self._updated_at, priority)
+                return wait
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    tokens, updated_at = self._parse_state(f.read())
+                    tokens, updated_at, wait = self._refill_and_take(tokens, updated_at, priority)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(f"{tokens} {updated_at}")
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                return wait
+
+    def _refill_and_take(self, tokens: float, updated_at: float, priority: Priority) -> Tuple[float, float, float]:
+        now = time.time()  # wall clock since the state may be shared between processes
+        tokens = min(self.burst, tokens + max(now - updated_at, 0.0) * self.rate_per_second)
+        floor = 0.0 if priority == Priority.INTERACTIVE else self.burst * self.background_reserve
+        if tokens - 1 >= floor:
+            return tokens - 1, now, 0.0
+        return tokens, now, (floor + 1 - tokens) / self.rate_per_second
+
+    def _parse_state(self, content: str) -> Tuple[float, float]:
+        try:
+            tokens, updated_at = content.split()
+            return float(tokens), float(updated_at)
+        except ValueError:
+            return self.burst, time.time()  # new or broken file, start with a full bucket
+
+
+# Process wide limiter that every upstream market data call goes through
+market_data_rate_limiter = TokenBucketRateLimiter(state_path=MARKET_DATA_RATE_LIMIT_FILE)
@@ -0,0 +1,52 @@
+# Microbenchmark of the price alert index, run it from the watchlist_service directory:
+#   python benchmark_alert_index.py
+# one million alerts over 500 symbols, then a tick of new prices is matched against the sorted alert prices
+import timeit
+from decimal import Decimal
+
+import numpy as np
+
+from services.price_alert_engine import ALERT_PRICE_BAND, AlertPriceIndex, PriceAlert
+
+ALERTS = 1_000_000
+SYMBOLS = 500
+REPEAT = 20
+
+
+def build_index(alerts: int = ALERTS, symbols: int = SYMBOLS):
+    rng = np.random.default_rng(42)
+    base_prices = rng.uniform(5, 500, size=symbols)
+    symbol_ids = rng.integers(0, symbols, size=alerts)
+    alert_prices = np.round(base_prices[symbol_ids] * rng.uniform(0.7, 1.3, size=alerts), 2)
+    grouped = {}
+    for item_id, (symbol_id, alert_price) in enumerate(zip(symbol_ids.tolist(), alert_prices.tolist())):
+        symbol = f"S{symbol_id:03d}"
+        grouped.setdefault(symbol, []).append(PriceAlert(item_id, item_id % 1000, symbol, Decimal(str(alert_price))))
+    index = AlertPriceIndex()
+    index.load(grouped)
+    prices = {f"S{i:03d}": Decimal(f"{price:.2f}") for i, price in enumerate(base_prices * rng.uniform(0.97, 1.03, size=symbols))}
+    return index, prices
+
+
+def match(index: AlertPriceIndex, prices: dict) -> int:
+    found = 0
+    for symbol, price in prices.items():
+        found += len(index.between(symbol, float(price / (1 + ALERT_PRICE_BAND)), float(price / (1 - ALERT_PRICE_BAND))))
+    return found
+
+
+def main():
+    index, prices = build_index()
+    found = match(index, prices)
+    print(f"{ALERTS} alerts over {SYMBOLS} symbols, {found} alerts in the band per tick, best of 5 x {REPEAT} runs")
+    best = min(timeit.repeat(lambda: match(index, prices), number=REPEAT, repeat=5)) / REPEAT
+    print(f"range search of one tick: {best * 1e3:.3f} ms ({best / SYMBOLS * 1e6:.2f} us per symbol)")
+    symbol, price = next(iter(prices.items()))
+    best = min(timeit.repeat(lambda: index.between(symbol, float(price) * 0.999, float(price) * 1.001), number=1000, repeat=5)) / 1000
+    print(f"range search of one symbol (~{ALERTS // SYMBOLS} alerts): {best * 1e6:.2f} us")
+    best = min(timeit.repeat(lambda: index.set(PriceAlert(ALERTS, 1, symbol, price)), number=1000, repeat=5)) / 1000
+    print(f"alert update: {best * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,8 @@ from models.watchlist_schemas import (
 )
 # to inform the user about the changes in the watchlist
 from utils.websocket_manager import websocket_manager
+from utils.quote_cache import quote_cache
+from services.price_alert_engine import price_alert_engine
 
 router = APIRouter(
     prefix="/api/watchlists",
@@ -248,7 +250,7 @@ async def check_alerts(db: Session = Depends(get_db)):
     notifications = service.check_price_alerts()
 
     for notification in notifications:
-        message = (f"🚨 Stock Alert: {notification['stock_symbol']} is near your target price of "
+        message = (f"🚨 Stock Alert: {notification['stock_symbol']} {'crossed' if notification['crossed'] else 'is near'} your target price of "
                    f"{notification['target_price']}! Current price: {notification['current_price']}")
         
         user_id = notification["user_id"]
@@ -260,4 +262,14 @@ async def check_alerts(db: Session = Depends(get_db)):
         print("message sent")
 
     return {"message": f"Checked {len(notifications)} alerts"}
-    
+
+
+# hit / miss / expired counters of the quote cache used by the alert checks
+@router.get("/quote-cache/stats")
+def get_quote_cache_stats():
+    return quote_cache.stats()
+
+# ticks, checked alerts, priced symbols and upstream calls of the price alert engine
+@router.get("/alert-engine/stats")
+def get_alert_engine_stats():
+    return price_alert_engine.stats()
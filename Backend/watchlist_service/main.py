@@ -3,7 +3,8 @@ import uvicorn
 
 # Third-party imports
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 
 # Local application imports
 from controllers.watchlist_controller import router as stock_router
@@ -12,8 +13,10 @@ from utils.db_context import engine
 from utils.websocket_manager import websocket_manager
 # for checking the price of the stock every minute and inform the user
 import asyncio
-from utils.db_context import get_db
+from utils.db_context import SessionLocal
 from services.watchlist_service import WatchlistService
+from utils.upstream_guard import UnknownSymbolError, UpstreamUnavailableError
+from utils.rate_limiter import Priority, call_priority
 
 # Single dot (.) means current directory, double dot (..) means parent directory
 
@@ -48,15 +51,32 @@ async def root():
         "redoc_url": "/redoc"
     }
 
+# market data errors are answered right away instead of waiting for the upstream timeouts
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(int(exc.retry_after))})
+
+@app.exception_handler(UnknownSymbolError)
+async def unknown_symbol_handler(request: Request, exc: UnknownSymbolError):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+# one tick of the alert loop, with its own session so that it reads the alerts committed since the last tick
+def check_price_alerts() -> list:
+    db = SessionLocal()
+    try:
+        return WatchlistService(db).check_price_alerts()
+    finally:
+        db.close()
+
 async def background_task():
-    db = next(get_db())  # Get database session
-    service = WatchlistService(db)
-    
     while True:
-        notifications = service.check_price_alerts()
+        # the alert loop gives way to the interactive requests in the shared upstream budget
+        # it may wait for tokens, so it runs in a thread (to_thread copies the context with the priority)
+        with call_priority(Priority.BACKGROUND):
+            notifications = await asyncio.to_thread(check_price_alerts)
 
         for notification in notifications:
-            message = (f"🚨 Stock Alert: {notification['stock_symbol']} is near your target price of "
+            message = (f"🚨 Stock Alert: {notification['stock_symbol']} {'crossed' if notification['crossed'] else 'is near'} your target price of "
                        f"{notification['target_price']}! Current price: {notification['current_price']}")
             await websocket_manager.send_update(notification["user_id"], message)
         
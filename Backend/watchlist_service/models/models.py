@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, DECIMAL, FLOAT, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, DECIMAL, FLOAT, Enum, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from utils.db_context import Base
@@ -49,6 +49,8 @@ class Stock(Base):
 
 class Financial(Base):
     __tablename__ = "financials"
+    # one row per stock and quarter, statement loads upsert on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "quarter", name="uq_financials_symbol_quarter"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -66,6 +68,8 @@ class Financial(Base):
 
 class BalanceSheet(Base):
     __tablename__ = "balance_sheets"
+    # one row per stock and quarter, statement loads upsert on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "quarter", name="uq_balance_sheets_symbol_quarter"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -82,6 +86,8 @@ class BalanceSheet(Base):
 
 class CashFlow(Base):
     __tablename__ = "cash_flows"
+    # one row per stock and quarter, statement loads upsert on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "quarter", name="uq_cash_flows_symbol_quarter"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -97,6 +103,7 @@ class CashFlow(Base):
 
 class Dividend(Base):
     __tablename__ = "dividends"
+    __table_args__ = (UniqueConstraint("stock_symbol", "payment_date", name="uq_dividends_symbol_payment_date"),)
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
@@ -108,6 +115,8 @@ class Dividend(Base):
 
 class StockPrice(Base):
     __tablename__ = "stock_prices"
+    # one close price per stock and day, bulk ingestion upserts on this key
+    __table_args__ = (UniqueConstraint("stock_symbol", "date", name="uq_stock_prices_symbol_date"),)
     
     price_id = Column(Integer, primary_key=True, autoincrement=True)
     stock_symbol = Column(String(10), ForeignKey('stocks.stock_symbol'), nullable=False)
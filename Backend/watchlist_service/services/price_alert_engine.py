@@ -0,0 +1,280 @@
+import math
+import os
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models.models import Watchlist, WatchlistItem
+from utils.market_data_provider import MarketDataProvider
+from utils.quote_cache import quote_cache
+from utils.upstream_guard import UpstreamUnavailableError
+
+# symbols of one batched quote download, every batch is one upstream call
+ALERT_QUOTE_BATCH_SIZE = int(os.getenv("ALERT_QUOTE_BATCH_SIZE", "100"))
+# an alert fires when the price is this close to its target (0.01 = 1%)
+ALERT_PRICE_BAND = Decimal(os.getenv("ALERT_PRICE_BAND", "0.01"))
+
+CENT = Decimal("0.01")
+
+
+class PriceAlert:
+    __slots__ = ("item_id", "user_id", "stock_symbol", "alert_price")
+
+    def __init__(self, item_id: int, user_id: int, stock_symbol: str, alert_price: Decimal):
+        self.item_id = item_id
+        self.user_id = user_id
+        self.stock_symbol = stock_symbol
+        self.alert_price = alert_price
+
+
+class AlertPriceIndex:
+    """
+    Alert prices of every symbol in a sorted list of (price, item_id), so the alerts between two prices
+    are found with two binary searches. Loaded from the database once, then kept up to date by the alert endpoints.
+    It also keeps the (count, item id sum, alert price sum) of its alerts, the same numbers of the database
+    rows tell whether the alerts were changed somewhere else.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, List[Tuple[float, int]]] = {}
+        self._alerts: Dict[int, PriceAlert] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._item_id_sum = 0
+        self._price_sum = Decimal(0)
+
+    def load(self, alerts: Dict[str, List[PriceAlert]]):
+        entries = {
+            symbol: sorted((float(alert.alert_price), alert.item_id) for alert in symbol_alerts)
+            for symbol, symbol_alerts in alerts.items()
+        }
+        with self._lock:
+            self._entries = entries
+            self._alerts = {alert.item_id: alert for symbol_alerts in alerts.values() for alert in symbol_alerts}
+            self._item_id_sum = sum(self._alerts)
+            self._price_sum = sum((alert.alert_price for alert in self._alerts.values()), Decimal(0))
+            self._loaded = True
+
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def signature(self) -> Tuple[int, int, Decimal]:
+        with self._lock:
+            return len(self._alerts), self._item_id_sum, self._price_sum.quantize(CENT)
+
+    def set(self, alert: PriceAlert):
+        with self._lock:
+            self._remove(alert.item_id)
+            insort(self._entries.setdefault(alert.stock_symbol, []), (float(alert.alert_price), alert.item_id))
+            self._alerts[alert.item_id] = alert
+            self._item_id_sum += alert.item_id
+            self._price_sum += alert.alert_price
+
+    def remove(self, item_id: int):
+        with self._lock:
+            self._remove(item_id)
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return [symbol for symbol, entries in self._entries.items() if entries]
+
+    def between(self, symbol: str, low: float, high: float) -> List[PriceAlert]:
+        """Alerts of the symbol with an alert price in [low, high]."""
+        with self._lock:
+            entries = self._entries.get(symbol)
+            if not entries:
+                return []
+            start = bisect_left(entries, (low, -1))
+            end = bisect_right(entries, (high, float("inf")), lo=start)
+            return [self._alerts[item_id] for _, item_id in entries[start:end]]
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    def _remove(self, item_id: int):
+        alert = self._alerts.pop(item_id, None)
+        if alert is None:
+            return
+        self._item_id_sum -= item_id
+        self._price_sum -= alert.alert_price
+        entries = self._entries[alert.stock_symbol]
+        position = bisect_left(entries, (float(alert.alert_price), item_id))
+        if position < len(entries) and entries[position][1] == item_id:
+            del entries[position]
+
+
+class PriceAlertEngine:
+    """
+    Checks the price alerts of the watchlist items once per tick. Alerts are loaded with their user in one
+    joined query into a sorted price index per symbol, each distinct symbol is priced once with batched quote
+    downloads, so the upstream cost of a tick grows with the distinct symbols and not with the alerts.
+    A new price only looks at the alerts inside its band or crossed since the previous price of the symbol.
+    The index follows the alert endpoints of this process, every tick compares its signature with the one of
+    the database rows (one aggregate query) and reloads it when another worker or process changed the alerts.
+    """
+
+    def __init__(self, batch_size: int = ALERT_QUOTE_BATCH_SIZE, band: Decimal = ALERT_PRICE_BAND):
+        self.batch_size = max(batch_size, 1)
+        self.band = band
+        self.index = AlertPriceIndex()
+        self._last_prices: Dict[str, Decimal] = {}
+        self._lock = threading.Lock()
+        self.ticks = 0
+        self.alerts_checked = 0
+        self.symbols_priced = 0
+        self.upstream_calls = 0
+        self.reloads = 0
+
+    def check(self, db: Session, market_data: MarketDataProvider) -> List[dict]:
+        """
+        Notifications of the alerts whose target is within the band of the current price of their stock
+        or between the previous price and the current one.
+        """
+        # a session kept between ticks would still read the snapshot of its first transaction (REPEATABLE READ),
+        # ending it here lets the signature and the reload see the alerts committed since then
+        db.rollback()
+        if not self.index.is_loaded() or self.index.signature() != self.load_signature(db):
+            self.index.load(self.load_alerts(db))
+            with self._lock:
+                self.reloads += 1
+        prices = self.get_prices(self.index.symbols(), market_data)
+
+        notifications = []
+        checked = 0
+        for symbol, price in prices.items():
+            with self._lock:
+                last_price = self._last_prices.get(symbol, price)
+                self._last_prices[symbol] = price
+            # the band around the price and the crossed range both contain the price, so one range covers both
+            low = min(price / (1 + self.band), last_price)
+            high = max(price / (1 - self.band), last_price)
+            # a little wider than needed, the exact check below decides
+            candidates = self.index.between(symbol, float(low) * (1 - 1e-9), float(high) * (1 + 1e-9))
+            checked += len(candidates)
+            for alert in candidates:
+                in_band = abs(price - alert.alert_price) / alert.alert_price <= self.band
+                crossed = min(price, last_price) <= alert.alert_price <= max(price, last_price)
+                if in_band or crossed:
+                    notifications.append(self._notification(alert, price, crossed=crossed and not in_band))
+
+        with self._lock:
+            self.ticks += 1
+            self.alerts_checked += checked
+            self.symbols_priced += len(prices)
+        return notifications
+
+    def set_alert(self, db: Session, item: WatchlistItem):
+        """Put the alert of the item in the index (or take it out if it has no alert price), after it is committed."""
+        if not self.index.is_loaded():
+            return  # the first check loads it from the database
+        if item.alert_price is None or item.alert_price <= 0:
+            self.index.remove(item.item_id)
+            return
+        watchlist = db.query(Watchlist.user_id).filter(Watchlist.watchlist_id == item.watchlist_id).first()
+        if watchlist is not None:
+            self.index.set(PriceAlert(item.item_id, watchlist.user_id, item.stock_symbol.upper(), Decimal(item.alert_price)))
+
+    def remove_alerts(self, item_ids: List[int]):
+        for item_id in item_ids:
+            self.index.remove(item_id)
+
+    def load_signature(self, db: Session) -> Tuple[int, int, Decimal]:
+        """(count, item id sum, alert price sum) of the alerts load_alerts would load."""
+        count, item_id_sum, price_sum = db.query(
+            func.count(WatchlistItem.item_id), func.sum(WatchlistItem.item_id), func.sum(WatchlistItem.alert_price)
+        ).join(Watchlist, Watchlist.watchlist_id == WatchlistItem.watchlist_id).filter(
+            WatchlistItem.alert_price.isnot(None), WatchlistItem.alert_price > 0
+        ).one()
+        return count, int(item_id_sum or 0), Decimal(str(price_sum or 0)).quantize(CENT)
+
+    def load_alerts(self, db: Session) -> Dict[str, List[PriceAlert]]:
+        """Symbol -> alerts of the watchlist items with an alert price, the user comes from the same query."""
+        rows = db.query(
+            WatchlistItem.item_id, WatchlistItem.stock_symbol, WatchlistItem.alert_price, Watchlist.user_id
+        ).join(Watchlist, Watchlist.watchlist_id == WatchlistItem.watchlist_id).filter(
+            WatchlistItem.alert_price.isnot(None), WatchlistItem.alert_price > 0
+        ).all()
+
+        alerts = defaultdict(list)
+        for row in rows:
+            symbol = row.stock_symbol.upper()
+            alerts[symbol].append(PriceAlert(row.item_id, row.user_id, symbol, Decimal(row.alert_price)))
+        return alerts
+
+    def get_prices(self, symbols: List[str], market_data: MarketDataProvider) -> Dict[str, Decimal]:
+        """
+        Current price of the symbols rounded to 2 decimals, symbols without a price are left out.
+        Quotes still fresh in the quote cache are used as they are, the rest come from batched downloads.
+        If the upstream is down the remaining batches are skipped until the next tick.
+        """
+        prices = {}
+        missing = []
+        for symbol in symbols:
+            info = quote_cache.get(symbol)
+            price = _round_price(info.get("currentPrice")) if info else None
+            if price is not None:
+                prices[symbol] = price
+            else:
+                missing.append(symbol)
+
+        for offset in range(0, len(missing), self.batch_size):
+            batch = missing[offset: offset + self.batch_size]
+            try:
+                with self._lock:
+                    self.upstream_calls += 1
+                # a few days so that there is a last close after a weekend or a holiday
+                closes = market_data.get_closes(batch, period="5d")
+            except UpstreamUnavailableError as e:
+                print(f"Price alert check stopped: {e}")
+                break
+            except Exception as e:
+                print(f"An error occurred while fetching stock prices for the alerts: {e}")
+                continue
+
+            for symbol in batch:
+                if symbol in closes.columns:
+                    symbol_closes = closes[symbol].dropna()
+                    price = _round_price(symbol_closes.iloc[-1]) if len(symbol_closes) > 0 else None
+                    if price is not None:
+                        prices[symbol] = price
+        return prices
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ticks": self.ticks,
+                "alerts_checked": self.alerts_checked,
+                "symbols_priced": self.symbols_priced,
+                "upstream_calls": self.upstream_calls,
+                "index_reloads": self.reloads,
+                "indexed_alerts": len(self.index),
+                "indexed_symbols": len(self.index.symbols()),
+            }
+
+    @staticmethod
+    def _notification(alert: PriceAlert, price: Decimal, crossed: bool = False) -> dict:
+        return {
+            "user_id": alert.user_id,
+            "item_id": alert.item_id,
+            "stock_symbol": alert.stock_symbol,
+            "target_price": alert.alert_price,
+            "current_price": price,
+            "crossed": crossed,  # the price went through the target since the last check but is not near it now
+        }
+
+
+def _round_price(price) -> Optional[Decimal]:
+    # take the 2 decimal, like the prices shown to the user, a missing, nan or infinite price is no price
+    if price is None or pd.isna(price) or not math.isfinite(float(price)):
+        return None
+    return Decimal("{:.2f}".format(float(price)))
+
+
+# Process wide alert engine of the background alert loop and the manual check endpoint
+price_alert_engine = PriceAlertEngine()
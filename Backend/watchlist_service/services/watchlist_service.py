@@ -4,8 +4,11 @@ from datetime import datetime, date
 from models.models import Watchlist, WatchlistItem, Stock, User
 from sqlalchemy.exc import SQLAlchemyError
 from decimal import Decimal
-import yfinance as yf
 from utils.websocket_manager import websocket_manager
+from utils.quote_cache import quote_cache
+from services.price_alert_engine import price_alert_engine
+from utils.market_data_provider import MarketDataProvider, market_data_provider
+from utils.upstream_guard import UnknownSymbolError, UpstreamUnavailableError
 
 
 # in the watchlist service we do not return detailed info of the stocks in the watchlist
@@ -13,8 +16,10 @@ from utils.websocket_manager import websocket_manager
 # current fiyata bakarak frontend de alert ler uygulayabiliriz mesela hissenin fiyatı x olursa alert the user gibi 
 class WatchlistService:
 
-    def __init__(self, db: Session):
+    # market data (yahoo finance by default) is injected so that the service can run offline in load tests
+    def __init__(self, db: Session, market_data: Optional[MarketDataProvider] = None):
         self.db = db
+        self.market_data = market_data or market_data_provider
 
     """
         class Watchlist(Base):
@@ -125,6 +130,7 @@ class WatchlistService:
         if item:
             self.db.delete(item)
             self.db.commit()
+            price_alert_engine.remove_alerts([item_id])
             return True
         return False
     
@@ -134,8 +140,10 @@ class WatchlistService:
         if not watchlist:
             raise ValueError(f"Watchlist with id {watchlist_id} does not exists")
         if watchlist:
+            item_ids = [item.item_id for item in watchlist.items]
             self.db.delete(watchlist)
             self.db.commit()
+            price_alert_engine.remove_alerts(item_ids)
             return True
         return False
     
@@ -151,6 +159,8 @@ class WatchlistService:
         item.alert_price = alert_price
         self.db.commit()
         self.db.refresh(item)
+        # the alert engine keeps its price index in memory, it is updated here instead of reloaded
+        price_alert_engine.set_alert(self.db, item)
         return item
 
     def remove_alert_price(self, item_id: int) -> WatchlistItem:
@@ -164,6 +174,7 @@ class WatchlistService:
         item.alert_price = None
         self.db.commit()
         self.db.refresh(item)
+        price_alert_engine.remove_alerts([item_id])
         return item
     
     # to learn the price of the stock in the watchlist
@@ -173,14 +184,17 @@ class WatchlistService:
         """
         try:
             stock_symbol = stock_symbol.upper()
-            # add .IS to the end of the stock symbol since yahoo finance excepts that
-            stock_symbol += ".IS"
-            stock = yf.Ticker(stock_symbol)
-            info = stock.info
+            # shared with the other requests and the alert loop through the quote cache
+            info = quote_cache.get_or_load(stock_symbol, lambda: self.market_data.get_info(stock_symbol))
             current_price = info.get("currentPrice", None)
             print(f"Current price of {stock_symbol}: {current_price}")
             # we need to return the price as decimal.Decimal
             return Decimal(current_price) if current_price is not None else None
+        except UpstreamUnavailableError:
+            raise
+        except UnknownSymbolError as e:
+            # the symbol is remembered as unknown, so this does not go upstream again for a while
+            print(f"Skipping price of {stock_symbol}: {e}")
         except Exception as e:
             print(f"An error occurred while fetching stock price: {e}")
     
@@ -194,31 +208,5 @@ class WatchlistService:
         Checks if any watchlist stocks are within 1% of their target price.
         Returns a list of notifications.
         """
-        watchlist_items = self.db.query(WatchlistItem).filter(WatchlistItem.alert_price.isnot(None)).all()
-        notifications = []
-
-        for item in watchlist_items:
-            current_price = self.get_current_stock_price(item.stock_symbol)
-            # take the 2 decimal 
-            current_price = "{:.2f}".format(current_price) if current_price is not None else None
-            current_price = Decimal(current_price)
-            
-            if current_price is None:
-                continue  # Skip if price is not available
-
-            print(f"Checking price alert for {item.stock_symbol}. Current price: {current_price}, Target price: {item.alert_price}")
-            
-            target_price = item.alert_price
-            if abs(current_price - target_price) / target_price <= 0.01:
-                watchlist = self.db.query(Watchlist).filter(Watchlist.watchlist_id == item.watchlist_id).first()
-                user_id = watchlist.user_id if watchlist else None
-                
-                if user_id:
-                    notifications.append({
-                        "user_id": user_id,
-                        "stock_symbol": item.stock_symbol,
-                        "target_price": target_price,
-                        "current_price": current_price
-                    })
-        
-        return notifications
\ No newline at end of file
+        # one joined query for the alerts and their users, one quote per distinct symbol
+        return price_alert_engine.check(self.db, self.market_data)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the service imports its packages from its own directory (from utils.x import ...), like when it is run with uvicorn
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
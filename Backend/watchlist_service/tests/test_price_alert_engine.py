@@ -0,0 +1,91 @@
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import services.watchlist_service as watchlist_service_module
+from models.models import Sector, Stock, User, Watchlist, WatchlistItem
+from services.price_alert_engine import PriceAlertEngine
+from services.watchlist_service import WatchlistService
+from utils.db_context import Base
+from utils.market_data_provider import MarketDataProvider
+
+
+class FixedPriceProvider(MarketDataProvider):
+    def __init__(self, prices: dict):
+        self.prices = prices
+
+    def get_info(self, symbol):
+        return {}
+
+    def get_quote(self, symbol):
+        return self.prices.get(symbol)
+
+    def get_history(self, symbol, start=None, end=None, period=None):
+        return pd.DataFrame()
+
+    def get_closes(self, symbols, start=None, end=None, period=None):
+        return pd.DataFrame({symbol: [self.prices[symbol]] for symbol in symbols if symbol in self.prices})
+
+    def get_quarterly_financials(self, symbol):
+        return pd.DataFrame()
+
+    def get_quarterly_balance_sheet(self, symbol):
+        return pd.DataFrame()
+
+    def get_quarterly_cashflow(self, symbol):
+        return pd.DataFrame()
+
+    def get_dividends(self, symbol):
+        return pd.Series(dtype=float)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # a file database in WAL mode with explicit BEGINs: a transaction reads one snapshot, like InnoDB REPEATABLE READ
+    engine = create_engine(f"sqlite:///{tmp_path / 'watchlist.db'}")
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_alert_set_through_the_service_survives_the_next_ticks(session_factory, monkeypatch):
+    alert_engine = PriceAlertEngine()
+    monkeypatch.setattr(watchlist_service_module, "price_alert_engine", alert_engine)
+    provider = FixedPriceProvider({"THYAO": 300.0, "AKBNK": 50.0})
+
+    seed = session_factory()
+    seed.add(User(user_id=1, username="investor", first_name="Ada", last_name="Investor", email="investor@example.com", password="x"))
+    seed.add(Sector(sector_id=1, name="Banking"))
+    seed.add_all([Stock(stock_symbol="THYAO", name="Turk Hava Yollari", sector_id=1),
+                  Stock(stock_symbol="AKBNK", name="Akbank", sector_id=1)])
+    seed.add(Watchlist(watchlist_id=1, user_id=1, name="Favourites"))
+    seed.add_all([WatchlistItem(item_id=1, watchlist_id=1, stock_symbol="AKBNK", alert_price=Decimal("50.00")),
+                  WatchlistItem(item_id=2, watchlist_id=1, stock_symbol="THYAO")])
+    seed.commit()
+    seed.close()
+
+    # the background loop keeps one session over the ticks
+    loop_db = session_factory()
+    assert [n["item_id"] for n in alert_engine.check(loop_db, provider)] == [1]
+
+    request_db = session_factory()
+    WatchlistService(request_db, provider).set_alert_price(2, Decimal("300.00"))
+    request_db.close()
+
+    for _ in range(2):
+        assert sorted(n["item_id"] for n in alert_engine.check(loop_db, provider)) == [1, 2]
+    assert len(alert_engine.index) == 2
+    loop_db.close()
@@ -0,0 +1,396 @@
+import json
+import os
+import time
+import zlib
+from abc import ABC, abstractmethod
+from datetime import date, timedelta
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from utils.rate_limiter import TokenBucketRateLimiter, market_data_rate_limiter
+from utils.upstream_guard import CircuitBreaker, NegativeCache, UnknownSymbolError, looks_like_unknown_symbol
+
+# which provider the services use: "yfinance" (default) or "local" for offline load tests and benchmarks
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "yfinance")
+# directory of recorded fixtures for the local provider, one sub directory per stock symbol
+MARKET_DATA_FIXTURES_DIR = os.getenv("MARKET_DATA_FIXTURES_DIR")
+# artificial latency of every local provider call, to mimic the upstream round trip
+MARKET_DATA_LATENCY_MS = float(os.getenv("MARKET_DATA_LATENCY_MS", "0"))
+
+
+class MarketDataProvider(ABC):
+    """
+    Source of market data for the services.
+    Symbols are given as they are stored in the db (e.g. THYAO), without the .IS suffix.
+    """
+
+    @abstractmethod
+    def get_info(self, symbol: str) -> dict:
+        """General info about a stock, same keys as yahoo finance Ticker.info"""
+
+    @abstractmethod
+    def get_quote(self, symbol: str) -> Optional[float]:
+        """Current price of a stock or None if it is not available"""
+
+    @abstractmethod
+    def get_history(self, symbol: str, start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        """Daily Open, High, Low, Close and Volume columns indexed by date"""
+
+    @abstractmethod
+    def get_closes(self, symbols: List[str], start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        """Daily close prices of many stocks, one column per stock symbol"""
+
+    @abstractmethod
+    def get_quarterly_financials(self, symbol: str) -> pd.DataFrame:
+        """Quarterly income statement, one column per quarter"""
+
+    @abstractmethod
+    def get_quarterly_balance_sheet(self, symbol: str) -> pd.DataFrame:
+        """Quarterly balance sheet, one column per quarter"""
+
+    @abstractmethod
+    def get_quarterly_cashflow(self, symbol: str) -> pd.DataFrame:
+        """Quarterly cash flow statement, one column per quarter"""
+
+    @abstractmethod
+    def get_dividends(self, symbol: str) -> pd.Series:
+        """Dividend amounts indexed by payment date"""
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Reads the market data from yahoo finance"""
+
+    # add .IS to the end of the stock symbol since yahoo finance excepts that
+    @staticmethod
+    def _ticker_symbol(symbol: str) -> str:
+        return symbol.upper() + ".IS"
+
+    def get_info(self, symbol: str) -> dict:
+        return yf.Ticker(self._ticker_symbol(symbol)).info
+
+    def get_quote(self, symbol: str) -> Optional[float]:
+        return self.get_info(symbol).get("currentPrice", None)
+
+    def get_history(self, symbol: str, start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        ticker = yf.Ticker(self._ticker_symbol(symbol))
+        if period is not None:
+            return ticker.history(period=period)
+        return ticker.history(start=start, end=end)
+
+    def get_closes(self, symbols: List[str], start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        tickers = [self._ticker_symbol(symbol) for symbol in symbols]
+        if period is not None:
+            data = yf.download(tickers, period=period, progress=False)
+        else:
+            data = yf.download(tickers, start=start, end=end, progress=False)
+        if data.empty:
+            return pd.DataFrame()
+
+        closes = data["Close"]
+        # older yfinance versions return a flat frame when there is only one ticker
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(name=tickers[0])
+        closes.columns = [str(column)[:-3] if str(column).endswith(".IS") else str(column) for column in closes.columns]
+        return closes
+
+    def get_quarterly_financials(self, symbol: str) -> pd.DataFrame:
+        return yf.Ticker(self._ticker_symbol(symbol)).quarterly_financials
+
+    def get_quarterly_balance_sheet(self, symbol: str) -> pd.DataFrame:
+        return yf.Ticker(self._ticker_symbol(symbol)).quarterly_balancesheet
+
+    def get_quarterly_cashflow(self, symbol: str) -> pd.DataFrame:
+        return yf.Ticker(self._ticker_symbol(symbol)).quarterly_cashflow
+
+    def get_dividends(self, symbol: str) -> pd.Series:
+        return yf.Ticker(self._ticker_symbol(symbol)).dividends
+
+
+class LocalMarketDataProvider(MarketDataProvider):
+    """
+    Offline provider for load tests and benchmarks.
+    It replays fixtures recorded with record_fixtures() when they exist for a symbol,
+    otherwise it generates synthetic data that is deterministic per symbol.
+    """
+
+    # line items that the services read from the statements
+    FINANCIAL_ITEMS = ["Total Revenue", "Gross Profit", "Operating Income", "Net Income", "Earnings Per Share"]
+    BALANCE_SHEET_ITEMS = [
+        "Total Assets", "Total Liabilities Net Minority Interest", "Ordinary Shares Number",
+        "Current Assets", "Current Liabilities"
+    ]
+    CASHFLOW_ITEMS = [
+        "Net Cash Provided by Operating Activities", "Net Cash Used for Investing Activities",
+        "Net Cash Used Provided by Financing Activities", "Free Cash Flow", "Capital Expenditure"
+    ]
+    HISTORY_YEARS = 10
+    QUARTERS = 8
+
+    def __init__(self, fixtures_dir: Optional[str] = None, latency_seconds: float = 0.0):
+        self.fixtures_dir = fixtures_dir
+        self.latency_seconds = latency_seconds
+
+    def get_info(self, symbol: str) -> dict:
+        self._simulate_latency()
+        symbol = symbol.upper()
+        fixture = self._fixture_path(symbol, "info.json")
+        if fixture:
+            with open(fixture) as f:
+                return json.load(f)
+
+        closes = self._synthetic_history(symbol)["Close"]
+        rng = self._rng(symbol, "info")
+        shares = int(rng.integers(50_000_000, 5_000_000_000))
+        return {
+            "symbol": symbol + ".IS",
+            "longName": f"{symbol} Synthetic A.S.",
+            "shortName": symbol,
+            "industry": "Synthetic",
+            "currency": "TRY",
+            "currentPrice": float(closes.iloc[-1]),
+            "previousClose": float(closes.iloc[-2]),
+            "marketCap": int(closes.iloc[-1] * shares),
+            "sharesOutstanding": shares,
+            "fiftyTwoWeekHigh": float(closes.iloc[-252:].max()),
+            "fiftyTwoWeekLow": float(closes.iloc[-252:].min()),
+        }
+
+    def get_quote(self, symbol: str) -> Optional[float]:
+        return self.get_info(symbol).get("currentPrice", None)
+
+    def get_history(self, symbol: str, start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        self._simulate_latency()
+        return self._slice(self._load_history(symbol.upper()), start, end, period)
+
+    def get_closes(self, symbols: List[str], start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        self._simulate_latency()
+        closes = {}
+        for symbol in symbols:
+            symbol = symbol.upper()
+            closes[symbol] = self._slice(self._load_history(symbol), start, end, period)["Close"]
+        return pd.DataFrame(closes)
+
+    def get_quarterly_financials(self, symbol: str) -> pd.DataFrame:
+        return self._statement(symbol, "financials.csv", self.FINANCIAL_ITEMS)
+
+    def get_quarterly_balance_sheet(self, symbol: str) -> pd.DataFrame:
+        return self._statement(symbol, "balance_sheet.csv", self.BALANCE_SHEET_ITEMS)
+
+    def get_quarterly_cashflow(self, symbol: str) -> pd.DataFrame:
+        return self._statement(symbol, "cashflow.csv", self.CASHFLOW_ITEMS)
+
+    def get_dividends(self, symbol: str) -> pd.Series:
+        self._simulate_latency()
+        symbol = symbol.upper()
+        fixture = self._fixture_path(symbol, "dividends.csv")
+        if fixture:
+            return pd.read_csv(fixture, index_col=0, parse_dates=True).iloc[:, 0]
+
+        # one dividend per year, paid at the end of may
+        rng = self._rng(symbol, "dividends")
+        closes = self._synthetic_history(symbol)["Close"]
+        payment_dates = [pd.Timestamp(year, 5, 31) for year in range(closes.index[0].year, closes.index[-1].year + 1)]
+        payment_dates = [d for d in payment_dates if closes.index[0] <= d <= closes.index[-1]]
+        prices = closes.asof(pd.DatetimeIndex(payment_dates)).to_numpy()
+        amounts = np.round(prices * rng.uniform(0.01, 0.05, len(payment_dates)), 2)
+        return pd.Series(amounts, index=pd.DatetimeIndex(payment_dates, name="Date"), name="Dividends")
+
+    def _simulate_latency(self):
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+    def _fixture_path(self, symbol: str, file_name: str) -> Optional[str]:
+        if not self.fixtures_dir:
+            return None
+        path = os.path.join(self.fixtures_dir, symbol, file_name)
+        return path if os.path.exists(path) else None
+
+    def _load_history(self, symbol: str) -> pd.DataFrame:
+        fixture = self._fixture_path(symbol, "history.csv")
+        if fixture:
+            return pd.read_csv(fixture, index_col=0, parse_dates=True)
+        return self._synthetic_history(symbol)
+
+    # random generator that gives the same numbers for the same symbol in every run
+    @staticmethod
+    def _rng(symbol: str, purpose: str) -> np.random.Generator:
+        return np.random.default_rng(zlib.crc32(f"{symbol}:{purpose}".encode()))
+
+    def _synthetic_history(self, symbol: str) -> pd.DataFrame:
+        end = pd.Timestamp(date.today())
+        index = pd.bdate_range(end=end, periods=self.HISTORY_YEARS * 252, name="Date")
+        rng = self._rng(symbol, "history")
+
+        # geometric brownian motion with a per symbol drift and volatility
+        drift = rng.uniform(0.0, 0.0008)
+        volatility = rng.uniform(0.01, 0.03)
+        log_returns = rng.normal(drift - volatility ** 2 / 2, volatility, len(index))
+        close = rng.uniform(5, 500) * np.exp(np.cumsum(log_returns))
+        open_ = close * np.exp(rng.normal(0, volatility / 4, len(index)))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, len(index))))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, len(index))))
+        volume = rng.integers(100_000, 10_000_000, len(index))
+
+        return pd.DataFrame(
+            {"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume},
+            index=index
+        )
+
+    @staticmethod
+    def _slice(history: pd.DataFrame, start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        if period is not None:
+            if period == "max":
+                return history
+            # periods like 5d, 1mo, 1y, 5y as in yahoo finance
+            amount = int("".join(c for c in period if c.isdigit()))
+            unit = "".join(c for c in period if not c.isdigit())
+            days = {"d": 1, "wk": 7, "mo": 30, "y": 365}[unit] * amount
+            return history[history.index >= history.index[-1] - timedelta(days=days)]
+
+        if start is not None:
+            history = history[history.index >= pd.Timestamp(start)]
+        if end is not None:
+            # end is exclusive as in yahoo finance
+            history = history[history.index < pd.Timestamp(end)]
+        return history
+
+    def _statement(self, symbol: str, file_name: str, items: List[str]) -> pd.DataFrame:
+        self._simulate_latency()
+        symbol = symbol.upper()
+        fixture = self._fixture_path(symbol, file_name)
+        if fixture:
+            statement = pd.read_csv(fixture, index_col=0)
+            statement.columns = pd.to_datetime(statement.columns)
+            return statement
+
+        rng = self._rng(symbol, file_name)
+        quarters = pd.date_range(end=pd.Timestamp(date.today()), periods=self.QUARTERS, freq="QE")[::-1]
+        base = rng.uniform(1e8, 1e11)
+        values = base * rng.uniform(0.05, 1.0, (len(items), len(quarters)))
+        # negative items like capital expenditures and investing cash flows
+        signs = np.where([("Invest" in item or "Capital" in item) for item in items], -1.0, 1.0)
+        statement = pd.DataFrame(values * signs[:, None], index=items, columns=quarters)
+        if "Earnings Per Share" in statement.index:
+            statement.loc["Earnings Per Share"] = rng.uniform(0.1, 50.0, len(quarters))
+        return statement
+
+
+def record_fixtures(symbols: List[str], fixtures_dir: str, source: Optional[MarketDataProvider] = None):
+    """
+    Record the market data of the given symbols from the source provider (yahoo finance by default)
+    so that LocalMarketDataProvider can replay it later without network access.
+    """
+    source = source or YFinanceProvider()
+    for symbol in symbols:
+        symbol = symbol.upper()
+        symbol_dir = os.path.join(fixtures_dir, symbol)
+        os.makedirs(symbol_dir, exist_ok=True)
+
+        with open(os.path.join(symbol_dir, "info.json"), "w") as f:
+            json.dump(source.get_info(symbol), f, default=str)
+
+        history = source.get_history(symbol, period="max")
+        history.index = history.index.tz_localize(None) if history.index.tz is not None else history.index
+        history.to_csv(os.path.join(symbol_dir, "history.csv"))
+
+        source.get_quarterly_financials(symbol).to_csv(os.path.join(symbol_dir, "financials.csv"))
+        source.get_quarterly_balance_sheet(symbol).to_csv(os.path.join(symbol_dir, "balance_sheet.csv"))
+        source.get_quarterly_cashflow(symbol).to_csv(os.path.join(symbol_dir, "cashflow.csv"))
+
+        dividends = source.get_dividends(symbol)
+        dividends.index = dividends.index.tz_localize(None) if dividends.index.tz is not None else dividends.index
+        dividends.to_csv(os.path.join(symbol_dir, "dividends.csv"))
+        print(f"Market data fixtures for {symbol} recorded to {symbol_dir}")
+
+
+class GuardedMarketDataProvider(MarketDataProvider):
+    """
+    Wraps a provider with a global circuit breaker, a negative cache of unknown symbols and the shared rate limiter.
+    While the upstream is failing, calls raise UpstreamUnavailableError right away instead of waiting for timeouts,
+    and symbols the upstream does not know raise UnknownSymbolError without another round trip.
+    """
+
+    def __init__(self, provider: MarketDataProvider, breaker: Optional[CircuitBreaker] = None,
+                 negative_cache: Optional[NegativeCache] = None, rate_limiter: Optional[TokenBucketRateLimiter] = None):
+        self.provider = provider
+        self.breaker = breaker or CircuitBreaker()
+        self.negative_cache = negative_cache or NegativeCache()
+        self.rate_limiter = rate_limiter or market_data_rate_limiter
+
+    def get_info(self, symbol: str) -> dict:
+        # yahoo finance answers unknown symbols with an (almost) empty info dict
+        return self._call(symbol, lambda: self.provider.get_info(symbol),
+                          is_missing=lambda info: not info or all(info.get(key) is None for key in ("symbol", "currentPrice", "previousClose")))
+
+    def get_quote(self, symbol: str) -> Optional[float]:
+        return self._call(symbol, lambda: self.provider.get_quote(symbol))
+
+    def get_history(self, symbol: str, start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        # only an empty full history means the symbol is unknown, a short range can be empty on holidays
+        return self._call(symbol, lambda: self.provider.get_history(symbol, start=start, end=end, period=period),
+                          is_missing=lambda history: period == "max" and history.empty)
+
+    def get_closes(self, symbols: List[str], start=None, end=None, period: Optional[str] = None) -> pd.DataFrame:
+        symbols = [symbol for symbol in symbols if not self.negative_cache.contains(symbol)]
+        if not symbols:
+            return pd.DataFrame()
+        return self._call(None, lambda: self.provider.get_closes(symbols, start=start, end=end, period=period))
+
+    def get_quarterly_financials(self, symbol: str) -> pd.DataFrame:
+        return self._call(symbol, lambda: self.provider.get_quarterly_financials(symbol))
+
+    def get_quarterly_balance_sheet(self, symbol: str) -> pd.DataFrame:
+        return self._call(symbol, lambda: self.provider.get_quarterly_balance_sheet(symbol))
+
+    def get_quarterly_cashflow(self, symbol: str) -> pd.DataFrame:
+        return self._call(symbol, lambda: self.provider.get_quarterly_cashflow(symbol))
+
+    def get_dividends(self, symbol: str) -> pd.Series:
+        return self._call(symbol, lambda: self.provider.get_dividends(symbol))
+
+    def stats(self) -> dict:
+        return {
+            "circuit_breaker": self.breaker.stats(),
+            "unknown_symbols": self.negative_cache.stats(),
+            "rate_limiter": self.rate_limiter.stats(),
+        }
+
+    def _call(self, symbol: Optional[str], fetch: Callable, is_missing: Optional[Callable] = None):
+        if symbol is not None:
+            self.negative_cache.check(symbol)
+        self.breaker.before_call()
+        try:
+            self.rate_limiter.acquire()
+        except BaseException:
+            # nothing went upstream, a half open breaker must not wait for this probe forever
+            self.breaker.cancel_call()
+            raise
+        try:
+            result = fetch()
+        except Exception as e:
+            if symbol is not None and looks_like_unknown_symbol(e):
+                # the upstream did answer, only the symbol is wrong
+                self.breaker.record_success()
+                self.negative_cache.add(symbol, str(e))
+                raise UnknownSymbolError(f"No market data found for {symbol.upper()}: {e}") from e
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        if is_missing is not None and is_missing(result):
+            self.negative_cache.add(symbol, "the symbol may be delisted")
+            raise UnknownSymbolError(f"No market data found for {symbol.upper()}, the symbol may be delisted")
+        return result
+
+
+def create_market_data_provider() -> MarketDataProvider:
+    if MARKET_DATA_PROVIDER == "local":
+        return GuardedMarketDataProvider(LocalMarketDataProvider(MARKET_DATA_FIXTURES_DIR, MARKET_DATA_LATENCY_MS / 1000))
+    return GuardedMarketDataProvider(YFinanceProvider())
+
+
+# Process wide provider that the services use unless another one is injected
+market_data_provider = create_market_data_provider()
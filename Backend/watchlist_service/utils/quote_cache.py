@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# how long a quote is considered fresh and how many symbols we keep in memory
+QUOTE_CACHE_TTL_SECONDS = float(os.getenv("QUOTE_CACHE_TTL_SECONDS", "30"))
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv("QUOTE_CACHE_MAX_ENTRIES", "1024"))
+
+# stock info pages: fresh for the soft ttl, then served stale and refreshed in the background until the hard ttl
+INFO_CACHE_SOFT_TTL_SECONDS = float(os.getenv("INFO_CACHE_SOFT_TTL_SECONDS", "60"))
+INFO_CACHE_HARD_TTL_SECONDS = float(os.getenv("INFO_CACHE_HARD_TTL_SECONDS", "3600"))
+
+
+# one upstream call that is currently running, other threads wait on its event
+class _InFlightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class QuoteCache:
+    """
+    Thread safe TTL cache with LRU eviction and single-flight loading.
+    Concurrent lookups of the same key share one call of the loader.
+    With a hard_ttl_seconds above ttl_seconds, get_or_load_stale serves expired entries until the hard ttl
+    while they are reloaded in the background.
+    """
+
+    def __init__(self, ttl_seconds: float = QUOTE_CACHE_TTL_SECONDS, max_entries: int = QUOTE_CACHE_MAX_ENTRIES,
+                 hard_ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds
+        self.hard_ttl_seconds = max(ttl_seconds, hard_ttl_seconds or 0.0)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, stored_at)
+        self._in_flight: Dict[str, _InFlightCall] = {}
+        self._lock = threading.Lock()
+
+        # counters to tune the ttl and the size under load
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.coalesced = 0  # lookups that waited for another thread's upstream call
+        self.evictions = 0
+        self.stale_hits = 0  # expired entries served while they were refreshed
+        self.refresh_errors = 0
+
+        self._refresh_executor: Optional[ThreadPoolExecutor] = None  # created on the first background refresh
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value if it is still fresh, otherwise None."""
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key: Optional[str] = None):
+        """Drop one key or, if no key is given, the whole cache."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for the key or call the loader to fetch it.
+        Only one loader runs per key at a time, the others wait for its result.
+        None results and exceptions are not cached.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._in_flight[key] = call
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        return self._run_loader(key, call, loader)
+
+    def get_or_load_stale(self, key: str, loader: Callable[[], Any]) -> Tuple[Any, float]:
+        """
+        Stale-while-revalidate lookup, returns the value and its age in seconds.
+        A fresh entry is returned as is. An entry past the ttl but not past the hard ttl is returned right away
+        and reloaded in the background. Only a missing or hard expired entry waits for the loader.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = time.monotonic() - stored_at
+                if age < self.hard_ttl_seconds:
+                    self._entries.move_to_end(key)
+                    if age < self.ttl_seconds:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                        if key not in self._in_flight:
+                            call = _InFlightCall()
+                            self._in_flight[key] = call
+                            self._get_refresh_executor().submit(self._refresh, key, call, loader)
+                    return value, age
+
+        return self.get_or_load(key, loader), 0.0
+
+    def _refresh(self, key: str, call: _InFlightCall, loader: Callable[[], Any]):
+        try:
+            self._run_loader(key, call, loader)
+        except Exception as e:
+            # keep serving the stale entry, the next lookup tries again
+            with self._lock:
+                self.refresh_errors += 1
+            print(f"An error occurred while refreshing the cached value of {key}: {e}")
+
+    def _run_loader(self, key: str, call: _InFlightCall, loader: Callable[[], Any]) -> Any:
+        try:
+            call.value = loader()
+            if call.value is not None:
+                self.set(key, call.value)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.event.set()
+        return call.value
+
+    def _get_refresh_executor(self) -> ThreadPoolExecutor:
+        if self._refresh_executor is None:
+            self._refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+        return self._refresh_executor
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.expired
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "stale_hits": self.stale_hits,
+                "refresh_errors": self.refresh_errors,
+                "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hard_ttl_seconds": self.hard_ttl_seconds,
+            }
+
+    # following helpers expect the lock to be held by the caller
+    def _lookup(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, stored_at = entry
+        age = time.monotonic() - stored_at
+        if age >= self.ttl_seconds:
+            # entries that can still be served stale are kept for get_or_load_stale
+            if age >= self.hard_ttl_seconds:
+                del self._entries[key]
+            self.expired += 1
+            return None
+
+        self._entries.move_to_end(key)  # mark as recently used
+        self.hits += 1
+        return value
+
+    def _store(self, key: str, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)  # least recently used
+            self.evictions += 1
+
+
+# Process wide cache of stock info dicts, keyed by the stock symbol (e.g. THYAO)
+quote_cache = QuoteCache()
+
+# Process wide stale-while-revalidate cache of the stock info pages, keyed by the stock symbol
+info_cache = QuoteCache(INFO_CACHE_SOFT_TTL_SECONDS, QUOTE_CACHE_MAX_ENTRIES, hard_ttl_seconds=INFO_CACHE_HARD_TTL_SECONDS)
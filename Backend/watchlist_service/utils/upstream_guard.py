@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# consecutive upstream failures that open the breaker and how long it stays open before a probe call
+MARKET_DATA_BREAKER_FAILURES = int(os.getenv("MARKET_DATA_BREAKER_FAILURES", "5"))
+MARKET_DATA_BREAKER_RESET_SECONDS = float(os.getenv("MARKET_DATA_BREAKER_RESET_SECONDS", "30"))
+# how long an unknown or delisted symbol is answered from memory
+MARKET_DATA_NEGATIVE_CACHE_SECONDS = float(os.getenv("MARKET_DATA_NEGATIVE_CACHE_SECONDS", "900"))
+
+
+class UpstreamUnavailableError(Exception):
+    """The market data upstream is failing and calls are rejected until the breaker lets a probe through."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UnknownSymbolError(ValueError):
+    """The upstream has no data for the symbol, e.g. it is mistyped or delisted."""
+
+
+class CircuitBreaker:
+    """
+    Global breaker of the upstream calls.
+    closed: calls go through, failure_threshold consecutive failures open the breaker
+    open: calls fail right away with UpstreamUnavailableError for reset_seconds
+    half_open: one probe call goes through, its success closes the breaker and its failure opens it again
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = MARKET_DATA_BREAKER_FAILURES,
+                 reset_seconds: float = MARKET_DATA_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.times_opened = 0
+        self._probe_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise UpstreamUnavailableError if the call may not go upstream now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_running:
+                self._probe_running = True  # this call is the probe
+                return
+
+            self.rejected += 1
+            raise UpstreamUnavailableError(
+                "Market data upstream is unavailable, please try again later",
+                retry_after=max(remaining, 1.0)
+            )
+
+    def cancel_call(self):
+        """The call allowed by before_call did not go upstream (e.g. rate limited), a probe slot is given back."""
+        with self._lock:
+            self._probe_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    print(f"Market data circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_running = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "failure_threshold": self.failure_threshold,
+                "reset_seconds": self.reset_seconds,
+            }
+
+
+class NegativeCache:
+    """Symbols the upstream does not know, so that they are not asked for again until the ttl passes."""
+
+    def __init__(self, ttl_seconds: float = MARKET_DATA_NEGATIVE_CACHE_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, tuple] = {}  # symbol -> (reason, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def add(self, symbol: str, reason: str):
+        with self._lock:
+            self._entries[symbol.upper()] = (reason, time.monotonic() + self.ttl_seconds)
+
+    def check(self, symbol: str):
+        """Raise UnknownSymbolError if the symbol is known to be missing upstream."""
+        reason = self._get(symbol.upper())
+        if reason is not None:
+            raise UnknownSymbolError(f"No market data found for {symbol.upper()}: {reason}")
+
+    def contains(self, symbol: str) -> bool:
+        return self._get(symbol.upper()) is not None
+
+    def _get(self, symbol: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is None:
+                return None
+            reason, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[symbol]
+                return None
+            self.hits += 1
+            return reason
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "symbols": sorted(symbol for symbol, (_, expires_at) in self._entries.items() if expires_at > now),
+                "hits": self.hits,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+# errors of yahoo finance that mean the symbol does not exist rather than an upstream failure
+def looks_like_unknown_symbol(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(text in message for text in ("404", "not found", "delisted", "no data found", "no timezone found"))
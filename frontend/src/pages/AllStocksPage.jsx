@@ -168,25 +168,32 @@ const AllStocksPage = () => {
         const fetchStocksData = async () => {
             try {
                 setLoading(true);
-                const allStocks = await stockService.getAllStocksDetailed();
+                // details and the period returns of all stocks, the returns come in one batch call
+                const [allStocks, periodReturns] = await Promise.all([
+                    stockService.getAllStocksDetailed(),
+                    stockService.getPeriodReturns()
+                ]);
 
-                const stocksWithDetails = await Promise.all(
-                    allStocks.map(async (stock) => {
-                        const stockPrices = await stockService.getStockPriceInPredefinedDateRange(stock.stock_symbol);
-                        return {
-                            ...stock,
-                            market_cap: stock.sharesOutstanding * stock.currentPrice,
-                            regularMarketChangePercent: ((stock.currentPrice / stock.previousClose) - 1) * 100,
-                            prices: stockPrices,
-                            '1_week': calculatePercentageChange(stockPrices, 7),
-                            '1_month': calculatePercentageChange(stockPrices, 30),
-                            '3_months': calculatePercentageChange(stockPrices, 90),
-                            '1_year': calculatePercentageChange(stockPrices, 365),
-                            '3_years': calculatePercentageChange(stockPrices, 3 * 365),
-                            '5_years': calculatePercentageChange(stockPrices, 5 * 365)
-                        };
-                    })
-                );
+                const periodsMap = {};
+                periodReturns.forEach((row) => {
+                    periodsMap[row.stock_symbol] = row.periods;
+                });
+                const periodReturn = (periods, key) => periods[key]?.return_pct ?? 0;
+
+                const stocksWithDetails = allStocks.map((stock) => {
+                    const periods = periodsMap[stock.stock_symbol] || {};
+                    return {
+                        ...stock,
+                        market_cap: stock.sharesOutstanding * stock.currentPrice,
+                        regularMarketChangePercent: ((stock.currentPrice / stock.previousClose) - 1) * 100,
+                        '1_week': periodReturn(periods, '1W'),
+                        '1_month': periodReturn(periods, '1M'),
+                        '3_months': periodReturn(periods, '3M'),
+                        '1_year': periodReturn(periods, '1Y'),
+                        '3_years': periodReturn(periods, '3Y'),
+                        '5_years': periodReturn(periods, '5Y')
+                    };
+                });
                 
                 // stock info coming from backend + calculated fields (market cap, day change %, etc.)
                 setStocks(stocksWithDetails);
@@ -204,67 +211,6 @@ const AllStocksPage = () => {
     }, []);
 
 
-    // days input unu alıcak ve prices alıcak = ve percentage change hesaplayacak
-    const calculatePercentageChange = (prices, days) => {
-        if (!prices || prices.length < 2) return 0;
-
-        /*
-            example prices in the stocksWithDetails array:
-            prices[0] = today stock price response
-            prices[1] = one week before stock price response
-            ...
-                [
-            {
-                "stock_symbol": "aghol",
-                "date": "2025-01-24",
-                "close_price": "315.0"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2025-01-17",
-                "close_price": "309.0"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2024-12-26",
-                "close_price": "363.0"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2024-10-28",
-                "close_price": "287.5"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2024-07-29",
-                "close_price": "427.25"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2024-01-26",
-                "close_price": "227.0554656982422"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2022-01-26",
-                "close_price": "33.286109924316406"
-            },
-            {
-                "stock_symbol": "aghol",
-                "date": "2020-01-27",
-                "close_price": "19.25945472717285"
-            }
-            ]
-            */
-        if (days == 7) return ((prices[0].close_price - prices[1].close_price) / prices[1].close_price) * 100;
-        if (days == 30) return ((prices[0].close_price - prices[2].close_price) / prices[2].close_price) * 100;
-        if (days == 90) return ((prices[0].close_price - prices[3].close_price) / prices[3].close_price) * 100;
-        if (days == 365) return ((prices[0].close_price - prices[4].close_price) / prices[5].close_price) * 100;
-        if (days == 3*365) return ((prices[0].close_price - prices[6].close_price) / prices[6].close_price) * 100;
-        if (days == 5*365) return ((prices[0].close_price - prices[7].close_price) / prices[7].close_price) * 100;
-        else return 0;
-    };   
-
     // Apply the filters to the stocks array and update the columns based on the filters
     const applyFilters = () => {
       const filtered = stocks.filter(stock => {
@@ -87,44 +87,29 @@ const PortfolioPage = ({ match }) => {
 
     const fetchPortfolioData = async () => {
         try {
-            const portfolioData = await portfolioService.getPortfolio(portfolioId);
+            // portfolio info and its valuation (prices, profit / loss and sectors of all holdings) with two requests
+            const [portfolioData, valuation] = await Promise.all([
+                portfolioService.getPortfolio(portfolioId),
+                portfolioService.getPortfolioValuation(portfolioId)
+            ]);
             setPortfolio(portfolioData);
 
-            const allSectors = await stockService.getAllSectors();
             const sectorMapping = {};
-            allSectors.forEach((sector) => {
-                sectorMapping[sector.sector_id] = sector.name;
+            valuation.sectors.forEach((sector) => {
+                sectorMapping[sector.sector_id] = sector.sector;
             });
             setSectorMap(sectorMapping);
 
-            const holdingsData = await portfolioService.getPortfolioHoldings(portfolioId);
-
-            const enhancedHoldings = await Promise.all(
-                holdingsData.map(async (holding) => {
-                    const stockPriceInfo = await stockService.getStockPrice(holding.stock_symbol);
-                    const SectorData = await stockService.getSectorOfStock(holding.stock_symbol);
-
-                    const currentMarketPrice = Number(stockPriceInfo.close_price);
-                    const marketValue = currentMarketPrice * holding.quantity;
-                    const profitLoss = (currentMarketPrice - holding.average_price) * holding.quantity;
-                    const profitLossPercentage = ((currentMarketPrice - holding.average_price) / holding.average_price) * 100;
-
-                    return {
-                        ...holding,
-                        currentMarketPrice,
-                        marketValue,
-                        profitLoss,
-                        profitLossPercentage,
-                        sector: sectorMapping[SectorData.sector_id]
-                    };
-                })
-            );
+            const enhancedHoldings = valuation.holdings.map((holding) => ({
+                ...holding,
+                currentMarketPrice: holding.last_price,
+                marketValue: holding.market_value ?? 0,
+                profitLoss: holding.unrealized_pl ?? 0,
+                profitLossPercentage: holding.unrealized_pl_pct ?? 0
+            }));
 
-            const totalPortfolioValue = enhancedHoldings.reduce((sum, holding) => sum + holding.marketValue, 0);
-            const totalPortfolioProfit = enhancedHoldings.reduce((sum, holding) => sum + holding.profitLoss, 0);
-            
-            setTotalValue(totalPortfolioValue);
-            setTotalProfit(totalPortfolioProfit);
+            setTotalValue(valuation.total_market_value);
+            setTotalProfit(valuation.total_unrealized_pl);
             setHoldings(enhancedHoldings);
 
             const uniqueSectors = [...new Set(enhancedHoldings.map((holding) => holding.sector))];
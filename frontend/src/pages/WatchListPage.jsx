@@ -68,20 +68,22 @@ const WatchlistPage = () => {
 
       const stocksData = await watchListService.getWatchlistItems(watchlistId);
       
-      // Enhance stocks data with current prices
-      const enhancedStocks = await Promise.all(
-        stocksData.map(async (stock) => {
-          console.log(stock);
-          const priceInfo = await stockService.getStockPrice(stock.stock_symbol);
-          const sectorInfo = await stockService.getSectorOfStock(stock.stock_symbol);
-          return {
-            ...stock,
-            currentPrice: Number(priceInfo.close_price),
-            alert_price: stock.alert_price ? Number(stock.alert_price) : null, // Convert to number
-            sector: sectorInfo.name
-          };
-        })
-      );
+      // Enhance stocks data with current prices, one request for all stocks
+      const quotes = await stockService.getQuotes(stocksData.map((stock) => stock.stock_symbol));
+      const quoteMap = {};
+      quotes.forEach((quote) => {
+        quoteMap[quote.stock_symbol] = quote;
+      });
+
+      const enhancedStocks = stocksData.map((stock) => {
+        const quote = quoteMap[stock.stock_symbol.toUpperCase()] || {};
+        return {
+          ...stock,
+          currentPrice: Number(quote.last_price),
+          alert_price: stock.alert_price ? Number(stock.alert_price) : null, // Convert to number
+          sector: quote.sector
+        };
+      });
       /* 
       not: Mysql decimal objeyi string olarak tutuyor. Bu nedenle her ne kadar decimal olarak yani bir number
       olarak backend e atıp db ye eklesek de o bize dönüşte string olarak gelicek. Bu nedenele alert_price
@@ -4,6 +4,7 @@ import axios from 'axios';
 Note that:
     - from the backend, we receive the average bought price of each holding, not the current price.
     - for this, we use stock service and for kar zarar calculations, we do these in the frontend side.
+    - getPortfolioValuation returns the current prices and kar zarar of all holdings computed by the backend.
 */
 class PortfolioService {
     constructor() {
@@ -38,6 +39,14 @@ class PortfolioService {
         return response.data;
     }
 
+    // to return the market value, profit / loss and weights of the holdings and sectors, computed by the backend
+    // example url: http://localhost:8001/api/stocks/portfolios/1/valuation
+    async getPortfolioValuation(portfolioId) {
+        if (!portfolioId) throw new Error('Portfolio ID is required');
+        const response = await axios.get(`${this.apiURL}/portfolios/${portfolioId}/valuation`);
+        return response.data;
+    }
+
     // to add a holding to a portfolio with the given id
     /*
         example request url: http://localhost:8001/api/stocks/portfolios/1/add/holdings
@@ -56,6 +65,21 @@ class PortfolioService {
         return response.data;
     }
 
+    // to apply many buy / sell / delete operations (e.g. the lines of a brokerage statement) with one request
+    /*
+        example request url: http://localhost:8001/api/stocks/portfolios/1/holdings/batch
+        example operations: [{op: "buy", symbol: "ORGE", quantity: 10, price: 120}, {op: "delete", symbol: "THYAO"}]
+        the response has the result of every operation, failed ones are skipped unless allOrNothing is set
+    */
+    async applyHoldingOperations(portfolioId, operations, allOrNothing = false) {
+        if (!portfolioId) throw new Error('Portfolio ID is required');
+        const response = await axios.post(`${this.apiURL}/portfolios/${portfolioId}/holdings/batch`, {
+            operations,
+            all_or_nothing: allOrNothing
+        });
+        return response.data;
+    }
+
     // to decrease the quantity of a holding in a portfolio with the given holding id, but not delete
     async decreaseHolding(holdingId, quantity) {
         const response = await axios.put(`${this.apiURL}/portfolios/holdings/decrease/${holdingId}`, {
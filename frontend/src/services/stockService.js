@@ -153,6 +153,30 @@ const stockService = {
     }
   },
 
+  // to fetch the last price, previous close and sector of many stocks with one request
+  // requested url: http://localhost:8001/api/stocks/quotes
+  // requested body: { "symbols": ["AGHOL", "THYAO"] }
+  /*
+    example response:
+    [
+      {
+        "stock_symbol": "AGHOL",
+        "last_price": 315.0,
+        "previous_close": 313.25,
+        "sector_id": 1,
+        "sector": "Conglomerates"
+      }
+    ]
+  */
+  getQuotes: async (symbols) => {
+    try {
+      const response = await axios.post(`${API_BASE_URL}/quotes`, { symbols });
+      return response.data;
+    } catch (error) {
+      throw error.response.data;
+    }
+  },
+
   // example url: http://localhost:8001/api/stocks/sector/aghol
   // example response: { "name": "Conglomerates", "sector_id": 1}
   getSectorOfStock: async (symbol) => {
@@ -231,6 +255,31 @@ const stockService = {
     }
   },
 
+  // price points and returns of 1W/1M/3M/6M/1Y/3Y/5Y for many stocks in one call, all stocks if symbols is not given
+  /*
+    example response:
+    [
+      {
+        "stock_symbol": "AGHOL",
+        "date": "2025-01-24",
+        "close_price": 315.0,
+        "periods": {
+          "1W": { "date": "2025-01-17", "close_price": 309.0, "return_pct": 1.94 },
+          ...
+          "5Y": { "date": "2020-01-27", "close_price": 19.26, "return_pct": 1535.57 }
+        }
+      }
+    ]
+  */
+  getPeriodReturns: async (symbols = null) => {
+    try {
+      const response = await axios.post(`${API_BASE_URL}/period-returns`, { symbols });
+      return response.data;
+    } catch (error) {
+      throw error.response.data;
+    }
+  },
+
   getFinancialData: async (symbol) => {
     try {
       const response = await axios.get(`${API_BASE_URL}/financials/${symbol}`);